@@ -0,0 +1,300 @@
+"""
+Buffered audit log sink
+- Audit entries are queued in memory and written in batches by a
+  background thread, so recording one costs a deque append
+- Pluggable destinations: stdout JSON lines (CloudWatch Logs), one S3
+  object per tenant and batch, or a local file
+- Per-action modes: drop an action, keep it only in the request's
+  in-memory trail, buffer it, or write it immediately
+
+Lambda freezes the container when the handler returns, so the
+background thread and atexit cannot be relied on there: the handlers
+call flush_audit() before returning, writing each request's entries in
+one batch. Guardrail violations default to "immediate".
+
+Configuration:
+    AUDIT_DESTINATIONS=stdout,s3,file
+    AUDIT_ACTIONS='{"guardrail_warning": "buffered", "retrieval_start": "off"}'
+"""
+
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import boto3
+
+logger = logging.getLogger()
+
+s3 = boto3.client("s3")
+
+# Comma-separated destinations: stdout, s3, file
+AUDIT_DESTINATIONS = os.environ.get("AUDIT_DESTINATIONS", "stdout")
+AUDIT_BUCKET = os.environ.get("AUDIT_BUCKET") or os.environ.get("VECTOR_BUCKET")
+AUDIT_FILE = os.environ.get("AUDIT_FILE", "audit.log")
+
+# Entries per write, seconds between background flushes, and entries
+# kept in memory before the oldest are dropped
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "100"))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "1.0"))
+AUDIT_MAX_BUFFER = int(os.environ.get("AUDIT_MAX_BUFFER", "10000"))
+
+# Modes per action, as JSON: {"action": "off" | "trail" | "buffered" | "immediate"}
+#   off: dropped
+#   trail: kept only in the request's SecurityContext trail
+#   buffered: also written to the destinations in the next batch
+#   immediate: also written before record() returns
+AUDIT_MODES = ("off", "trail", "buffered", "immediate")
+
+
+def _parse_actions(value: str) -> Dict[str, str]:
+    """
+    Per-action modes from JSON; a malformed value or unknown mode is
+    logged and ignored rather than failing the import
+    """
+    try:
+        actions = json.loads(value)
+        if not isinstance(actions, dict):
+            raise ValueError("expected a JSON object")
+    except ValueError as e:
+        logger.error(f"Ignoring invalid AUDIT_ACTIONS: {str(e)}")
+        return {}
+    
+    parsed = {}
+    for action, mode in actions.items():
+        if mode in AUDIT_MODES:
+            parsed[action] = mode
+        else:
+            logger.error(f"Ignoring invalid audit mode for {action}: {mode!r}")
+    return parsed
+
+
+def _parse_mode(name: str, default: str) -> str:
+    mode = os.environ.get(name, default)
+    if mode not in AUDIT_MODES:
+        logger.error(f"Ignoring invalid {name}: {mode!r}")
+        return default
+    return mode
+
+
+AUDIT_ACTIONS = {
+    "guardrail_violation": "immediate",
+    **_parse_actions(os.environ.get("AUDIT_ACTIONS", "{}"))
+}
+# Default for summary entries (create_audit_log_entry: "chat", "ingest")
+AUDIT_DEFAULT_MODE = _parse_mode("AUDIT_DEFAULT_MODE", "buffered")
+# Default for per-step actions (SecurityContext.log_action)
+AUDIT_STEP_MODE = _parse_mode("AUDIT_STEP_MODE", "trail")
+
+
+def audit_mode(action: str, default: str = None) -> str:
+    """Configured mode for an action"""
+    return AUDIT_ACTIONS.get(action, default or AUDIT_DEFAULT_MODE)
+
+
+def _json_line(entry: Dict) -> str:
+    return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class StdoutDestination:
+    """JSON lines on stdout (collected by CloudWatch Logs on Lambda)"""
+
+    name = "stdout"
+
+    def write(self, entries: List[Dict]):
+        sys.stdout.write("".join(_json_line(entry) + "\n" for entry in entries))
+        sys.stdout.flush()
+
+
+class FileDestination:
+    """JSON lines appended to a local file"""
+
+    name = "file"
+
+    def __init__(self, path: str = None):
+        self.path = path or AUDIT_FILE
+
+    def write(self, entries: List[Dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(_json_line(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class S3Destination:
+    """
+    One JSON-lines object per tenant and batch:
+    <tenant_id>/audit/YYYY/MM/DD/<HHMMSS>-<id>.jsonl
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket: str = None):
+        self.bucket = bucket or AUDIT_BUCKET
+        if not self.bucket:
+            raise ValueError("S3 audit destination needs AUDIT_BUCKET or VECTOR_BUCKET")
+
+    def write(self, entries: List[Dict]):
+        by_tenant = {}
+        for entry in entries:
+            by_tenant.setdefault(entry.get("tenant_id") or "_system", []).append(entry)
+
+        now = datetime.now(timezone.utc)
+        for tenant_id, tenant_entries in by_tenant.items():
+            key = f"{tenant_id}/audit/{now:%Y/%m/%d/%H%M%S}-{uuid.uuid4().hex[:12]}.jsonl"
+            s3.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body="".join(_json_line(entry) + "\n" for entry in tenant_entries).encode("utf-8"),
+                ContentType="application/x-ndjson"
+            )
+
+
+DESTINATIONS = {
+    "stdout": StdoutDestination,
+    "file": FileDestination,
+    "s3": S3Destination,
+}
+
+
+class AuditSink:
+    """
+    Buffer of audit entries written in batches by a daemon thread
+
+    record() only appends to the buffer; serialization and I/O happen on
+    the flush thread, which wakes every flush_interval seconds or when a
+    batch is full. A destination that fails has its batch written to
+    stdout instead, so entries still reach the logs.
+    """
+
+    def __init__(
+        self,
+        destinations: List = None,
+        batch_size: int = None,
+        flush_interval: float = None,
+        max_buffer: int = None
+    ):
+        self.destinations = destinations if destinations is not None else [StdoutDestination()]
+        self.batch_size = batch_size or AUDIT_BATCH_SIZE
+        self.flush_interval = flush_interval or AUDIT_FLUSH_INTERVAL
+        self.max_buffer = max_buffer or AUDIT_MAX_BUFFER
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._stats = {"recorded": 0, "written": 0, "dropped": 0, "failed_writes": 0}
+
+    def record(self, entry: Dict, immediate: bool = False):
+        """
+        Queue an entry
+
+        Args:
+            entry: JSON-serializable audit entry
+            immediate: Write it (and everything queued before it) now
+        """
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.popleft()
+                self._stats["dropped"] += 1
+            self._buffer.append(entry)
+            self._stats["recorded"] += 1
+            full = len(self._buffer) >= self.batch_size
+
+        if immediate:
+            self.flush()
+            return
+        self._ensure_worker()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Write every queued entry on the calling thread"""
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    break
+                self._write(batch)
+
+    def stats(self) -> Dict:
+        """Counters: recorded, written, dropped (buffer full) and failed_writes"""
+        with self._lock:
+            return dict(self._stats, buffered=len(self._buffer))
+
+    def _write(self, batch: List[Dict]):
+        for destination in self.destinations:
+            try:
+                destination.write(batch)
+            except Exception as e:
+                with self._lock:
+                    self._stats["failed_writes"] += 1
+                logger.error(f"Audit destination {destination.name} failed: {str(e)}")
+                if destination.name != "stdout":
+                    StdoutDestination().write(batch)
+        with self._lock:
+            self._stats["written"] += len(batch)
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="audit-flush", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Audit flush failed: {str(e)}", exc_info=True)
+
+
+def _configured_destinations() -> List:
+    names = [name.strip() for name in AUDIT_DESTINATIONS.split(",") if name.strip()]
+    unknown = [name for name in names if name not in DESTINATIONS]
+    if unknown:
+        raise ValueError(f"Unknown audit destination(s): {', '.join(unknown)}")
+    return [DESTINATIONS[name]() for name in names]
+
+
+# Shared by the handlers of this container
+audit_sink = AuditSink(_configured_destinations())
+atexit.register(audit_sink.flush)
+
+
+def record_audit(entry: Dict, mode: str = None):
+    """
+    Send an audit entry to the sink according to its action's mode
+
+    Args:
+        entry: Audit entry with an "action" key
+        mode: Mode to use instead of the configured one
+    """
+    mode = mode or audit_mode(entry.get("action", ""))
+    if mode in ("buffered", "immediate"):
+        audit_sink.record(entry, immediate=mode == "immediate")
+
+
+def flush_audit():
+    """
+    Write every buffered entry before a handler returns
+
+    Lambda freezes the container (and the flush thread) once the handler
+    returns; entries left in the buffer would wait for the next warm
+    invocation and be lost if the container is shut down instead.
+    """
+    try:
+        audit_sink.flush()
+    except Exception as e:
+        logger.error(f"Audit flush failed: {str(e)}", exc_info=True)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Bulk backfill: re-index every document under an S3 prefix.
+
+Documents are streamed, chunked, embedded and stored in a thread pool;
+PII masking runs in the shared guardrails process pool. Progress is
+checkpointed to a JSON file every --checkpoint-every documents and at the
+end, so an interrupted run resumes where it stopped. A document is only
+checkpointed once all of its chunks were stored.
+
+Run against AWS:
+    python backfill.py --bucket my-docs --prefix tenant-a/
+
+Run end to end locally (documents under ./local-data/my-docs/tenant-a/):
+    python backfill.py --bucket my-docs --prefix tenant-a/ \\
+        --local-root ./local-data --fake-bedrock
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List
+
+from chunking import iter_paragraphs, CHUNKING_STRATEGIES
+from guardrails import mask_pii_stream
+from s3_reader import open_object, detect_encoding, decompressing_reader
+
+
+def prepare_chunks(
+    stream,
+    strategy: str,
+    max_tokens: int = 500,
+    overlap_tokens: int = 50,
+    workers: int = 1
+) -> Iterator[Dict]:
+    """
+    Mask PII and chunk one document without reading it into memory
+
+    Masking runs in the guardrails process pool when workers > 1; its
+    forkserver/spawn context is safe to start from the I/O threads.
+
+    Args:
+        stream: File-like object with read(size) returning bytes
+        strategy: Chunking strategy name
+        max_tokens: Maximum tokens per chunk
+        overlap_tokens: Tokens to overlap between chunks
+        workers: Masking processes
+
+    Yields:
+        Chunk dictionaries in document order
+    """
+    paragraphs = mask_pii_stream(iter_paragraphs(stream), workers=workers)
+    yield from CHUNKING_STRATEGIES[strategy](paragraphs, max_tokens, overlap_tokens)
+
+
+class Checkpoint:
+    """
+    Resumable record of completed documents, keyed by S3 key with the
+    ETag that was indexed. Written atomically by flush().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = {}
+        self.unflushed = 0
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.completed = json.load(f).get("completed", {})
+
+    def is_done(self, key: str, etag: str) -> bool:
+        return self.completed.get(key) == etag
+
+    def mark_done(self, key: str, etag: str):
+        with self._lock:
+            self.completed[key] = etag
+            self.unflushed += 1
+
+    def flush(self):
+        with self._lock:
+            self.unflushed = 0
+            if not self.path:
+                return
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"completed": self.completed}, f)
+            os.replace(tmp_path, self.path)
+
+
+class Throughput:
+    """Running docs/s, chunks/s and tokens/s counters"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.docs = 0
+        self.failed = 0
+        self.unchanged = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, counts: Dict, tokens: int):
+        with self._lock:
+            self.docs += 1
+            self.chunks += counts["total_chunks"]
+            self.embedded += counts["embedded_chunks"]
+            self.tokens += tokens
+
+    def record_unchanged(self):
+        with self._lock:
+            self.unchanged += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        return (
+            f"{self.docs} docs ({self.failed} failed, {self.unchanged} unchanged), {self.chunks} chunks "
+            f"({self.embedded} embedded), {self.tokens} tokens in {elapsed:.1f}s | "
+            f"{self.docs / elapsed:.2f} docs/s, {self.chunks / elapsed:.1f} chunks/s, "
+            f"{self.tokens / elapsed:.0f} tokens/s"
+        )
+
+
+def list_documents(s3, bucket: str, prefix: str) -> List[Dict]:
+    """List source documents under a prefix"""
+    paginator = s3.get_paginator('list_objects_v2')
+    documents = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/'):
+                documents.append({"key": obj['Key'], "etag": obj.get('ETag', '')})
+    return documents
+
+
+def run_backfill(args) -> Throughput:
+    """Re-index all documents under args.prefix"""
+    if args.local_root:
+        from local_backends import install_local_backends
+        install_local_backends(args.local_root, fake_bedrock=args.fake_bedrock)
+    elif args.fake_bedrock:
+        raise SystemExit("--fake-bedrock requires --local-root")
+
+    # Imported after the local stand-ins are installed
+    import ingest_handler
+    from security import sanitize_document_id
+
+    s3 = ingest_handler.s3
+    checkpoint = Checkpoint(args.checkpoint)
+    stats = Throughput()
+
+    documents = list_documents(s3, args.bucket, args.prefix)
+    pending = [d for d in documents if not checkpoint.is_done(d["key"], d["etag"])]
+    print(f"Found {len(documents)} documents, {len(pending)} to process "
+          f"({len(documents) - len(pending)} already in checkpoint)")
+
+    params = ingest_handler.index_params(args.strategy)
+    dedup_indexes = ingest_handler.TenantDedupIndexes() if ingest_handler.DEDUP_ENABLED else None
+
+    with ThreadPoolExecutor(max_workers=args.io_workers) as threads:
+
+        def process(document: Dict):
+            key = document["key"]
+            path_parts = key.split('/')
+            if len(path_parts) < 2:
+                raise ValueError(f"Invalid S3 key format: {key}")
+            tenant_id = path_parts[0]
+            safe_doc_id = sanitize_document_id('/'.join(path_parts[1:]))
+
+            # Documents already indexed from this ETag with these settings
+            # (e.g. by the ingest Lambda) are skipped without downloading
+            manifest = ingest_handler.load_manifest(tenant_id, safe_doc_id)
+            if ingest_handler.is_unchanged(manifest, document["etag"], params):
+                return None, 0
+
+            head = s3.head_object(Bucket=args.bucket, Key=key)
+            encoding = detect_encoding(key, head.get("ContentEncoding"))
+            raw = ingest_handler.HashingReader(open_object(s3, args.bucket, key, head))
+            body = decompressing_reader(raw, encoding)
+
+            tokens = 0
+
+            def chunks():
+                nonlocal tokens
+                for chunk in prepare_chunks(body, args.strategy, params["max_tokens"],
+                                            params["overlap_tokens"], args.workers):
+                    tokens += chunk.get("token_estimate", 0)
+                    yield chunk
+
+            def source_info():
+                return {
+                    "etag": head["ETag"],
+                    "content_hash": raw.hexdigest(),
+                    "size": raw.bytes_read,
+                    "encoding": encoding
+                }
+
+            try:
+                counts = ingest_handler.index_document_chunks(
+                    tenant_id, safe_doc_id, chunks(), dedup_indexes,
+                    params=params, source_info=source_info
+                )
+            finally:
+                # Stops in-flight ranged GETs if chunking failed early
+                raw.close()
+            return counts, tokens
+
+        futures = {threads.submit(process, d): d for d in pending}
+        for future in as_completed(futures):
+            document = futures[future]
+            try:
+                counts, tokens = future.result()
+            except Exception as e:
+                stats.record_failure()
+                print(f"✗ {document['key']}: {e}", file=sys.stderr)
+                continue
+
+            # Failed chunks (e.g. throttled embeddings) are retried next run
+            if counts is not None and counts["successful_chunks"] < counts["total_chunks"]:
+                stats.record_failure()
+                print(f"✗ {document['key']}: {counts['total_chunks'] - counts['successful_chunks']} "
+                      f"of {counts['total_chunks']} chunks failed", file=sys.stderr)
+                continue
+
+            checkpoint.mark_done(document["key"], document["etag"])
+            if checkpoint.unflushed >= args.checkpoint_every:
+                checkpoint.flush()
+            if counts is None:
+                stats.record_unchanged()
+                continue
+
+            stats.record(counts, tokens)
+            if stats.docs % args.report_every == 0:
+                print(f"  {stats.summary()}")
+
+        checkpoint.flush()
+
+    print(f"✓ {stats.summary()}")
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-index every document under an S3 prefix")
+    parser.add_argument("--bucket", required=True, help="Source document bucket")
+    parser.add_argument("--prefix", default="", help="Key prefix to backfill (e.g. tenant_id/)")
+    parser.add_argument("--checkpoint", default="backfill-checkpoint.json",
+                        help="Checkpoint file for resuming ('' disables)")
+    parser.add_argument("--checkpoint-every", type=int, default=50,
+                        help="Documents completed between checkpoint saves")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes for PII masking")
+    parser.add_argument("--io-workers", type=int, default=8,
+                        help="Threads for download, embedding and storage")
+    parser.add_argument("--strategy", default=os.environ.get("CHUNK_STRATEGY", "paragraph"),
+                        choices=sorted(CHUNKING_STRATEGIES), help="Chunking strategy")
+    parser.add_argument("--report-every", type=int, default=25,
+                        help="Print throughput every N documents")
+    parser.add_argument("--local-root", help="Use a local directory instead of S3")
+    parser.add_argument("--fake-bedrock", action="store_true",
+                        help="Use the fake Bedrock stand-in (requires --local-root)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    result = run_backfill(parse_args())
+    sys.exit(1 if result.failed else 0)
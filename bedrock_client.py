@@ -1,9 +1,11 @@
 import boto3
 import json
 import os
-from decimal import Decimal
 from datetime import datetime
 
+from budget import cache_spend
+from usage import record_usage
+
 # Bedrock runtime client
 bedrock_runtime = boto3.client(
     "bedrock-runtime",
@@ -23,28 +25,14 @@ MODEL_PRICING = {
     CHAT_MODEL_ID: 0.0003    # Llama 3 8B
 }
 
-# DynamoDB table to log costs
-dynamodb = boto3.resource("dynamodb")
-COST_TABLE = os.environ.get("COST_TABLE")
-table = dynamodb.Table(COST_TABLE)
-
-
 def _log_cost(model_id: str, tokens_used: int, tenant_id: str = "default"):
     cost_per_1000 = MODEL_PRICING.get(model_id, 0)
     cost = (tokens_used / 1000) * cost_per_1000
 
-    timestamp = int(datetime.utcnow().timestamp())
-
-    # Save to DynamoDB
-    table.put_item(
-        Item={
-            "tenant_id": tenant_id,  # Required hash key
-            "timestamp": Decimal(str(timestamp)),  # Required range key
-            "model_id": model_id,
-            "tokens_used": Decimal(str(tokens_used)),
-            "estimated_cost": Decimal(str(cost))
-        }
-    )
+    # Hourly, daily and monthly rollups in DynamoDB; the new monthly
+    # total refreshes the budget cache
+    monthly = record_usage(tenant_id, model_id, tokens_used, cost)
+    cache_spend(tenant_id, monthly["period"], monthly["estimated_cost"])
     
     # Publish custom CloudWatch metric for token usage alarm
     try:
@@ -128,3 +116,33 @@ def generate_chat_completion(prompt: str, tenant_id: str = "default") -> str:
     _log_cost(CHAT_MODEL_ID, tokens_used, tenant_id)
 
     return answer
+
+
+def stream_chat_completion(prompt: str, tenant_id: str = "default"):
+    """
+    Generate a chat completion with Meta Llama 3, yielding text as it is
+    generated (pass through security.sanitize_stream before sending)
+    """
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId=CHAT_MODEL_ID,
+        body=json.dumps({
+            "prompt": prompt,
+            "max_gen_len": 500,
+            "temperature": 0.3,
+            "top_p": 0.9
+        }),
+        contentType="application/json"
+    )
+
+    prompt_tokens = 0
+    generation_tokens = 0
+    for event in response["body"]:
+        if "chunk" not in event:
+            continue
+        chunk = json.loads(event["chunk"]["bytes"])
+        prompt_tokens = chunk.get("prompt_token_count") or prompt_tokens
+        generation_tokens = chunk.get("generation_token_count") or generation_tokens
+        if chunk.get("generation"):
+            yield chunk["generation"]
+
+    _log_cost(CHAT_MODEL_ID, prompt_tokens + generation_tokens, tenant_id)
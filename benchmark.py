@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for ingest and chat hot paths.
+No AWS credentials required.
+
+Run: python benchmark.py [chunking] [guardrails] [pii] [pii_parallel]
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+from chunking import chunk_text
+from guardrails import (
+    INJECTION_PATTERNS, PII_PATTERNS, PII_MASKS, mask_pii, mask_pii_stream, scan_input, scan_pii
+)
+
+
+def _timed(fn, *args, repeat: int = 3, **kwargs) -> float:
+    """Best-of-N wall time in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _single_paragraph(size_bytes: int, seed: int = 7) -> str:
+    """Unbroken text with no paragraph breaks (logs, CSV dumps, minified content)"""
+    rng = random.Random(seed)
+    vocab = [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789,;=") for _ in range(rng.randint(2, 12)))
+        for _ in range(5000)
+    ]
+    words = []
+    total = 0
+    while total < size_bytes:
+        word = rng.choice(vocab)
+        words.append(word)
+        total += len(word) + 1
+    return " ".join(words)
+
+
+def bench_chunking(sizes_mb=(1, 2, 4, 8)):
+    """Hard-split path of chunk_text on multi-megabyte single paragraphs"""
+    print("=" * 60)
+    print("chunk_text: single-paragraph hard split (max_tokens=500, overlap=50)")
+    print("=" * 60)
+    print(f"{'size':>8} {'chunks':>8} {'seconds':>10} {'MB/s':>8} {'x prev':>8}")
+
+    previous = None
+    for size_mb in sizes_mb:
+        text = _single_paragraph(size_mb * 1024 * 1024)
+        chunks = chunk_text(text, max_tokens=500, overlap_tokens=50)
+        elapsed = _timed(chunk_text, text, max_tokens=500, overlap_tokens=50)
+
+        ratio = f"{elapsed / previous:.2f}" if previous else "-"
+        print(f"{size_mb:>6}MB {len(chunks):>8} {elapsed:>10.3f} {size_mb / elapsed:>8.1f} {ratio:>8}")
+        previous = elapsed
+
+    print("\nDoubling the input should roughly double the time (x prev ~ 2.0).")
+
+
+def _multi_pass_guardrails(text: str, blocked_terms: list):
+    """Baseline: one search per pattern and per term, separate detect and mask passes"""
+    text_lower = text.lower()
+    for pattern in INJECTION_PATTERNS:
+        if re.search(pattern, text_lower, re.IGNORECASE):
+            return
+    for term in blocked_terms:
+        if term.lower() in text_lower:
+            return
+    found = {k: re.findall(p, text) for k, p in PII_PATTERNS.items()}
+    masked = text
+    if any(found.values()):
+        for pattern in PII_PATTERNS.values():
+            masked = re.sub(pattern, "[REDACTED]", masked)
+
+
+def bench_guardrails(sizes_kb=(10, 100, 1000), term_counts=(10, 500)):
+    """Input guardrails on long clean inputs (the worst case: nothing short-circuits)"""
+    print("=" * 60)
+    print("Input guardrails: multi-pass baseline vs scan_input")
+    print("=" * 60)
+    print(f"{'size':>8} {'terms':>6} {'baseline s':>11} {'scan s':>9} {'speedup':>8}")
+
+    rng = random.Random(11)
+    for size_kb in sizes_kb:
+        text = _single_paragraph(size_kb * 1024) + " contact ops@example.com or 555-123-4567"
+        for count in term_counts:
+            terms = [
+                "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(6, 12))) + " zq"
+                for _ in range(count)
+            ]
+            baseline = _timed(_multi_pass_guardrails, text, terms)
+            scanned = _timed(scan_input, text, max_input_length=len(text), max_tokens=len(text), blocked_terms=terms)
+            print(f"{size_kb:>6}KB {count:>6} {baseline:>11.4f} {scanned:>9.4f} {baseline / scanned:>7.1f}x")
+
+    print("\nscan_input's blocked-term pass does not grow with the number of terms.")
+
+
+def _sequential_pii(text: str):
+    """Baseline: findall per type, then one re.sub per type"""
+    findings = {k: re.findall(p, text) for k, p in PII_PATTERNS.items()}
+    for pii_type, pattern in PII_PATTERNS.items():
+        text = re.sub(pattern, PII_MASKS[pii_type], text)
+    return findings, text
+
+
+def bench_pii(rows=(5000, 20000, 80000)):
+    """PII detection and masking on PII-dense documents (CSV exports)"""
+    print("=" * 60)
+    print("PII: sequential findall + re.sub vs scan_pii (one scan, one join)")
+    print("=" * 60)
+    print(f"{'size':>8} {'spans':>7} {'baseline s':>11} {'scan s':>9} {'speedup':>8}")
+
+    rng = random.Random(5)
+    for count in rows:
+        text = "\n".join(
+            f"user{i},user{i}@example.com,555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)},"
+            f"4111 1111 1111 {rng.randint(1000, 9999)},notes"
+            for i in range(count)
+        )
+        findings, _ = scan_pii(text)
+        baseline = _timed(_sequential_pii, text)
+        scanned = _timed(scan_pii, text)
+        spans = sum(len(v) for v in findings.values())
+        print(f"{len(text) / 1e6:>6.1f}MB {spans:>7} {baseline:>11.4f} {scanned:>9.4f} {baseline / scanned:>7.1f}x")
+
+
+def bench_pii_parallel(rows=200000, workers=(1, 2, 4, 8)):
+    """Ingest-style PII masking over paragraphs by worker processes"""
+    print("=" * 60)
+    print("PII: mask_pii_stream by worker processes (ingest masking)")
+    print("=" * 60)
+    print(f"{os.cpu_count()} CPU(s)")
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8}")
+
+    rng = random.Random(6)
+    paragraphs = [
+        f"user{i},user{i}@example.com,555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)},notes\n"
+        for i in range(rows)
+    ]
+    expected = [mask_pii(p) for p in paragraphs]
+    sequential = None
+    for count in workers:
+        # Warm the pool so process start-up is not timed
+        list(mask_pii_stream(paragraphs[:1000], workers=count))
+        start = time.perf_counter()
+        masked = list(mask_pii_stream(paragraphs, workers=count))
+        elapsed = time.perf_counter() - start
+        assert masked == expected
+        sequential = sequential or elapsed
+        print(f"{count:>8} {elapsed:>9.3f} {sequential / elapsed:>7.1f}x")
+
+
+BENCHMARKS = {
+    "chunking": bench_chunking,
+    "guardrails": bench_guardrails,
+    "pii": bench_pii,
+    "pii_parallel": bench_pii_parallel,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
+        print()
@@ -0,0 +1,120 @@
+"""
+Per-tenant spend budgets
+- Spend per tenant and calendar month (UTC) from the monthly usage
+  rollup (see usage.py)
+- Budget checks served from an in-process cache with a short TTL, so
+  the check before a request is usually a dictionary lookup
+
+The check is soft: requests already in flight when a tenant crosses its
+budget still complete, and other containers see the new total when their
+cache entry expires (BUDGET_CACHE_TTL).
+
+Usage:
+    from budget import check_budget
+    result = check_budget(tenant_id)
+    if not result["allowed"]:
+        ...  # reject before embedding or generation
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from usage import get_usage, period_start
+
+logger = logging.getLogger()
+
+
+def _parse_budgets(value: str) -> Dict[str, float]:
+    """
+    Per-tenant budgets from JSON; a malformed value is logged and ignored
+    (every tenant gets TENANT_BUDGET_USD) rather than failing the import
+    """
+    try:
+        budgets = json.loads(value)
+        if not isinstance(budgets, dict):
+            raise ValueError("expected a JSON object")
+    except ValueError as e:
+        logger.error(f"Ignoring invalid TENANT_BUDGETS_USD: {str(e)}")
+        return {}
+    
+    parsed = {}
+    for tenant_id, budget in budgets.items():
+        try:
+            parsed[tenant_id] = float(budget)
+        except (TypeError, ValueError):
+            logger.error(f"Ignoring invalid budget for tenant {tenant_id}: {budget!r}")
+    return parsed
+
+
+# Monthly budget per tenant in USD (0 = unlimited), and per-tenant
+# overrides as JSON: {"tenant-a": 50, "tenant-b": 0}
+TENANT_BUDGET_USD = float(os.environ.get("TENANT_BUDGET_USD", "0"))
+TENANT_BUDGETS_USD = _parse_budgets(os.environ.get("TENANT_BUDGETS_USD", "{}"))
+# Seconds a cached spend total is trusted before it is read again
+BUDGET_CACHE_TTL = float(os.environ.get("BUDGET_CACHE_TTL", "30"))
+
+# (tenant_id, period) -> (spend, fetched_at); kept across warm invocations
+_spend_cache = {}
+_spend_cache_lock = threading.Lock()
+
+
+def budget_period(now: float = None) -> int:
+    """Start of the budget period (UTC calendar month) containing `now`, epoch seconds"""
+    return period_start("month", time.time() if now is None else now)
+
+
+def tenant_budget(tenant_id: str) -> Optional[float]:
+    """Monthly budget in USD, or None if the tenant is unlimited"""
+    budget = float(TENANT_BUDGETS_USD.get(tenant_id, TENANT_BUDGET_USD))
+    return budget if budget > 0 else None
+
+
+def cache_spend(tenant_id: str, period: int, spend: float):
+    """
+    Cache a tenant's spend total, e.g. the one returned when logging a cost
+    (usage.record_usage()), so this container sees its own spend at once
+    """
+    with _spend_cache_lock:
+        # Spend only grows within a period; concurrent updates may return
+        # their totals out of order
+        cached = _spend_cache.get((tenant_id, period))
+        if cached:
+            spend = max(spend, cached[0])
+        _spend_cache[(tenant_id, period)] = (spend, time.monotonic())
+
+
+def current_spend(tenant_id: str) -> float:
+    """Tenant spend for the current period (cached for BUDGET_CACHE_TTL)"""
+    period = budget_period()
+    cached = _spend_cache.get((tenant_id, period))
+    if cached and time.monotonic() - cached[1] < BUDGET_CACHE_TTL:
+        return cached[0]
+
+    spend = get_usage(tenant_id, "month", period)["estimated_cost"]
+    cache_spend(tenant_id, period, spend)
+    return spend
+
+
+def check_budget(tenant_id: str) -> Dict:
+    """
+    Check a tenant's spend against its monthly budget
+
+    Returns:
+        Dictionary with allowed, spend and budget (USD; None if unlimited)
+    """
+    budget = tenant_budget(tenant_id)
+    if budget is None:
+        return {"allowed": True, "spend": None, "budget": None}
+
+    try:
+        spend = current_spend(tenant_id)
+    except Exception as e:
+        # Fail open: a cost table outage should not take chat down
+        logger.warning(f"Budget check failed for tenant {tenant_id}: {str(e)}")
+        return {"allowed": True, "spend": None, "budget": budget}
+
+    return {"allowed": spend < budget, "spend": round(spend, 6), "budget": budget}
@@ -1,22 +1,270 @@
 import json
 import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 from bedrock_client import generate_embedding, generate_chat_completion
-from vector_store import retrieve_similar
-from prompt_templates import build_prompt
+from vector_store import load_index, load_session, save_session
+from prompt_templates import build_prompt, build_prompt_with_stats
 from guardrails import apply_guardrails, GuardrailViolation
 from security import SecurityContext, sanitize_output, create_audit_log_entry
+from audit import record_audit, flush_audit
 from evaluation import calculate_answer_relevance
+from post_response import post_response, should_sample, EVAL_SAMPLE_RATE
+from tracing import Tracer
+from rate_limit import check_rate_limit, RATE_LIMIT_WINDOW_SECONDS
+from budget import check_budget
+from conversation import (
+    validate_session_id, new_session_id, session_user_id, new_session,
+    add_turn, format_history, history_stats, cache_retrieval, cached_retrieval, chunk_ref
+)
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Loads tenant indexes while guardrails and the query embedding run;
+# kept across warm invocations
+_prefetch_executor = ThreadPoolExecutor(max_workers=4)
+
+# Batch requests ({"questions": [...]}): size limit and concurrent
+# Bedrock calls per invocation
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "50"))
+BATCH_EMBED_CONCURRENCY = int(os.environ.get("BATCH_EMBED_CONCURRENCY", "8"))
+BATCH_GENERATION_CONCURRENCY = int(os.environ.get("BATCH_GENERATION_CONCURRENCY", "4"))
+
+
+def _evaluate_and_audit(
+    sec_context: SecurityContext,
+    question: str,
+    answer: str,
+    context_texts: list,
+    evaluate: bool,
+    relevance_metrics: dict = None
+):
+    """Post-response work: sampled answer evaluation and the audit log"""
+    if evaluate and relevance_metrics is None:
+        relevance_metrics = calculate_answer_relevance(
+            question=question,
+            answer=answer,
+            context_chunks=context_texts
+        )
+    
+    audit_entry = create_audit_log_entry(
+        tenant_id=sec_context.tenant_id,
+        user_id=sec_context.user_id,
+        action="chat",
+        query=question,
+        metadata={
+            "request_id": sec_context.request_id,
+            "chunks_used": len(context_texts),
+            "relevance_metrics": relevance_metrics,
+            "security_context": sec_context.to_dict()
+        }
+    )
+    
+    record_audit(audit_entry)
+
+
+def _guard_question(question: str) -> dict:
+    """Apply input guardrails to a question (raises GuardrailViolation)"""
+    return apply_guardrails(
+        question,
+        check_injection=True,
+        check_pii=True,
+        max_input_length=5000,
+        max_tokens=4000
+    )
+
+
+def _rate_limited(tenant_id: str, cost: int, tracer: Tracer):
+    """429 response if the tenant is over its request rate, else None"""
+    with tracer.span("rate_limit"):
+        result = check_rate_limit(tenant_id, "chat", cost)
+    if result["allowed"]:
+        return None
+    
+    retry_after = math.ceil(min(result["retry_after"], RATE_LIMIT_WINDOW_SECONDS))
+    logger.warning(
+        f"Rate limit exceeded for tenant {tenant_id} ({result['limited_by']}): "
+        f"{cost} request(s), retry after {retry_after}s"
+    )
+    return {
+        "statusCode": 429,
+        "headers": {"Retry-After": str(retry_after)},
+        "body": json.dumps({"error": "Rate limit exceeded", "retry_after": retry_after})
+    }
+
+
+def _over_budget(tenant_id: str, tracer: Tracer):
+    """402 response if the tenant has spent its monthly budget, else None"""
+    with tracer.span("budget"):
+        result = check_budget(tenant_id)
+    if result["allowed"]:
+        return None
+    
+    logger.warning(
+        f"Budget exceeded for tenant {tenant_id}: "
+        f"${result['spend']} of ${result['budget']} this month"
+    )
+    return {
+        "statusCode": 402,
+        "body": json.dumps({
+            "error": "Monthly budget exceeded",
+            "spend": result["spend"],
+            "budget": result["budget"]
+        })
+    }
+
+
+def _handle_batch(
+    questions: list,
+    tenant_id: str,
+    user_id: str,
+    request_id: str,
+    tracer: Tracer
+) -> dict:
+    """
+    Answer a list of questions in one invocation
+    
+    `questions` is validated by the caller. The tenant index is loaded
+    once, questions are embedded concurrently and scored with one matrix
+    product, and generations run with bounded concurrency. A failing
+    question yields an error entry without failing the others.
+    
+    Returns:
+        API Gateway response with results in question order
+    """
+    sec_context = SecurityContext(tenant_id, user_id, request_id)
+    sec_context.log_action("chat_batch_received", {"questions": len(questions)})
+    
+    def prefetch_index():
+        with tracer.span("index_load"):
+            return load_index(tenant_id)
+    
+    index_future = _prefetch_executor.submit(prefetch_index)
+    
+    results = [None] * len(questions)
+    safe_questions = {}
+    warnings = {}
+    
+    with tracer.span("guardrails"):
+        for i, question in enumerate(questions):
+            if not isinstance(question, str) or not question:
+                results[i] = {"index": i, "error": "No question provided"}
+                continue
+            try:
+                guardrail_result = _guard_question(question)
+            except GuardrailViolation as e:
+                sec_context.log_action("guardrail_violation", {"index": i, "reason": str(e)})
+                results[i] = {
+                    "index": i,
+                    "error": "Request blocked by security guardrails",
+                    "reason": str(e)
+                }
+                continue
+            safe_questions[i] = guardrail_result["masked_input"]
+            if guardrail_result["warnings"]:
+                warnings[i] = guardrail_result["warnings"]
+    
+    pending = list(safe_questions)
+    
+    def embed(i):
+        try:
+            return generate_embedding(safe_questions[i], tenant_id)
+        except Exception as e:
+            logger.error(f"Error embedding question {i}: {str(e)}")
+            return None
+    
+    with tracer.span("embed"):
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_EMBED_CONCURRENCY, len(pending)))) as executor:
+            embeddings = dict(zip(pending, executor.map(embed, pending)))
+    
+    for i in pending:
+        if embeddings[i] is None:
+            results[i] = {"index": i, "error": "Internal server error"}
+    pending = [i for i in pending if embeddings[i] is not None]
+    
+    with tracer.span("index_wait"):
+        try:
+            index = index_future.result()
+        except Exception as e:
+            logger.error(f"Error loading vector index: {str(e)}")
+            index = None
+    
+    with tracer.span("retrieval"):
+        retrieved = index.search_many([embeddings[i] for i in pending], top_k=5) if index is not None else [[] for _ in pending]
+        context_chunks = dict(zip(pending, retrieved))
+    
+    def answer(i):
+        try:
+            prompt = build_prompt(context_chunks[i], safe_questions[i])
+            return sanitize_output(generate_chat_completion(prompt, tenant_id))
+        except Exception as e:
+            logger.error(f"Error answering question {i}: {str(e)}")
+            return None
+    
+    with tracer.span("generation"):
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_GENERATION_CONCURRENCY, len(pending)))) as executor:
+            answers = dict(zip(pending, executor.map(answer, pending)))
+    
+    for i in pending:
+        if answers[i] is None:
+            results[i] = {"index": i, "error": "Internal server error"}
+            continue
+        
+        results[i] = {
+            "index": i,
+            "answer": answers[i],
+            "chunks_used": len(context_chunks[i])
+        }
+        if i in warnings:
+            results[i]["warnings"] = warnings[i]
+    
+    failed = sum(1 for r in results if "error" in r)
+    response = {
+        "statusCode": 200,
+        "body": json.dumps({
+            "results": results,
+            "metadata": {
+                "questions": len(questions),
+                "failed": failed,
+                "request_id": request_id
+            }
+        }),
+        "headers": {
+            "Content-Type": "application/json",
+            "X-Request-ID": request_id
+        }
+    }
+    
+    with tracer.span("post_response"):
+        for i in pending:
+            if answers[i] is None:
+                continue
+            post_response.defer(
+                "chat_audit",
+                _evaluate_and_audit,
+                sec_context=sec_context,
+                question=safe_questions[i],
+                answer=answers[i],
+                context_texts=[c.get("text", "") for c in context_chunks[i]],
+                evaluate=should_sample(EVAL_SAMPLE_RATE, f"{request_id}:{i}")
+            )
+        post_response.complete()
+    
+    tracer.finish()
+    response["headers"]["Server-Timing"] = tracer.server_timing()
+    tracer.emit_metrics()
+    return response
+
 
 def lambda_handler(event, context):
     """
     Enhanced chat handler with security, guardrails, and evaluation
     """
     request_id = context.request_id if hasattr(context, 'request_id') else 'local'
+    tracer = Tracer("chat")
     
     try:
         # Parse request
@@ -25,25 +273,75 @@ def lambda_handler(event, context):
         tenant_id = body.get("tenant_id", "default")
         user_id = body.get("user_id", "anonymous")
         
+        # Batch mode: {"questions": ["...", ...]}
+        if "questions" in body:
+            questions = body["questions"]
+            if not isinstance(questions, list) or not questions:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps({"error": "questions must be a non-empty list"})
+                }
+            if len(questions) > BATCH_MAX_QUESTIONS:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps({"error": f"At most {BATCH_MAX_QUESTIONS} questions per request"})
+                }
+            
+            # Throttle before any Bedrock call; a batch counts each question
+            limited = _rate_limited(tenant_id, len(questions), tracer) or _over_budget(tenant_id, tracer)
+            if limited:
+                return limited
+            
+            return _handle_batch(questions, tenant_id, user_id, request_id, tracer)
+        
         if not question:
             return {
                 "statusCode": 400,
                 "body": json.dumps({"error": "No question provided"})
             }
         
+        # Conversation mode: "session_id" continues (or starts) a session,
+        # "conversation": true starts one with a generated ID
+        session_id = body.get("session_id")
+        if session_id is None and body.get("conversation"):
+            session_id = new_session_id()
+        if session_id is not None:
+            try:
+                session_id = validate_session_id(session_id)
+            except ValueError as e:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps({"error": str(e)})
+                }
+        
+        # Throttle before any Bedrock call; rejected requests are not charged
+        limited = _rate_limited(tenant_id, 1, tracer) or _over_budget(tenant_id, tracer)
+        if limited:
+            return limited
+        
         # Initialize security context
         sec_context = SecurityContext(tenant_id, user_id, request_id)
         sec_context.log_action("chat_request_received", {"question_length": len(question)})
         
+        session_future = None
+        if session_id is not None:
+            session_user = session_user_id(user_id)
+            session_future = _prefetch_executor.submit(
+                load_session, sec_context.tenant_id, session_user, session_id
+            )
+        
+        # Load (or revalidate) the tenant index concurrently with
+        # guardrails and the embedding call; it does not depend on either
+        def prefetch_index():
+            with tracer.span("index_load"):
+                return load_index(tenant_id)
+        
+        index_future = _prefetch_executor.submit(prefetch_index)
+        
         # Apply guardrails
         try:
-            guardrail_result = apply_guardrails(
-                question,
-                check_injection=True,
-                check_pii=True,
-                max_input_length=5000,
-                max_tokens=4000
-            )
+            with tracer.span("guardrails"):
+                guardrail_result = _guard_question(question)
             
             # Use masked input if PII detected
             safe_question = guardrail_result["masked_input"]
@@ -58,63 +356,88 @@ def lambda_handler(event, context):
         except GuardrailViolation as e:
             logger.error(f"Guardrail violation: {str(e)}")
             sec_context.log_action("guardrail_violation", {"reason": str(e)})
+            tracer.emit_metrics()
             return {
                 "statusCode": 400,
                 "body": json.dumps({
                     "error": "Request blocked by security guardrails",
                     "reason": str(e)
-                })
+                }),
+                "headers": {"Server-Timing": tracer.server_timing()}
             }
         
         # Step 1: Embed query
         sec_context.log_action("embedding_generation_start")
-        query_embedding = generate_embedding(safe_question, tenant_id)
+        with tracer.span("embed"):
+            query_embedding = generate_embedding(safe_question, tenant_id)
         sec_context.log_action("embedding_generation_complete")
         
-        # Step 2: Retrieve top-k similar chunks (with tenant isolation)
-        sec_context.log_action("retrieval_start")
-        context_chunks = retrieve_similar(
-            query_embedding, 
-            top_k=5,
-            tenant_id=tenant_id  # Enforce tenant isolation
-        )
-        sec_context.log_action("retrieval_complete", {
-            "chunks_retrieved": len(context_chunks)
-        })
+        session = None
+        if session_future is not None:
+            with tracer.span("session_load"):
+                session = session_future.result() or new_session(sec_context.tenant_id, session_user, session_id)
+        
+        # Step 2: Retrieve top-k similar chunks (with tenant isolation);
+        # follow-ups on the same topic reuse the session's last retrieval
+        context_chunks = cached_retrieval(session, query_embedding)
+        retrieval_reused = context_chunks is not None
+        if retrieval_reused:
+            sec_context.log_action("retrieval_reused", {"chunks_retrieved": len(context_chunks)})
+        else:
+            sec_context.log_action("retrieval_start")
+            try:
+                with tracer.span("index_wait"):
+                    index = index_future.result()
+                with tracer.span("retrieval"):
+                    context_chunks = index.search(query_embedding, top_k=5)
+            except Exception as e:
+                logger.error(f"Error loading vector index: {str(e)}")
+                context_chunks = []
+            sec_context.log_action("retrieval_complete", {
+                "chunks_retrieved": len(context_chunks)
+            })
+            if session is not None:
+                cache_retrieval(session, query_embedding, context_chunks)
         
         # Step 3: Build prompt
-        prompt = build_prompt(context_chunks, safe_question)
+        with tracer.span("prompt"):
+            prompt, packing = build_prompt_with_stats(
+                context_chunks, safe_question, history=format_history(session)
+            )
+        sec_context.log_action("context_packed", packing)
+        if session is not None:
+            sec_context.log_action("conversation_history", history_stats(session))
         
         # Step 4: Generate chat response
         sec_context.log_action("llm_generation_start")
-        answer = generate_chat_completion(prompt, tenant_id)
+        with tracer.span("generation"):
+            answer = generate_chat_completion(prompt, tenant_id)
         sec_context.log_action("llm_generation_complete")
         
         # Step 5: Sanitize output
-        safe_answer = sanitize_output(answer)
-        
-        # Step 6: Calculate evaluation metrics
-        relevance_metrics = calculate_answer_relevance(
-            question=safe_question,
-            answer=safe_answer,
-            context_chunks=[c.get("text", "") for c in context_chunks]
-        )
+        with tracer.span("sanitize"):
+            safe_answer = sanitize_output(answer)
         
-        # Create audit log
-        audit_entry = create_audit_log_entry(
-            tenant_id=tenant_id,
-            user_id=user_id,
-            action="chat",
-            query=safe_question,
-            metadata={
-                "request_id": request_id,
-                "chunks_used": len(context_chunks),
-                "relevance_metrics": relevance_metrics,
-                "security_context": sec_context.to_dict()
-            }
-        )
+        # The next turn must see this one, so the session is saved
+        # before responding
+        if session is not None:
+            add_turn(session, safe_question, safe_answer, [chunk_ref(c) for c in context_chunks])
+            with tracer.span("session_save"):
+                save_session(sec_context.tenant_id, session_user, session_id, session)
         
-        logger.info(f"Audit log: {json.dumps(audit_entry)}")
+        # Step 6: Evaluate a sample of answers. Run inline, the metrics
+        # are returned with the answer; in background mode they only reach
+        # the audit log
+        context_texts = [c.get("text", "") for c in context_chunks]
+        evaluate = should_sample(EVAL_SAMPLE_RATE, request_id)
+        relevance_metrics = None
+        if evaluate and post_response.mode == "inline":
+            with tracer.span("evaluate"):
+                relevance_metrics = calculate_answer_relevance(
+                    question=safe_question,
+                    answer=safe_answer,
+                    context_chunks=context_texts
+                )
         
         # Return response
         response_body = {
@@ -125,12 +448,15 @@ def lambda_handler(event, context):
                 "relevance_metrics": relevance_metrics
             }
         }
+        if session is not None:
+            response_body["metadata"]["session_id"] = session_id
+            response_body["metadata"]["retrieval_reused"] = retrieval_reused
         
         # Include warnings if any
         if guardrail_result.get("warnings"):
             response_body["warnings"] = guardrail_result["warnings"]
         
-        return {
+        response = {
             "statusCode": 200,
             "body": json.dumps(response_body),
             "headers": {
@@ -138,9 +464,29 @@ def lambda_handler(event, context):
                 "X-Request-ID": request_id
             }
         }
+        
+        # Step 7: Write the audit log after the response is built
+        with tracer.span("post_response"):
+            post_response.defer(
+                "chat_audit",
+                _evaluate_and_audit,
+                sec_context=sec_context,
+                question=safe_question,
+                answer=safe_answer,
+                context_texts=context_texts,
+                evaluate=evaluate,
+                relevance_metrics=relevance_metrics
+            )
+            post_response.complete()
+        
+        tracer.finish()
+        response["headers"]["Server-Timing"] = tracer.server_timing()
+        tracer.emit_metrics()
+        return response
     
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}", exc_info=True)
+        tracer.emit_metrics()
         return {
             "statusCode": 500,
             "body": json.dumps({
@@ -148,3 +494,7 @@ def lambda_handler(event, context):
                 "request_id": request_id
             })
         }
+    
+    finally:
+        # The container may be frozen as soon as the handler returns
+        flush_audit()
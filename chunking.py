@@ -1,5 +1,36 @@
 import re
-from typing import List, Dict
+import codecs
+import hashlib
+import zlib
+from functools import lru_cache
+from typing import List, Dict, Iterable, Iterator, Callable, Optional, Tuple
+
+# Text -> estimated token count
+TokenEstimator = Callable[[str], int]
+
+# Paragraph separator: a blank line (optionally containing whitespace)
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+# Sentence boundary: terminal punctuation (optionally closed by a quote or
+# bracket) followed by whitespace and a capital/digit, or CJK terminal
+# punctuation, which is not followed by a space. Common title
+# abbreviations are not boundaries.
+SENTENCE_BREAK = re.compile(
+    r"(?<!\b(?:Mr|Ms|Dr|St|Jr|Sr|vs|No)\.)(?<!\bMrs\.)"
+    r"(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+(?=[\"'(\[]?[A-Z0-9\u00C0-\u024F])"
+    r"|(?<=[\u3002\uff01\uff1f])\s*"
+)
+
+# Pieces a BPE tokenizer will not merge across: ASCII words, digit runs,
+# other scripts, and single symbols. Whitespace is folded into the next piece.
+TOKEN_PIECE = re.compile(r"[A-Za-z]+|[0-9]+|[^\W\d_A-Za-z]+|\S")
+
+# Bytes pulled from the underlying stream per read
+STREAM_READ_SIZE = 64 * 1024
+
+# Content-defined chunking: the gear hash covers the last 32 words
+_GEAR_BITS = 32
+_GEAR_MASK = (1 << _GEAR_BITS) - 1
 
 
 def approximate_token_count(text: str) -> int:
@@ -10,81 +41,607 @@ def approximate_token_count(text: str) -> int:
     return max(1, len(text) // 4)
 
 
+def content_hash(text: str) -> str:
+    """
+    Stable content hash of a chunk, used as its storage key.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Frequent English words that are a single token in common vocabularies
+COMMON_WORDS = frozenset("""
+a about after all also an and any are as at be because been but by can
+could data do document does each first for from has have he her his how
+i if in information into is it its just like made make many may more most
+my new no not now of on one only or other our out over people said see
+she should so some such than that the their them then there these they
+this through time to two up use used using was way we well were what when
+where which while who will with would you your
+""".split())
+
+
+class VocabularyTokenEstimator:
+    """
+    Cached vocabulary-based token estimate.
+
+    Splits text into the pieces a BPE tokenizer keeps apart and prices each
+    piece: common words cost one token, other words roughly one per five
+    letters, digits one per three, CJK one per character, and other
+    scripts one per three characters. Piece costs are memoized, so repeated
+    vocabulary is a dictionary lookup. Counts are additive across
+    whitespace, which lets chunkers keep running totals.
+    """
+
+    def __init__(self, vocabulary: Iterable[str] = COMMON_WORDS, cache_size: int = 65536):
+        self.vocabulary = frozenset(w.lower() for w in vocabulary)
+        self._piece_tokens = lru_cache(maxsize=cache_size)(self._price_piece)
+
+    def _price_piece(self, piece: str) -> int:
+        first = piece[0]
+        if first.isascii():
+            if first.isalpha():
+                if len(piece) <= 3 or piece.lower() in self.vocabulary:
+                    return 1
+                return max(1, (len(piece) + 2) // 5)
+            if first.isdigit():
+                return (len(piece) + 2) // 3
+            return 1
+        if first >= "\u2e80":
+            # CJK and later blocks: roughly one token per character
+            return len(piece)
+        return max(1, (len(piece) + 2) // 3)
+
+    def __call__(self, text: str) -> int:
+        pieces = TOKEN_PIECE.findall(text)
+        if not pieces:
+            return 1
+        price = self._piece_tokens
+        return sum(price(piece) for piece in pieces)
+
+
 def split_into_paragraphs(text: str) -> List[str]:
     """
     Splits text into paragraphs using double newlines.
     Cleans excessive whitespace.
     """
-    paragraphs = re.split(r"\n\s*\n", text)
+    paragraphs = PARAGRAPH_BREAK.split(text)
     return [p.strip() for p in paragraphs if p.strip()]
 
 
-def chunk_text(
-    text: str,
+def split_into_sentences(paragraph: str) -> List[str]:
+    """
+    Splits a paragraph into sentences on terminal punctuation.
+    """
+    sentences = SENTENCE_BREAK.split(paragraph)
+    return [s.strip() for s in sentences if s.strip()]
+
+
+def iter_paragraphs(
+    stream,
+    encoding: str = "utf-8",
+    read_size: int = STREAM_READ_SIZE
+) -> Iterator[str]:
+    """
+    Incrementally decode a byte stream and yield paragraphs as they complete.
+
+    Produces the same paragraphs as split_into_paragraphs() on the fully
+    decoded text, but only the paragraph currently being read is buffered.
+
+    Args:
+        stream: File-like object with read(size) returning bytes
+            (e.g. an S3 StreamingBody)
+        encoding: Text encoding of the stream
+        read_size: Number of bytes to read per call
+
+    Yields:
+        Stripped, non-empty paragraphs
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    parts = []   # Body of the paragraph in progress
+    carry = ""   # Trailing whitespace a separator may start in
+
+    while True:
+        raw = stream.read(read_size)
+        data = decoder.decode(raw or b"", final=not raw)
+
+        if data:
+            text = carry + data
+            start = 0
+
+            for match in PARAGRAPH_BREAK.finditer(text):
+                paragraph = ("".join(parts) + text[start:match.start()]).strip()
+                if paragraph:
+                    yield paragraph
+                parts = []
+                start = match.end()
+
+            # A separator can only begin inside trailing whitespace, so keep
+            # that back and scan it again together with the next read
+            remainder = text[start:]
+            body = remainder.rstrip()
+            carry = remainder[len(body):]
+            if body:
+                parts.append(body)
+
+        if not raw:
+            break
+
+    paragraph = "".join(parts).strip()
+    if paragraph:
+        yield paragraph
+
+
+def _overlap_words(words: List[str], overlap_tokens: int) -> List[str]:
+    """Trailing words carried into the next chunk"""
+    if overlap_tokens <= 0:
+        return []
+    return words[-overlap_tokens:]
+
+
+class _RunningCount:
+    """
+    Incremental token count of words joined with separators.
+
+    The default estimator is tracked exactly by character count; any other
+    estimator is assumed additive and summed per word.
+    """
+
+    def __init__(self, estimator: TokenEstimator):
+        self.estimator = estimator
+        self.by_chars = estimator is approximate_token_count
+        self.reset()
+
+    def reset(self, words: Iterable[Tuple[str, str]] = ()):
+        self.chars = 0
+        self.summed = 0
+        self.empty = True
+        for word, separator in words:
+            self.add(word, separator)
+
+    def _cost(self, word: str, separator: str) -> Tuple[int, int]:
+        chars = len(word) + (0 if self.empty else len(separator))
+        return chars, (0 if self.by_chars else self.estimator(word))
+
+    def add(self, word: str, separator: str = " "):
+        chars, tokens = self._cost(word, separator)
+        self.chars += chars
+        self.summed += tokens
+        self.empty = False
+
+    def tokens_with(self, word: str, separator: str = " ") -> int:
+        chars, tokens = self._cost(word, separator)
+        if self.by_chars:
+            return max(1, (self.chars + chars) // 4)
+        return self.summed + tokens
+
+    @property
+    def tokens(self) -> int:
+        if self.by_chars:
+            return max(1, self.chars // 4)
+        return self.summed
+
+
+def _hard_split(
+    words: List[str],
+    max_tokens: int,
+    overlap_tokens: int,
+    first_new: int = 0,
+    estimator: TokenEstimator = approximate_token_count
+) -> Iterator[Tuple[int, int, bool]]:
+    """
+    Split a word list into spans of roughly max_tokens each.
+
+    Keeps a running count instead of re-joining the span after every word,
+    so the split is linear in the number of words. Each span after the
+    first starts with up to overlap_tokens words of the previous one.
+
+    Args:
+        words: Words to split
+        max_tokens: Token budget per span
+        overlap_tokens: Words repeated at the start of the next span
+        first_new: Index of the first word not already emitted elsewhere
+            (words before it are overlap seed)
+        estimator: Token estimator
+
+    Yields:
+        (start, end, full) word index spans; the last span is yielded with
+        full=False when it ends under budget
+    """
+    running = _RunningCount(estimator)
+    start = 0
+    next_new = first_new
+
+    for i, word in enumerate(words):
+        running.add(word)
+
+        if i >= next_new and running.tokens >= max_tokens:
+            yield start, i + 1, True
+            next_new = i + 1
+
+            # Restart from the overlap, always moving forward
+            start = max(next_new - max(overlap_tokens, 0), start + 1)
+            running.reset((w, " ") for w in words[start:next_new])
+
+    # Trailing words that never reached the budget
+    if next_new < len(words):
+        yield start, len(words), False
+
+
+def chunk_paragraphs(
+    paragraphs: Iterable[str],
     max_tokens: int = 500,
-    overlap_tokens: int = 50
-) -> List[Dict]:
+    overlap_tokens: int = 50,
+    estimator: Optional[TokenEstimator] = None
+) -> Iterator[Dict]:
     """
-    Chunk text into overlapping segments based on approximate token size.
+    Chunk a stream of paragraphs into overlapping segments.
 
-    Returns list of:
+    Generator core shared by chunk_text() and chunk_stream(); chunks are
+    yielded as soon as they are finalized. Uses approximate_token_count()
+    unless another estimator is given.
+
+    Yields:
     {
         "chunk_id": int,
         "text": str,
         "token_estimate": int
     }
     """
-
-    paragraphs = split_into_paragraphs(text)
-
-    chunks = []
+    estimator = estimator or approximate_token_count
     current_chunk = ""
     current_tokens = 0
     chunk_id = 0
 
     for paragraph in paragraphs:
-        paragraph_tokens = approximate_token_count(paragraph)
+        paragraph_tokens = estimator(paragraph)
 
         # If paragraph alone exceeds max, hard split
         if paragraph_tokens > max_tokens:
-            words = paragraph.split()
-            temp_chunk = []
-            for word in words:
-                temp_chunk.append(word)
-                if approximate_token_count(" ".join(temp_chunk)) >= max_tokens:
-                    chunk_text_block = " ".join(temp_chunk)
-                    chunks.append({
+            # Finalize pending text first so chunks stay in document order
+            seed = []
+            if current_chunk.strip():
+                yield {
+                    "chunk_id": chunk_id,
+                    "text": current_chunk.strip(),
+                    "token_estimate": current_tokens
+                }
+                chunk_id += 1
+                seed = _overlap_words(current_chunk.split(), overlap_tokens)
+
+            words = seed + paragraph.split()
+            current_chunk = ""
+            current_tokens = 0
+
+            spans = _hard_split(words, max_tokens, overlap_tokens, len(seed), estimator)
+            for start, end, full in spans:
+                chunk_text_block = " ".join(words[start:end])
+                if full:
+                    yield {
                         "chunk_id": chunk_id,
                         "text": chunk_text_block,
-                        "token_estimate": approximate_token_count(chunk_text_block)
-                    })
+                        "token_estimate": estimator(chunk_text_block)
+                    }
                     chunk_id += 1
-                    temp_chunk = []
+                else:
+                    # Leftover words seed the next chunk instead of being dropped
+                    current_chunk = chunk_text_block
+                    current_tokens = estimator(current_chunk)
             continue
 
         # If adding paragraph exceeds max_tokens, finalize current chunk
         if current_tokens + paragraph_tokens > max_tokens:
-            chunks.append({
+            yield {
                 "chunk_id": chunk_id,
                 "text": current_chunk.strip(),
                 "token_estimate": current_tokens
-            })
+            }
             chunk_id += 1
 
             # Start new chunk with overlap
-            overlap_text = current_chunk.split()[-overlap_tokens:]
+            overlap_text = _overlap_words(current_chunk.split(), overlap_tokens)
             current_chunk = " ".join(overlap_text) + "\n\n" + paragraph
-            current_tokens = approximate_token_count(current_chunk)
+            current_tokens = estimator(current_chunk)
         else:
             current_chunk += "\n\n" + paragraph
-            current_tokens = approximate_token_count(current_chunk)
+            current_tokens = estimator(current_chunk)
 
     # Add final chunk
     if current_chunk.strip():
-        chunks.append({
+        yield {
             "chunk_id": chunk_id,
             "text": current_chunk.strip(),
             "token_estimate": current_tokens
-        })
+        }
+
+
+def _fit_units(text: str, tokens: int, max_tokens: int, estimator: TokenEstimator) -> Iterator[Tuple[str, int]]:
+    """Chop a single word that exceeds the budget into character slices"""
+    if tokens <= max_tokens:
+        yield text, tokens
+        return
+    step = max(1, len(text) * max_tokens // tokens)
+    for i in range(0, len(text), step):
+        piece = text[i:i + step]
+        yield piece, estimator(piece)
+
+
+def _iter_sentence_units(
+    paragraphs: Iterable[str],
+    max_tokens: int,
+    estimator: TokenEstimator
+) -> Iterator[Tuple[str, int, str]]:
+    """
+    Yield (text, tokens, separator) packing units: whole sentences, or the
+    words of a sentence that would not fit in a chunk on its own.
+    """
+    for paragraph in paragraphs:
+        separator = "\n\n"
+        for sentence in split_into_sentences(paragraph):
+            tokens = estimator(sentence)
+            if tokens <= max_tokens:
+                yield sentence, tokens, separator
+            else:
+                for word in sentence.split():
+                    piece_separator = separator
+                    for piece, piece_tokens in _fit_units(word, estimator(word), max_tokens, estimator):
+                        yield piece, piece_tokens, piece_separator
+                        piece_separator = ""
+                    separator = " "
+            separator = " "
+
+
+def chunk_sentences(
+    paragraphs: Iterable[str],
+    max_tokens: int = 500,
+    overlap_tokens: int = 50,
+    estimator: Optional[TokenEstimator] = None,
+    min_fill: float = 0.8
+) -> Iterator[Dict]:
+    """
+    Sentence-aware chunking that packs whole sentences up to the budget.
+
+    Chunk size adapts to content density: the budget is counted with the
+    token estimator sentence by sentence, so token-dense text (code, numbers,
+    CJK) gets fewer characters per chunk and plain prose gets more. A chunk
+    never exceeds max_tokens; once it is min_fill full it is closed at the
+    next paragraph break rather than splitting a paragraph. Overlap is
+    whole trailing sentences totalling at most overlap_tokens.
+
+    Uses VocabularyTokenEstimator unless another estimator is given.
+
+    Yields:
+    {
+        "chunk_id": int,
+        "text": str,
+        "token_estimate": int
+    }
+    """
+    estimator = estimator or DEFAULT_SENTENCE_ESTIMATOR
+    units = []   # (text, tokens, separator)
+    total = 0
+    chunk_id = 0
+
+    def render(batch):
+        return "".join(
+            (sep if i else "") + text for i, (text, _, sep) in enumerate(batch)
+        )
+
+    def finalize(batch):
+        # Running totals are exact for additive estimators; re-check the
+        # rendered text so other estimators cannot overshoot either
+        text = render(batch)
+        tokens = estimator(text)
+        carried = []
+        while tokens > max_tokens and len(batch) > 1:
+            carried.insert(0, batch.pop())
+            text = render(batch)
+            tokens = estimator(text)
+        return text, tokens, carried
+
+    for unit in _iter_sentence_units(paragraphs, max_tokens, estimator):
+        _, unit_tokens, separator = unit
+        full = total + unit_tokens > max_tokens
+        early = separator == "\n\n" and total >= max_tokens * min_fill
+
+        if units and (full or early):
+            pending = units
+            while True:
+                text, tokens, carried = finalize(pending)
+                yield {"chunk_id": chunk_id, "text": text, "token_estimate": tokens}
+                chunk_id += 1
+
+                # Overlap with trailing sentences, dropped first if they
+                # would crowd out the incoming unit
+                overlap = []
+                overlap_total = 0
+                for prev in reversed(pending):
+                    if overlap_total + prev[1] > overlap_tokens:
+                        break
+                    overlap.insert(0, prev)
+                    overlap_total += prev[1]
+
+                units = overlap + carried
+                total = sum(u[1] for u in units)
+                while overlap and total + unit_tokens > max_tokens:
+                    total -= units.pop(0)[1]
+                    overlap.pop(0)
+
+                if not carried or total + unit_tokens <= max_tokens:
+                    break
+                # Units held back by finalize() still leave no room
+                pending = units
+
+        units.append(unit)
+        total += unit_tokens
+
+    pending = units
+    while pending:
+        text, tokens, pending = finalize(pending)
+        yield {"chunk_id": chunk_id, "text": text, "token_estimate": tokens}
+        chunk_id += 1
+
+
+def chunk_content_defined(
+    paragraphs: Iterable[str],
+    max_tokens: int = 500,
+    overlap_tokens: int = 50,
+    estimator: Optional[TokenEstimator] = None,
+    min_tokens: Optional[int] = None,
+    avg_tokens: Optional[int] = None
+) -> Iterator[Dict]:
+    """
+    Content-defined chunking with rolling-hash boundaries.
+
+    A gear hash over the last 32 words decides where chunks end, so
+    boundaries depend only on nearby content: an edit moves the boundaries
+    around it and the rest of the document re-chunks to identical text
+    (and identical content_hash values). Chunks hold at least min_tokens,
+    average about avg_tokens and never exceed max_tokens, which forces a
+    boundary (a single word longer than max_tokens is a chunk of its own).
+    Each chunk starts with the last overlap_tokens words of the previous
+    one, fewer if they would leave no room for the next word.
+
+    Uses approximate_token_count() unless another estimator is given.
+
+    Yields:
+    {
+        "chunk_id": int,
+        "text": str,
+        "token_estimate": int
+    }
+    """
+    estimator = estimator or approximate_token_count
+    min_tokens = max_tokens // 4 if min_tokens is None else min_tokens
+    avg_tokens = max_tokens // 2 if avg_tokens is None else avg_tokens
+
+    # Boundary when the top bits of the hash are zero: about one in
+    # 2**bits words once a chunk holds min_tokens
+    bits = max(1, max(2, avg_tokens - min_tokens).bit_length() - 1)
+    boundary_mask = ((1 << bits) - 1) << (_GEAR_BITS - bits)
+
+    units = []   # (word, separator) of the chunk in progress
+    running = _RunningCount(estimator)
+    fresh = 0    # Words added since the last chunk was emitted
+    gear = 0
+    chunk_id = 0
+
+    def emit():
+        nonlocal units, fresh
+        text = "".join((sep if i else "") + word for i, (word, sep) in enumerate(units))
+        keep = min(max(overlap_tokens, 0), len(units) - 1)
+        units = units[len(units) - keep:] if keep else []
+        running.reset(units)
+        fresh = 0
+        return text
+
+    for paragraph in paragraphs:
+        separator = "\n\n"
+        for word in paragraph.split():
+            if running.tokens_with(word, separator) > max_tokens:
+                if fresh:
+                    text = emit()
+                    yield {"chunk_id": chunk_id, "text": text, "token_estimate": estimator(text)}
+                    chunk_id += 1
+                # Drop carried-over words until the next word fits
+                while units and running.tokens_with(word, separator) > max_tokens:
+                    units = units[1:]
+                    running.reset(units)
+
+            units.append((word, separator))
+            running.add(word, separator)
+            fresh += 1
+            separator = " "
+
+            gear = ((gear << 1) + zlib.crc32(word.encode("utf-8"))) & _GEAR_MASK
+            if gear & boundary_mask == 0 and running.tokens >= min_tokens:
+                text = emit()
+                yield {"chunk_id": chunk_id, "text": text, "token_estimate": estimator(text)}
+                chunk_id += 1
+
+    if fresh:
+        text = emit()
+        yield {"chunk_id": chunk_id, "text": text, "token_estimate": estimator(text)}
+
+
+DEFAULT_SENTENCE_ESTIMATOR = VocabularyTokenEstimator()
+
+# Chunking strategies selectable by name (e.g. from configuration)
+CHUNKING_STRATEGIES = {
+    "paragraph": chunk_paragraphs,
+    "sentence": chunk_sentences,
+    "content_defined": chunk_content_defined,
+}
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = 500,
+    overlap_tokens: int = 50,
+    estimator: Optional[TokenEstimator] = None
+) -> List[Dict]:
+    """
+    Chunk text into overlapping segments based on approximate token size.
+
+    Returns list of:
+    {
+        "chunk_id": int,
+        "text": str,
+        "token_estimate": int
+    }
+    """
+    paragraphs = split_into_paragraphs(text)
+    return list(chunk_paragraphs(paragraphs, max_tokens, overlap_tokens, estimator))
+
+
+def chunk_by_sentences(
+    text: str,
+    max_tokens: int = 500,
+    overlap_tokens: int = 50,
+    estimator: Optional[TokenEstimator] = None
+) -> List[Dict]:
+    """
+    Chunk text on sentence boundaries; see chunk_sentences().
+    """
+    paragraphs = split_into_paragraphs(text)
+    return list(chunk_sentences(paragraphs, max_tokens, overlap_tokens, estimator))
+
+
+def chunk_stream(
+    stream,
+    max_tokens: int = 500,
+    overlap_tokens: int = 50,
+    transform: Optional[Callable[[str], str]] = None,
+    encoding: str = "utf-8",
+    read_size: int = STREAM_READ_SIZE,
+    strategy: str = "paragraph",
+    estimator: Optional[TokenEstimator] = None
+) -> Iterator[Dict]:
+    """
+    Chunk a byte stream without materializing the whole document.
+
+    Peak memory is bounded by the largest paragraph rather than the
+    document size. With the default strategy, chunks match chunk_text() on
+    the decoded text.
+
+    Args:
+        stream: File-like object with read(size) returning bytes
+        max_tokens: Maximum tokens per chunk
+        overlap_tokens: Words carried over between chunks
+        transform: Optional per-paragraph transform (e.g. mask_pii)
+        encoding: Text encoding of the stream
+        read_size: Number of bytes to read per call
+        strategy: Key of CHUNKING_STRATEGIES
+        estimator: Optional token estimator passed to the strategy
+
+    Yields:
+        Chunk dictionaries in document order
+    """
+    if strategy not in CHUNKING_STRATEGIES:
+        raise ValueError(f"Unknown chunking strategy: {strategy}")
+
+    paragraphs = iter_paragraphs(stream, encoding, read_size)
+    if transform is not None:
+        paragraphs = (transform(p) for p in paragraphs)
 
-    return chunks
+    chunker = CHUNKING_STRATEGIES[strategy]
+    yield from chunker(paragraphs, max_tokens, overlap_tokens, estimator)
@@ -0,0 +1,218 @@
+"""
+Multi-turn conversation sessions
+- Sessions stored per tenant and user next to the tenant's vectors
+- Rolling history: recent turns verbatim, older turns compressed to a
+  short summary, the oldest reduced to the chunk ids they cited
+- Cached retrieval results reused by follow-up questions
+
+Compression is incremental and extractive: each turn is compressed once,
+when it leaves the recent window, without another model call.
+"""
+
+import os
+import re
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from chunking import approximate_token_count, split_into_sentences
+from security import sanitize_document_id
+
+# Turns kept verbatim in the prompt
+CONVERSATION_RECENT_TURNS = int(os.environ.get("CONVERSATION_RECENT_TURNS", "3"))
+# Compressed turns kept as summaries; older ones keep only chunk ids
+CONVERSATION_MAX_SUMMARIES = int(os.environ.get("CONVERSATION_MAX_SUMMARIES", "10"))
+# Estimated tokens per summarized answer
+CONVERSATION_SUMMARY_TOKENS = int(os.environ.get("CONVERSATION_SUMMARY_TOKENS", "60"))
+CONVERSATION_MAX_CITED = int(os.environ.get("CONVERSATION_MAX_CITED", "200"))
+
+# A follow-up reuses the previous retrieval when its embedding is at
+# least this similar to the query that produced it
+RETRIEVAL_REUSE_THRESHOLD = float(os.environ.get("RETRIEVAL_REUSE_THRESHOLD", "0.85"))
+RETRIEVAL_CACHE_TTL = float(os.environ.get("RETRIEVAL_CACHE_TTL", "900"))
+
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def validate_session_id(session_id: str) -> str:
+    """
+    Validate a client-supplied session ID (used in S3 keys)
+
+    Raises:
+        ValueError: If the ID is not 1-64 alphanumerics, hyphens or underscores
+    """
+    if not isinstance(session_id, str) or not SESSION_ID.match(session_id):
+        raise ValueError("Invalid session_id: must be 1-64 alphanumerics, hyphens or underscores")
+    return session_id
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def session_user_id(user_id: str) -> str:
+    """User ID as used in session keys"""
+    return sanitize_document_id(user_id or "anonymous")
+
+
+def new_session(tenant_id: str, user_id: str, session_id: str) -> Dict:
+    """Empty session dictionary"""
+    return {
+        "session_id": session_id,
+        "tenant_id": tenant_id,
+        "user_id": user_id,
+        "turn_count": 0,
+        "full_history_tokens": 0,
+        "turns": [],
+        "summaries": [],
+        "cited_chunk_ids": [],
+        "retrieval": None,
+        "updated_at": time.time()
+    }
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Leading sentences of `text` within `max_tokens` (at least one, cut by words)"""
+    kept = []
+    used = 0
+    for sentence in split_into_sentences(" ".join(text.split())):
+        tokens = approximate_token_count(sentence)
+        if used + tokens > max_tokens:
+            if not kept:
+                kept.append(sentence[:max_tokens * 4].rsplit(" ", 1)[0] + " ...")
+            break
+        kept.append(sentence)
+        used += tokens
+    return " ".join(kept)
+
+
+def chunk_ref(chunk: Dict) -> str:
+    """Stable reference of a retrieved chunk: doc_id/chunk_id"""
+    return f"{chunk.get('doc_id')}/{chunk.get('chunk_id')}"
+
+
+def summarize_turn(turn: Dict) -> Dict:
+    """Compressed form of a turn leaving the recent window"""
+    return {
+        "question": _truncate(turn["question"], CONVERSATION_SUMMARY_TOKENS // 2),
+        "answer": _truncate(turn["answer"], CONVERSATION_SUMMARY_TOKENS),
+        "chunk_ids": turn.get("chunk_ids", [])
+    }
+
+
+def add_turn(session: Dict, question: str, answer: str, chunk_ids: List[str]):
+    """
+    Append a turn and compress the history incrementally
+
+    Args:
+        session: Session dictionary (modified in place)
+        question: Question as sent to the model
+        answer: Sanitized answer
+        chunk_ids: chunk_ref() of the chunks the answer was based on
+    """
+    session["turns"].append({
+        "question": question,
+        "answer": answer,
+        "chunk_ids": chunk_ids,
+        "created_at": time.time()
+    })
+    session["turn_count"] = session.get("turn_count", 0) + 1
+    session["full_history_tokens"] = (
+        session.get("full_history_tokens", 0)
+        + approximate_token_count(question) + approximate_token_count(answer)
+    )
+
+    while len(session["turns"]) > CONVERSATION_RECENT_TURNS:
+        session["summaries"].append(summarize_turn(session["turns"].pop(0)))
+
+    while len(session["summaries"]) > CONVERSATION_MAX_SUMMARIES:
+        oldest = session["summaries"].pop(0)
+        cited = session["cited_chunk_ids"]
+        cited.extend(ref for ref in oldest["chunk_ids"] if ref not in cited)
+        del cited[:-CONVERSATION_MAX_CITED]
+
+    session["updated_at"] = time.time()
+
+
+def format_history(session: Optional[Dict]) -> str:
+    """
+    History section of the prompt: summaries, then recent turns verbatim
+
+    Returns:
+        History text ("" for a new session)
+    """
+    if not session:
+        return ""
+
+    lines = []
+    omitted = session.get("turn_count", 0) - len(session["turns"]) - len(session["summaries"])
+    if omitted > 0:
+        lines.append(f"({omitted} earlier turn(s) omitted)")
+    for summary in session["summaries"]:
+        lines.append(f"User: {summary['question']}")
+        lines.append(f"Assistant (summary): {summary['answer']}")
+    for turn in session["turns"]:
+        lines.append(f"User: {turn['question']}")
+        lines.append(f"Assistant: {turn['answer']}")
+    return "\n".join(lines)
+
+
+def cache_retrieval(session: Dict, query_embedding: list, chunks: List[Dict]):
+    """
+    Keep the latest retrieval for follow-up questions
+
+    Args:
+        session: Session dictionary (modified in place)
+        query_embedding: Embedding of the query that was searched
+        chunks: Retrieved chunks (VectorIndex.search() results)
+    """
+    session["retrieval"] = {
+        "embedding": [round(float(x), 6) for x in query_embedding],
+        "chunks": [
+            {
+                "text": c.get("text", ""),
+                "similarity": c.get("similarity", 0.0),
+                "doc_id": c.get("doc_id"),
+                "chunk_id": c.get("chunk_id"),
+                # Text is stored once, at the top level
+                "metadata": {k: v for k, v in c.get("metadata", {}).items() if k != "text"}
+            }
+            for c in chunks
+        ],
+        "cached_at": time.time()
+    }
+
+
+def cached_retrieval(session: Optional[Dict], query_embedding: list) -> Optional[List[Dict]]:
+    """
+    Previous retrieval results, if they apply to this query
+
+    Returns:
+        Cached chunks, or None when a new retrieval is needed
+    """
+    cached = (session or {}).get("retrieval")
+    if not cached or not cached["chunks"]:
+        return None
+    if time.time() - cached["cached_at"] > RETRIEVAL_CACHE_TTL:
+        return None
+
+    previous = np.asarray(cached["embedding"], dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(previous) * np.linalg.norm(query)
+    if norms == 0 or float(previous @ query) / norms < RETRIEVAL_REUSE_THRESHOLD:
+        return None
+    return cached["chunks"]
+
+
+def history_stats(session: Optional[Dict]) -> Dict:
+    """Compressed history size against resending every turn verbatim"""
+    if not session:
+        return {"turns": 0, "history_tokens": 0, "full_history_tokens": 0}
+    history = format_history(session)
+    return {
+        "turns": session.get("turn_count", 0),
+        "history_tokens": approximate_token_count(history) if history else 0,
+        "full_history_tokens": session.get("full_history_tokens", 0)
+    }
@@ -0,0 +1,416 @@
+"""
+Cross-document chunk deduplication for RAG ingest
+- Normalized chunk-text hashing
+- MinHash signatures for near-duplicate detection
+- Per-tenant dedup index with LSH banding, in memory or stored in
+  DynamoDB one item per chunk
+"""
+
+import hashlib
+import re
+import threading
+import zlib
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+WHITESPACE = re.compile(r"\s+")
+
+# MinHash parameters: 64 permutations split into 8 bands of 8 rows.
+# Chunks become LSH candidates around Jaccard ~0.77 and are then verified
+# against the configured threshold.
+NUM_PERM = 64
+LSH_BANDS = 8
+SHINGLE_SIZE = 3
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Fixed seed: signatures must be comparable across invocations
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+
+
+def normalize_chunk_text(text: str) -> str:
+    """
+    Normalize chunk text for duplicate detection.
+    Case-folds and collapses whitespace.
+    """
+    return WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def normalized_hash(text: str) -> str:
+    """
+    Hash of the normalized chunk text.
+    Copies differing only in case or whitespace share a hash.
+    """
+    return hashlib.sha256(normalize_chunk_text(text).encode("utf-8")).hexdigest()
+
+
+def minhash_signature(text: str, shingle_size: int = SHINGLE_SIZE) -> List[int]:
+    """
+    MinHash signature over word shingles of the normalized text
+
+    Args:
+        text: Chunk text
+        shingle_size: Words per shingle
+
+    Returns:
+        List of NUM_PERM integers
+    """
+    words = normalize_chunk_text(text).split()
+    if len(words) <= shingle_size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {
+            " ".join(words[i:i + shingle_size])
+            for i in range(len(words) - shingle_size + 1)
+        }
+
+    hashes = np.array(
+        [zlib.crc32(s.encode("utf-8")) for s in shingles],
+        dtype=np.uint64
+    )
+
+    # One row per permutation, minimum over shingles
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+    return [int(v) for v in permuted.min(axis=1)]
+
+
+def estimate_jaccard(sig1: List[int], sig2: List[int]) -> float:
+    """
+    Estimate Jaccard similarity from two MinHash signatures
+
+    Returns:
+        Fraction of matching signature positions (0-1)
+    """
+    if not sig1 or len(sig1) != len(sig2):
+        return 0.0
+
+    return sum(1 for a, b in zip(sig1, sig2) if a == b) / len(sig1)
+
+
+def _band_keys(signature: List[int]) -> List[str]:
+    rows = len(signature) // LSH_BANDS
+    return [
+        f"{band}:{hashlib.md5(repr(signature[band * rows:(band + 1) * rows]).encode()).hexdigest()[:16]}"
+        for band in range(LSH_BANDS)
+    ]
+
+
+class DedupIndex:
+    """
+    Per-tenant index of embedded chunks keyed by normalized text hash.
+
+    Each entry points at the stored vector (doc_id, chunk_id) and lists the
+    documents referencing it, so a vector is only deleted once nothing uses
+    it. Safe to share between threads; chunks being embedded can be
+    claimed so concurrent ingests wait for one embedding instead of
+    each computing their own.
+    """
+
+    def __init__(self, entries: Dict = None, lsh: Dict = None):
+        self.entries = entries or {}
+        self.lsh = lsh or {}
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+
+    def lookup(
+        self,
+        norm_hash: str,
+        signature: List[int] = None,
+        threshold: float = 0.0
+    ) -> Optional[str]:
+        """
+        Find an embedded chunk to reuse
+
+        Args:
+            norm_hash: Normalized hash of the new chunk
+            signature: Optional MinHash signature for near-duplicate lookup
+            threshold: Minimum estimated Jaccard similarity for a near match
+
+        Returns:
+            Normalized hash of the matching entry, or None
+        """
+        with self._lock:
+            if norm_hash in self.entries:
+                return norm_hash
+
+            if not signature or threshold <= 0:
+                return None
+
+            best, best_score = None, threshold
+            for band_key in _band_keys(signature):
+                for candidate in self.lsh.get(band_key, []):
+                    entry = self.entries.get(candidate)
+                    if not entry or "signature" not in entry:
+                        continue
+                    score = estimate_jaccard(signature, entry["signature"])
+                    if score >= best_score:
+                        best, best_score = candidate, score
+
+            return best
+
+    def claim(self, norm_hash: str) -> Optional[Future]:
+        """
+        Claim the embedding of a chunk that is not in the index yet
+
+        Returns:
+            None if the caller now owns the claim and must release() it,
+            otherwise a future resolving to True once the owner has added
+            the entry (False if the owner failed)
+        """
+        with self._lock:
+            if norm_hash in self._in_flight:
+                return self._in_flight[norm_hash]
+            self._in_flight[norm_hash] = Future()
+            return None
+
+    def release(self, norm_hash: str, added: bool):
+        """Release a claim, waking ingests waiting on it"""
+        with self._lock:
+            future = self._in_flight.pop(norm_hash, None)
+        if future is not None:
+            future.set_result(added)
+
+    def get(self, norm_hash: str) -> Optional[Dict]:
+        """Return an entry by normalized hash"""
+        with self._lock:
+            return self.entries.get(norm_hash)
+
+    def add(
+        self,
+        norm_hash: str,
+        doc_id: str,
+        chunk_id: str,
+        signature: List[int] = None
+    ) -> bool:
+        """
+        Register a newly embedded chunk owned by doc_id
+
+        Returns:
+            False if another document registered the same chunk first; the
+            existing entry is kept and doc_id is added as a reference
+        """
+        with self._lock:
+            if norm_hash in self.entries:
+                refs = self.entries[norm_hash]["refs"]
+                if doc_id not in refs:
+                    refs.append(doc_id)
+                return False
+
+            entry = {"doc_id": doc_id, "chunk_id": chunk_id, "refs": [doc_id]}
+            if signature:
+                entry["signature"] = signature
+                for band_key in _band_keys(signature):
+                    self.lsh.setdefault(band_key, []).append(norm_hash)
+            self.entries[norm_hash] = entry
+            return True
+
+    def add_ref(self, norm_hash: str, doc_id: str) -> bool:
+        """
+        Record that doc_id reuses an existing entry
+
+        Returns:
+            False if the entry no longer exists (its vector was released)
+        """
+        with self._lock:
+            entry = self.entries.get(norm_hash)
+            if entry is None:
+                return False
+            if doc_id not in entry["refs"]:
+                entry["refs"].append(doc_id)
+            return True
+
+    def remove_ref(self, norm_hash: str, doc_id: str) -> Optional[Dict]:
+        """
+        Drop doc_id's reference to an entry
+
+        Returns:
+            The removed entry if no references remain (its vector can be
+            deleted), otherwise None
+        """
+        with self._lock:
+            entry = self.entries.get(norm_hash)
+            if entry is None:
+                return None
+
+            if doc_id in entry["refs"]:
+                entry["refs"].remove(doc_id)
+            if entry["refs"]:
+                return None
+
+            del self.entries[norm_hash]
+            if entry.get("signature"):
+                for band_key in _band_keys(entry["signature"]):
+                    bucket = self.lsh.get(band_key, [])
+                    if norm_hash in bucket:
+                        bucket.remove(norm_hash)
+                    if not bucket:
+                        self.lsh.pop(band_key, None)
+            return entry
+
+
+def _condition_failed(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+
+class TableDedupIndex(DedupIndex):
+    """
+    Per-tenant dedup index stored in DynamoDB, one item per entry.
+
+    Entries are keyed (tenant_id, norm_hash) and hold doc_id, chunk_id,
+    the optional signature and refs, a string set of the referencing
+    documents. Every change is a single atomic update of one item, so
+    concurrent ingests of a tenant never overwrite each other's
+    references, and an entry is only deleted while nothing references
+    it. LSH bands are items keyed "lsh#<band key>" holding a string set
+    of normalized hashes. Claims stay in process.
+    """
+
+    LSH_PREFIX = "lsh#"
+
+    def __init__(self, table, tenant_id: str):
+        super().__init__()
+        self.table = table
+        self.tenant_id = tenant_id
+        self._signatures: Dict[str, List[int]] = {}  # Never change once stored
+
+    def _key(self, norm_hash: str) -> Dict:
+        return {"tenant_id": self.tenant_id, "norm_hash": norm_hash}
+
+    @staticmethod
+    def _entry(item: Dict) -> Dict:
+        entry = {
+            "doc_id": item["doc_id"],
+            "chunk_id": item["chunk_id"],
+            "refs": sorted(item.get("refs", ()))
+        }
+        if item.get("signature"):
+            entry["signature"] = [int(v) for v in item["signature"]]
+        return entry
+
+    def _signature(self, norm_hash: str) -> Optional[List[int]]:
+        if norm_hash not in self._signatures:
+            entry = self.get(norm_hash)
+            if entry is None:
+                return None
+            self._signatures[norm_hash] = entry.get("signature")
+        return self._signatures[norm_hash]
+
+    def _update_band(self, band_key: str, action: str, norm_hash: str):
+        self.table.update_item(
+            Key=self._key(self.LSH_PREFIX + band_key),
+            UpdateExpression=f"{action} #hashes :hash",
+            ExpressionAttributeNames={"#hashes": "hashes"},
+            ExpressionAttributeValues={":hash": {norm_hash}}
+        )
+
+    def lookup(
+        self,
+        norm_hash: str,
+        signature: List[int] = None,
+        threshold: float = 0.0
+    ) -> Optional[str]:
+        if self.get(norm_hash) is not None:
+            return norm_hash
+
+        if not signature or threshold <= 0:
+            return None
+
+        best, best_score = None, threshold
+        for band_key in _band_keys(signature):
+            band = self.table.get_item(Key=self._key(self.LSH_PREFIX + band_key)).get("Item", {})
+            for candidate in band.get("hashes", ()):
+                candidate_signature = self._signature(candidate)
+                if not candidate_signature:
+                    continue
+                score = estimate_jaccard(signature, candidate_signature)
+                if score >= best_score:
+                    best, best_score = candidate, score
+
+        return best
+
+    def get(self, norm_hash: str) -> Optional[Dict]:
+        item = self.table.get_item(Key=self._key(norm_hash)).get("Item")
+        if not item or "doc_id" not in item:
+            return None
+        return self._entry(item)
+
+    def add(
+        self,
+        norm_hash: str,
+        doc_id: str,
+        chunk_id: str,
+        signature: List[int] = None
+    ) -> bool:
+        update = "SET #doc_id = if_not_exists(#doc_id, :doc_id), #chunk_id = if_not_exists(#chunk_id, :chunk_id)"
+        names = {"#doc_id": "doc_id", "#chunk_id": "chunk_id", "#refs": "refs"}
+        values = {":doc_id": doc_id, ":chunk_id": chunk_id, ":ref": {doc_id}}
+        if signature:
+            update += ", #signature = if_not_exists(#signature, :signature)"
+            names["#signature"] = "signature"
+            values[":signature"] = signature
+        response = self.table.update_item(
+            Key=self._key(norm_hash),
+            UpdateExpression=update + " ADD #refs :ref",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_OLD"
+        )
+        if "doc_id" in response.get("Attributes", {}):
+            return False
+
+        if signature:
+            for band_key in _band_keys(signature):
+                self._update_band(band_key, "ADD", norm_hash)
+        return True
+
+    def add_ref(self, norm_hash: str, doc_id: str) -> bool:
+        try:
+            self.table.update_item(
+                Key=self._key(norm_hash),
+                UpdateExpression="ADD #refs :ref",
+                ConditionExpression="attribute_exists(#doc_id)",
+                ExpressionAttributeNames={"#refs": "refs", "#doc_id": "doc_id"},
+                ExpressionAttributeValues={":ref": {doc_id}}
+            )
+        except ClientError as e:
+            if _condition_failed(e):
+                return False
+            raise
+        return True
+
+    def remove_ref(self, norm_hash: str, doc_id: str) -> Optional[Dict]:
+        try:
+            response = self.table.update_item(
+                Key=self._key(norm_hash),
+                UpdateExpression="DELETE #refs :ref",
+                ConditionExpression="attribute_exists(#doc_id)",
+                ExpressionAttributeNames={"#refs": "refs", "#doc_id": "doc_id"},
+                ExpressionAttributeValues={":ref": {doc_id}},
+                ReturnValues="ALL_NEW"
+            )
+            item = response["Attributes"]
+            if item.get("refs"):
+                return None
+
+            # Fails if another document referenced the entry in the meantime
+            self.table.delete_item(
+                Key=self._key(norm_hash),
+                ConditionExpression="attribute_not_exists(#refs)",
+                ExpressionAttributeNames={"#refs": "refs"}
+            )
+        except ClientError as e:
+            if _condition_failed(e):
+                return None
+            raise
+
+        entry = self._entry(item)
+        if entry.get("signature"):
+            for band_key in _band_keys(entry["signature"]):
+                self._update_band(band_key, "DELETE", norm_hash)
+        return entry
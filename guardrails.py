@@ -7,8 +7,17 @@ Guardrails for RAG system
 - Cost budgeting
 """
 
+import logging
+import multiprocessing
+import os
 import re
-from typing import Dict, Tuple, Optional
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
+
+logger = logging.getLogger()
 
 
 class GuardrailViolation(Exception):
@@ -38,6 +47,133 @@ PII_PATTERNS = {
     "phone": r"\b\d{3}[-.]?\d{3}[-.]?\d{4}\b",
 }
 
+# Blocked terms applied when apply_guardrails() is not given a list
+# (comma-separated, case-insensitive)
+BLOCKED_TERMS = [t.strip() for t in os.environ.get("GUARDRAIL_BLOCKED_TERMS", "").split(",") if t.strip()]
+
+# Below this many blocked terms, per-term substring search (in C) beats
+# the automaton's per-character loop
+AUTOMATON_MIN_TERMS = int(os.environ.get("GUARDRAIL_AUTOMATON_MIN_TERMS", "150"))
+
+# Compiled once at import: every injection pattern in one alternation,
+# matched against lowercased text. Non-capturing groups and no
+# re.IGNORECASE keep the regex engine's first-character prefilter, which
+# either would disable (several times slower on long inputs).
+# re.IGNORECASE also matches two characters that str.lower() keeps,
+# dotless i and long s, to the ASCII letters; those are folded instead.
+INJECTION_CASE_FOLD = str.maketrans({"\u0131": "i", "\u017f": "s"})
+INJECTION_REGEX = re.compile("|".join(f"(?:{pattern})" for pattern in INJECTION_PATTERNS))
+INJECTION_REGEXES = [re.compile(pattern) for pattern in INJECTION_PATTERNS]
+PII_REGEXES = {pii_type: re.compile(pattern) for pii_type, pattern in PII_PATTERNS.items()}
+
+# All PII types in one scan: the leftmost match wins, and at the same
+# offset the first type in PII_PATTERNS order (email, ssn, credit_card,
+# phone). Non-capturing for the same reason as INJECTION_REGEX.
+PII_REGEX = re.compile("|".join(f"(?:{pattern})" for pattern in PII_PATTERNS.values()))
+PII_PRIORITY = {pii_type: i for i, pii_type in enumerate(PII_PATTERNS)}
+
+# Parallel PII masking at ingest: worker processes (0 or 1 = sequential)
+# and characters per task
+PII_MASK_WORKERS = int(os.environ.get("PII_MASK_WORKERS", "0"))
+PII_MASK_SEGMENT_SIZE = int(os.environ.get("PII_MASK_SEGMENT_SIZE", str(256 * 1024)))
+
+# Whitespace no PII match can span: only card numbers contain whitespace,
+# and only a single character between two digits
+_SAFE_SPLIT = re.compile(r"(?<!\d)\s|\s(?!\d)")
+
+# Every PII pattern starts at a word boundary, and a match can only be
+# extended by a later one if the next character could continue it
+_WORD_BOUNDARY = re.compile(r"\b")
+_CONTINUES = re.compile(r"[.%+@-]*\w|\s\d")
+
+PII_MASKS = {
+    "email": "[EMAIL_REDACTED]",
+    "ssn": "[SSN_REDACTED]",
+    "credit_card": "[CARD_REDACTED]",
+    "phone": "[PHONE_REDACTED]",
+}
+
+
+class TermMatcher:
+    """
+    Aho-Corasick automaton for case-insensitive substring matching.
+
+    Finds any of the terms in one pass over the text, however many terms
+    there are. Transitions are precomputed into a dense table per state,
+    so each character costs one dictionary lookup.
+    """
+
+    def __init__(self, terms: List[str]):
+        self.terms = [term for term in terms if term]
+        self._lowered = [term.lower() for term in self.terms]
+        goto = [{}]
+        outputs = [()]
+        for i, term in enumerate(self._lowered):
+            state = 0
+            for ch in term:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    outputs.append(())
+                    goto[state][ch] = nxt
+                state = nxt
+            outputs[state] += (i,)
+
+        # Breadth-first: a state's failure link is always shallower, so
+        # its transition table is complete by the time it is needed
+        fail = [0] * len(goto)
+        self._delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self._delta[state] = {**self._delta[fail[state]], **goto[state]}
+            for ch, nxt in goto[state].items():
+                fail[nxt] = self._delta[fail[state]].get(ch, 0) if state else 0
+                outputs[nxt] += outputs[fail[nxt]]
+                queue.append(nxt)
+        self._outputs = outputs
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """Yield (end offset in the lowercased text, term) for every occurrence"""
+        delta, outputs = self._delta, self._outputs
+        state = 0
+        for position, ch in enumerate(text.lower()):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for i in outputs[state]:
+                    yield position + 1, self.terms[i]
+
+    def search_lower(self, text_lower: str) -> Optional[str]:
+        """
+        A term occurring in already-lowercased text, or None
+
+        Short term lists are checked term by term; see AUTOMATON_MIN_TERMS.
+        """
+        if len(self.terms) < AUTOMATON_MIN_TERMS:
+            for term, lowered in zip(self.terms, self._lowered):
+                if lowered in text_lower:
+                    return term
+            return None
+
+        delta, outputs = self._delta, self._outputs
+        state = 0
+        for ch in text_lower:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                return self.terms[outputs[state][0]]
+        return None
+
+    def search(self, text: str) -> Optional[str]:
+        """A term occurring in the text, or None"""
+        return self.search_lower(text.lower())
+
+
+@lru_cache(maxsize=32)
+def term_matcher(terms: Tuple[str, ...]) -> TermMatcher:
+    """Cached automaton per blocked-term list"""
+    return TermMatcher(list(terms))
+
 
 def check_input_length(text: str, max_length: int = 10000) -> None:
     """
@@ -66,15 +202,114 @@ def check_prompt_injection(text: str) -> Tuple[bool, Optional[str]]:
     Returns:
         Tuple of (is_safe, violation_reason)
     """
-    text_lower = text.lower()
-    
-    for pattern in INJECTION_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            return False, f"Potential injection detected: {pattern}"
+    return _check_injection_lower(text.lower())
+
+
+def _check_injection_lower(text_lower: str) -> Tuple[bool, Optional[str]]:
+    if "\u0131" in text_lower or "\u017f" in text_lower:
+        text_lower = text_lower.translate(INJECTION_CASE_FOLD)
+    match = INJECTION_REGEX.search(text_lower)
+    if match:
+        # The alternation takes the first pattern matching at that offset
+        index = next(i for i, regex in enumerate(INJECTION_REGEXES) if regex.match(text_lower, match.start()))
+        return False, f"Potential injection detected: {INJECTION_PATTERNS[index]}"
     
     return True, None
 
 
+def find_pii_spans(text: str) -> List[Tuple[int, int, str]]:
+    """
+    Locate PII in one scan
+    
+    A match that starts inside the previous one and runs past it (e.g. a
+    card number starting in the last digits of a phone number) is kept
+    too, so masking covers both.
+    
+    Args:
+        text: Text to scan
+        
+    Returns:
+        (start, end, pii_type) spans ordered by start; a span overlaps the
+        previous one only in the case above
+    """
+    spans = []
+    position = 0
+    while True:
+        match = PII_REGEX.search(text, position)
+        if match is None:
+            return spans
+        start, end = match.span()
+        spans.append((start, end, _pii_type_at(text, start)))
+        if _CONTINUES.match(text, end):
+            end = _extend_span(text, start, end, spans)
+        position = end
+
+
+def _extend_span(text: str, start: int, end: int, spans: list) -> int:
+    """Append matches starting inside [start, end) that run past it; returns the new end"""
+    for boundary in _WORD_BOUNDARY.finditer(text, start + 1):
+        offset = boundary.start()
+        if offset >= end:
+            break
+        for pii_type, regex in PII_REGEXES.items():
+            inner = regex.match(text, offset)
+            if inner and inner.end() > end:
+                end = inner.end()
+                spans.append((offset, end, pii_type))
+                break
+    return end
+
+
+def _pii_type_at(text: str, start: int) -> str:
+    # The alternation takes the first pattern matching at that offset
+    return next(pii_type for pii_type, regex in PII_REGEXES.items() if regex.match(text, start))
+
+
+def mask_spans(text: str, spans: List[Tuple[int, int, str]]) -> str:
+    """
+    Replace PII spans with masks, building the output in one join
+    
+    Overlapping spans are masked once, with the mask of the
+    highest-priority type among them.
+    """
+    if not spans:
+        return text
+    
+    parts = []
+    position = 0
+    masked_type = None
+    for start, end, pii_type in spans:
+        if start < position:
+            position = max(position, end)
+            if PII_PRIORITY[pii_type] < PII_PRIORITY[masked_type]:
+                parts[-1] = PII_MASKS[pii_type]
+                masked_type = pii_type
+            continue
+        parts.append(text[position:start])
+        parts.append(PII_MASKS[pii_type])
+        position = end
+        masked_type = pii_type
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def scan_pii(text: str) -> Tuple[Dict[str, list], str]:
+    """
+    Detect and mask PII from the same scan
+    
+    Args:
+        text: Text to scan
+        
+    Returns:
+        (detect_pii() findings, mask_pii() output)
+    """
+    spans = find_pii_spans(text)
+    findings = {}
+    for start, end, pii_type in spans:
+        findings.setdefault(pii_type, []).append(text[start:end])
+    return findings, mask_spans(text, spans)
+
+
 def detect_pii(text: str) -> Dict[str, list]:
     """
     Detect personally identifiable information
@@ -86,12 +321,8 @@ def detect_pii(text: str) -> Dict[str, list]:
         Dictionary mapping PII type to list of matches
     """
     findings = {}
-    
-    for pii_type, pattern in PII_PATTERNS.items():
-        matches = re.findall(pattern, text)
-        if matches:
-            findings[pii_type] = matches
-    
+    for start, end, pii_type in find_pii_spans(text):
+        findings.setdefault(pii_type, []).append(text[start:end])
     return findings
 
 
@@ -105,37 +336,160 @@ def mask_pii(text: str) -> str:
     Returns:
         Text with PII masked
     """
-    masked = text
+    return mask_spans(text, find_pii_spans(text))
+
+
+def split_for_masking(text: str, segment_size: int = None) -> List[str]:
+    """
+    Split text into segments of about segment_size characters at
+    whitespace no PII match can span
     
-    # Mask emails
-    masked = re.sub(
-        PII_PATTERNS["email"],
-        "[EMAIL_REDACTED]",
-        masked
-    )
+    Masking the segments separately gives exactly mask_pii(text): no
+    match crosses a cut, and a cut on whitespace does not change the
+    word boundaries the patterns see. Text with no safe cut stays whole.
     
-    # Mask SSNs
-    masked = re.sub(
-        PII_PATTERNS["ssn"],
-        "[SSN_REDACTED]",
-        masked
-    )
+    Args:
+        text: Text to split
+        segment_size: Target segment length (default PII_MASK_SEGMENT_SIZE)
+        
+    Returns:
+        Segments whose concatenation is text
+    """
+    segment_size = segment_size or PII_MASK_SEGMENT_SIZE
+    segments = []
+    start = 0
+    while len(text) - start > segment_size:
+        cut = _SAFE_SPLIT.search(text, start + segment_size)
+        if cut is None:
+            break
+        segments.append(text[start:cut.start()])
+        start = cut.start()
+    segments.append(text[start:])
+    return segments
+
+
+_mask_executor = None
+_mask_executor_workers = 0
+_mask_executor_lock = threading.Lock()
+
+
+def _get_mask_executor(workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    Shared masking process pool, or None where processes are unavailable
+    (e.g. AWS Lambda has no /dev/shm for multiprocessing primitives)
+    """
+    global _mask_executor, _mask_executor_workers
+    with _mask_executor_lock:
+        if _mask_executor and _mask_executor_workers != workers:
+            _mask_executor.shutdown(wait=False)
+            _mask_executor = None
+        if _mask_executor is None:
+            _mask_executor_workers = workers
+            try:
+                # Not fork: the pool is created from pipeline threads
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _mask_executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context(method)
+                )
+            except (OSError, NotImplementedError, ImportError) as e:
+                logger.warning(f"Parallel PII masking unavailable, masking sequentially: {str(e)}")
+                _mask_executor = False
+        return _mask_executor or None
+
+
+def _disable_mask_executor(error: Exception):
+    """Stop using a failed pool; later calls mask sequentially"""
+    global _mask_executor
+    with _mask_executor_lock:
+        if _mask_executor:
+            logger.warning(f"Parallel PII masking failed, masking sequentially: {str(error)}")
+            _mask_executor.shutdown(wait=False, cancel_futures=True)
+            _mask_executor = False
+
+
+def _mask_batch(segments: List[str]) -> List[str]:
+    return [mask_pii(segment) for segment in segments]
+
+
+def mask_pii_stream(
+    texts: Iterable[str],
+    workers: int = None,
+    segment_size: int = None
+) -> Iterator[str]:
+    """
+    Mask a stream of texts (e.g. paragraphs), in a process pool when
+    workers > 1
     
-    # Mask credit cards
-    masked = re.sub(
-        PII_PATTERNS["credit_card"],
-        "[CARD_REDACTED]",
-        masked
-    )
+    Small texts are batched and large ones split with split_for_masking()
+    into tasks of about segment_size characters; at most 2 * workers
+    tasks are in flight. The output is exactly map(mask_pii, texts). A
+    task whose worker fails is masked in this process instead.
     
-    # Mask phone numbers
-    masked = re.sub(
-        PII_PATTERNS["phone"],
-        "[PHONE_REDACTED]",
-        masked
-    )
+    Args:
+        texts: Texts to mask
+        workers: Worker processes (default PII_MASK_WORKERS)
+        segment_size: Characters per task (default PII_MASK_SEGMENT_SIZE)
+        
+    Yields:
+        Masked texts in input order
+    """
+    workers = PII_MASK_WORKERS if workers is None else workers
+    segment_size = segment_size or PII_MASK_SEGMENT_SIZE
+    executor = _get_mask_executor(workers) if workers > 1 else None
+    if executor is None:
+        yield from map(mask_pii, texts)
+        return
+    
+    pending = deque()  # (future, segments) in submission order
+    masked = deque()   # Masked segments not yet reassembled
+    counts = deque()   # Segments per text not yet yielded
+    batch = []
+    batch_size = 0
+    
+    def submit():
+        nonlocal batch, batch_size
+        future = None
+        if _mask_executor:
+            try:
+                future = executor.submit(_mask_batch, batch)
+            except Exception as e:
+                _disable_mask_executor(e)
+        pending.append((future, batch))
+        batch, batch_size = [], 0
+    
+    def collect():
+        future, segments = pending.popleft()
+        if future is not None:
+            try:
+                masked.extend(future.result())
+                return
+            except Exception as e:
+                _disable_mask_executor(e)
+        masked.extend(_mask_batch(segments))
     
-    return masked
+    def reassemble():
+        while counts and len(masked) >= counts[0]:
+            n = counts.popleft()
+            yield "".join(masked.popleft() for _ in range(n))
+    
+    for text in texts:
+        segments = split_for_masking(text, segment_size) if len(text) > segment_size else [text]
+        counts.append(len(segments))
+        for segment in segments:
+            batch.append(segment)
+            batch_size += len(segment)
+            if batch_size >= segment_size:
+                submit()
+                while len(pending) >= 2 * workers:
+                    collect()
+                yield from reassemble()
+    
+    if batch:
+        submit()
+    while pending:
+        collect()
+        yield from reassemble()
 
 
 def check_token_budget(
@@ -169,19 +523,23 @@ def check_content_safety(text: str, blocked_terms: list = None) -> Tuple[bool, O
     Returns:
         Tuple of (is_safe, violation_reason)
     """
+    return _check_content_lower(text.lower(), blocked_terms)
+
+
+def _check_content_lower(text_lower: str, blocked_terms: list = None) -> Tuple[bool, Optional[str]]:
     if blocked_terms is None:
-        blocked_terms = []
+        blocked_terms = BLOCKED_TERMS
+    if not blocked_terms:
+        return True, None
     
-    text_lower = text.lower()
-    
-    for term in blocked_terms:
-        if term.lower() in text_lower:
-            return False, f"Blocked term detected: {term}"
+    term = term_matcher(tuple(blocked_terms)).search_lower(text_lower)
+    if term is not None:
+        return False, f"Blocked term detected: {term}"
     
     return True, None
 
 
-def apply_guardrails(
+def scan_input(
     user_input: str,
     check_injection: bool = True,
     check_pii: bool = True,
@@ -190,68 +548,100 @@ def apply_guardrails(
     blocked_terms: list = None
 ) -> Dict:
     """
-    Apply all guardrails to user input
+    Run every input guardrail and return one verdict
+    
+    Inputs over max_input_length are rejected without being scanned.
+    Otherwise the input is lowercased once for the injection alternation
+    and the blocked-term search, and PII is only scanned for inputs that
+    passed.
     
     Args:
         user_input: User's input text
         check_injection: Whether to check for prompt injection
-        check_pii: Whether to detect PII
+        check_pii: Whether to detect and mask PII
         max_input_length: Maximum input length
         max_tokens: Maximum token budget
-        blocked_terms: Optional list of blocked terms
+        blocked_terms: Blocked terms (default GUARDRAIL_BLOCKED_TERMS)
         
     Returns:
-        Dictionary with validation results and masked input
-        
-    Raises:
-        GuardrailViolation: If any critical check fails
+        Dictionary with "safe", "violations" (in check order), "warnings",
+        "masked_input", "pii_detected" and "estimated_tokens"
     """
-    results = {
+    verdict = {
         "safe": True,
         "violations": [],
         "warnings": [],
         "masked_input": user_input,
-        "pii_detected": {}
+        "pii_detected": {},
+        "estimated_tokens": len(user_input) // 4  # Rough estimate
     }
     
-    # Check input length
     try:
         check_input_length(user_input, max_input_length)
     except GuardrailViolation as e:
-        results["safe"] = False
-        results["violations"].append(str(e))
-        raise
+        verdict["safe"] = False
+        verdict["violations"].append(str(e))
+        return verdict
     
-    # Check prompt injection
+    text_lower = user_input.lower()
+    checks = [_check_content_lower(text_lower, blocked_terms)]
     if check_injection:
-        is_safe, reason = check_prompt_injection(user_input)
-        if not is_safe:
-            results["safe"] = False
-            results["violations"].append(reason)
-            raise GuardrailViolation(reason)
-    
-    # Check content safety
-    is_safe, reason = check_content_safety(user_input, blocked_terms)
-    if not is_safe:
-        results["safe"] = False
-        results["violations"].append(reason)
-        raise GuardrailViolation(reason)
-    
-    # Detect and mask PII
-    if check_pii:
-        pii_found = detect_pii(user_input)
-        if pii_found:
-            results["pii_detected"] = pii_found
-            results["warnings"].append(f"PII detected: {list(pii_found.keys())}")
-            results["masked_input"] = mask_pii(user_input)
+        checks.insert(0, _check_injection_lower(text_lower))
+    verdict["violations"].extend(reason for is_safe, reason in checks if not is_safe)
     
-    # Check token budget
-    estimated_tokens = len(user_input) // 4  # Rough estimate
     try:
-        check_token_budget(estimated_tokens, max_tokens)
+        check_token_budget(verdict["estimated_tokens"], max_tokens)
     except GuardrailViolation as e:
-        results["safe"] = False
-        results["violations"].append(str(e))
-        raise
+        verdict["violations"].append(str(e))
+    
+    if verdict["violations"]:
+        verdict["safe"] = False
+        return verdict
+    
+    if check_pii:
+        pii_found, masked = scan_pii(user_input)
+        if pii_found:
+            verdict["pii_detected"] = pii_found
+            verdict["warnings"].append(f"PII detected: {list(pii_found.keys())}")
+            verdict["masked_input"] = masked
+    
+    return verdict
+
+
+def apply_guardrails(
+    user_input: str,
+    check_injection: bool = True,
+    check_pii: bool = True,
+    max_input_length: int = 10000,
+    max_tokens: int = 4000,
+    blocked_terms: list = None
+) -> Dict:
+    """
+    Apply all guardrails to user input
+    
+    Args:
+        user_input: User's input text
+        check_injection: Whether to check for prompt injection
+        check_pii: Whether to detect PII
+        max_input_length: Maximum input length
+        max_tokens: Maximum token budget
+        blocked_terms: Optional list of blocked terms
+        
+    Returns:
+        Dictionary with validation results and masked input (see scan_input)
+        
+    Raises:
+        GuardrailViolation: With the first failed check, if any
+    """
+    results = scan_input(
+        user_input,
+        check_injection=check_injection,
+        check_pii=check_pii,
+        max_input_length=max_input_length,
+        max_tokens=max_tokens,
+        blocked_terms=blocked_terms
+    )
+    if not results["safe"]:
+        raise GuardrailViolation(results["violations"][0])
     
     return results
@@ -56,6 +56,9 @@ module "database" {
   range_key                     = local.config.dynamodb.range_key
   enable_point_in_time_recovery = local.config.dynamodb.enable_point_in_time_recovery
 
+  # Rate limit counters expire; cost records have no expires_at
+  ttl_attribute = "expires_at"
+
   attributes = [
     {
       name = local.config.dynamodb.hash_key
@@ -70,6 +73,30 @@ module "database" {
   tags = local.common_tags
 }
 
+module "dedup_table" {
+  source = "./modules/database"
+
+  project_name                  = local.config.project_name
+  table_name                    = local.config.dynamodb.dedup_table_name
+  billing_mode                  = local.config.dynamodb.billing_mode
+  hash_key                      = "tenant_id"
+  range_key                     = "norm_hash"
+  enable_point_in_time_recovery = local.config.dynamodb.enable_point_in_time_recovery
+
+  attributes = [
+    {
+      name = "tenant_id"
+      type = "S"
+    },
+    {
+      name = "norm_hash"
+      type = "S"
+    }
+  ]
+
+  tags = local.common_tags
+}
+
 # ========================
 # IAM Policies Module
 # ========================
@@ -81,6 +108,7 @@ module "policies" {
   region            = local.config.region
   vector_bucket_arn = module.storage.bucket_arn
   cost_table_arn    = module.database.table_arn
+  dedup_table_arn   = module.dedup_table.table_arn
 }
 
 # ========================
@@ -115,6 +143,7 @@ module "lambda" {
   environment_variables = {
     VECTOR_BUCKET = module.storage.bucket_name
     COST_TABLE    = module.database.table_name
+    DEDUP_TABLE   = module.dedup_table.table_name
   }
 
   vector_bucket_id  = module.storage.bucket_id
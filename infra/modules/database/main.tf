@@ -21,6 +21,15 @@ resource "aws_dynamodb_table" "table" {
     }
   }
 
+  # Expire items carrying the TTL attribute (items without it are kept)
+  dynamic "ttl" {
+    for_each = var.ttl_attribute == null ? [] : [var.ttl_attribute]
+    content {
+      attribute_name = ttl.value
+      enabled        = true
+    }
+  }
+
   # Point-in-time recovery
   point_in_time_recovery {
     enabled = var.enable_point_in_time_recovery
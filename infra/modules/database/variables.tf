@@ -51,6 +51,12 @@ variable "write_capacity" {
   default     = null
 }
 
+variable "ttl_attribute" {
+  description = "Attribute holding the expiry time (epoch seconds), or null to disable TTL"
+  type        = string
+  default     = null
+}
+
 variable "tags" {
   description = "Additional tags for the table"
   type        = map(string)
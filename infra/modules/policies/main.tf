@@ -70,10 +70,20 @@ resource "aws_iam_policy" "dynamodb_cost_access" {
         Effect = "Allow"
         Action = [
           "dynamodb:PutItem",
+          "dynamodb:UpdateItem",
           "dynamodb:Query",
           "dynamodb:GetItem"
         ]
         Resource = var.cost_table_arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:UpdateItem",
+          "dynamodb:DeleteItem"
+        ]
+        Resource = var.dedup_table_arn
       }
     ]
   })
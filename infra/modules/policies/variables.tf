@@ -17,3 +17,8 @@ variable "cost_table_arn" {
   description = "ARN of the DynamoDB cost tracking table"
   type        = string
 }
+
+variable "dedup_table_arn" {
+  description = "ARN of the DynamoDB chunk dedup table"
+  type        = string
+}
@@ -1,121 +1,679 @@
+import hashlib
 import json
+import os
+import threading
 import boto3
 import logging
-from chunking import chunk_text
-from bedrock_client import generate_embedding
-from vector_store import store_vector
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+from datetime import datetime
+from urllib.parse import unquote_plus
+from chunking import iter_paragraphs, content_hash, CHUNKING_STRATEGIES, STREAM_READ_SIZE
+from bedrock_client import generate_embedding, EMBED_MODEL_ID
+from vector_store import store_vectors, load_manifest, save_manifest, list_vector_ids, delete_vectors
+from dedup import TableDedupIndex, normalized_hash, minhash_signature
 from security import SecurityContext, sanitize_document_id, create_audit_log_entry
-from guardrails import mask_pii
+from audit import record_audit, flush_audit
+from guardrails import mask_pii_stream
+from pipeline import Pipeline
+from s3_reader import open_object, detect_encoding, decompressing_reader
+from tracing import Tracer
 
 s3 = boto3.client("s3")
 
+# Chunking strategy name from chunking.CHUNKING_STRATEGIES
+CHUNK_STRATEGY = os.environ.get("CHUNK_STRATEGY", "paragraph")
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "500"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "50"))
+
+# Reuse embeddings of identical chunks across a tenant's documents, and
+# optionally of near-duplicates above this MinHash Jaccard estimate (0 = off)
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_NEAR_THRESHOLD = float(os.environ.get("DEDUP_NEAR_THRESHOLD", "0"))
+# One item per deduplicated chunk: tenant_id (hash key), norm_hash (range key)
+DEDUP_TABLE = os.environ.get("DEDUP_TABLE", "rag-genai-dedup")
+
+dynamodb = boto3.resource("dynamodb")
+dedup_table = dynamodb.Table(DEDUP_TABLE)
+
+# Documents ingested in parallel per invocation
+INGEST_MAX_WORKERS = int(os.environ.get("INGEST_MAX_WORKERS", "4"))
+
+# Per-document pipeline: items buffered between stages, concurrent
+# embedding calls, and vectors written per batch
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "16"))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "16"))
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def lambda_handler(event, context):
+class TenantDedupIndexes:
     """
-    Enhanced ingest handler with security and audit logging
+    Dedup indexes shared by all documents of one batch.
+
+    Entries live in the dedup table and every change is written as it
+    happens, so concurrent invocations see each other's references and
+    nothing needs saving. Sharing one index per tenant lets the batch's
+    workers wait on each other's embeddings (claims) instead of
+    embedding the same chunk twice.
     """
-    request_id = context.request_id if hasattr(context, 'request_id') else 'local'
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: str) -> TableDedupIndex:
+        with self._lock:
+            if tenant_id not in self._indexes:
+                self._indexes[tenant_id] = TableDedupIndex(dedup_table, tenant_id)
+            return self._indexes[tenant_id]
+
+
+class HashingReader:
+    """
+    Wraps a byte stream and hashes everything read through it, so the
+    source content hash is known once the stream has been consumed.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._sha256 = hashlib.sha256()
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self._sha256.update(data)
+        self.bytes_read += len(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+    def close(self):
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+
+class BlockReader:
+    """File-like adapter over an iterator of byte blocks"""
+
+    def __init__(self, blocks: Iterable[bytes]):
+        self._blocks = iter(blocks)
+
+    def read(self, size: int = -1) -> bytes:
+        # Returns whole blocks; iter_paragraphs accepts any read length
+        return next(self._blocks, b"")
+
+
+def index_params(strategy: str = None) -> dict:
+    """
+    Settings that determine a document's chunks and vectors.
+    A document is only skipped as unchanged if these match its manifest.
+    """
+    return {
+        "strategy": strategy or CHUNK_STRATEGY,
+        "max_tokens": CHUNK_MAX_TOKENS,
+        "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "embed_model": EMBED_MODEL_ID
+    }
+
+
+def is_unchanged(manifest: Optional[dict], etag: str, params: dict) -> bool:
+    """
+    Check whether a document was already fully indexed from this exact
+    source object with the same settings
+
+    Args:
+        manifest: Stored document manifest (None if never ingested)
+        etag: Current ETag of the source object
+        params: Current index_params()
+
+    Returns:
+        True if ingesting again would produce the same vectors
+    """
+    if not manifest or not etag:
+        return False
     
-    try:
-        record = event["Records"][0]
-        bucket = record["s3"]["bucket"]["name"]
-        key = record["s3"]["object"]["key"]
-        
-        logger.info(f"Processing document: s3://{bucket}/{key}")
-        
-        # Extract tenant_id from S3 path (assumes format: tenant_id/doc_id)
-        path_parts = key.split('/')
-        if len(path_parts) < 2:
-            logger.error(f"Invalid S3 key format: {key}")
-            return {"status": "error", "message": "Invalid S3 key format"}
-        
-        tenant_id = path_parts[0]
-        doc_id = '/'.join(path_parts[1:])
-        
-        # Initialize security context
-        sec_context = SecurityContext(tenant_id, "system", request_id)
-        sec_context.log_action("ingest_start", {"document": doc_id})
-        
-        # Sanitize document ID
-        safe_doc_id = sanitize_document_id(doc_id)
-        
-        # Get document from S3
-        response = s3.get_object(Bucket=bucket, Key=key)
-        text = response["Body"].read().decode("utf-8")
-        
-        # Mask any PII in the document before processing
-        masked_text = mask_pii(text)
-        
-        # Chunk the text
-        sec_context.log_action("chunking_start")
-        chunks = chunk_text(masked_text)
-        sec_context.log_action("chunking_complete", {"num_chunks": len(chunks)})
-        
-        logger.info(f"Created {len(chunks)} chunks from document")
-        
-        # Process each chunk
-        successful_chunks = 0
-        for idx, chunk in enumerate(chunks):
-            try:
-                # Generate embedding
-                embedding = generate_embedding(chunk["text"], tenant_id)
-                
-                # Store vector with tenant isolation
-                store_vector(
-                    doc_id=safe_doc_id,
-                    chunk_id=idx,
-                    vector=embedding,
-                    metadata={
-                        "source": safe_doc_id,
-                        "tenant_id": tenant_id,
-                        "chunk_index": idx,
-                        "token_estimate": chunk.get("token_estimate", 0)
-                    }
-                )
-                
-                successful_chunks += 1
+    source = manifest.get("source") or {}
+    return source.get("etag") == etag and manifest.get("params") == params
+
+
+def _parse_record(record: dict) -> list:
+    """(item_id, bucket, key) for each S3 object one event record carries"""
+    if "s3" in record:
+        item_id, s3_records = None, [record]
+    else:
+        # SQS message wrapping an S3 notification
+        item_id = record.get("messageId")
+        s3_records = json.loads(record.get("body") or "{}").get("Records", [])
+    
+    # Object keys arrive URL-encoded in S3 notifications
+    return [
+        (item_id, r["s3"]["bucket"]["name"], unquote_plus(r["s3"]["object"]["key"]))
+        for r in s3_records
+    ]
+
+
+def parse_s3_records(event: dict) -> tuple:
+    """
+    Extract the S3 objects to ingest from an S3 or SQS event
+    
+    Each record is parsed on its own, so a malformed message does not
+    keep the rest of the batch from being ingested.
+
+    Args:
+        event: S3 notification event, or SQS event whose messages carry
+            S3 notifications
+
+    Returns:
+        (objects, failures): objects is a list of (item_id, bucket, key),
+        where item_id is the SQS messageId for SQS-delivered records and
+        otherwise None; failures is a list of (item_id, error message)
+        for records that could not be parsed
+    """
+    objects = []
+    failures = []
+    
+    for record in event.get("Records", []):
+        try:
+            objects.extend(_parse_record(record))
+        except Exception as e:
+            item_id = record.get("messageId") if isinstance(record, dict) else None
+            logger.error(f"Unparseable ingest record {item_id}: {str(e)}")
+            failures.append((item_id, f"Unparseable record: {str(e)}"))
+    
+    return objects, failures
+
+
+def index_document_chunks(
+    tenant_id: str,
+    safe_doc_id: str,
+    chunks,
+    dedup_indexes: TenantDedupIndexes = None,
+    params: dict = None,
+    source_info: Callable[[], dict] = None
+) -> dict:
+    """
+    Embed and store a document's chunks, reusing unchanged and duplicate ones
+
+    Chunks flow through pipeline stages: dedup (hashing, manifest and
+    dedup index lookups) -> embed (concurrent) -> write (batched), so
+    storage writes overlap with embedding calls.
+
+    Args:
+        tenant_id: Tenant identifier
+        safe_doc_id: Sanitized document identifier
+        chunks: Chunk dictionaries in document order (may be a generator),
+            or a Pipeline whose last stage produces them
+        dedup_indexes: Per-tenant dedup indexes shared across the batch
+            (None disables deduplication)
+        params: Chunking and embedding settings recorded in the manifest
+            (defaults to index_params())
+        source_info: Called after all chunks are consumed; returns the
+            source object details (etag, content_hash) for the manifest
+
+    Returns:
+        Chunk counts (total, successful, embedded, deduplicated, deleted)
+        and per-stage pipeline statistics
+    """
+    params = params or index_params()
+    
+    # Chunks whose content was embedded by a previous ingest of this
+    # document are carried forward instead of being re-embedded, unless
+    # the vectors came from a different embedding model
+    previous_manifest = load_manifest(tenant_id, safe_doc_id)
+    previous_chunks = {
+        c["hash"]: c for c in previous_manifest["chunks"]
+    } if previous_manifest else {}
+    previous_model = (previous_manifest or {}).get("params", {}).get("embed_model", EMBED_MODEL_ID)
+    reusable_chunks = previous_chunks if previous_model == params["embed_model"] else {}
+    
+    # Identical chunks from the tenant's other documents reuse their
+    # stored vector by reference
+    dedup_index = dedup_indexes.get(tenant_id) if dedup_indexes is not None else None
+    
+    if isinstance(chunks, Pipeline):
+        pipeline = chunks
+    else:
+        pipeline = Pipeline(queue_size=PIPELINE_QUEUE_SIZE)
+        pipeline.add_stage("chunk", lambda _: chunks)
+    
+    counts = {"total": 0, "embedded": 0, "deduplicated": 0}
+    counts_lock = threading.Lock()
+    records = []          # (entry, chunk) in document order
+    current_chunks = {}   # chunk hash -> entry, shared by repeated chunks
+    claimed = set()       # normalized hashes this document is embedding
+    deferred = []         # chunks another ingest is embedding right now
+    
+    def release(item, added: bool):
+        with counts_lock:
+            if item["norm_hash"] not in claimed:
+                return
+            claimed.discard(item["norm_hash"])
+        dedup_index.release(item["norm_hash"], added)
+    
+    def fail(item, message: str):
+        logger.error(message)
+        item["entry"]["failed"] = True
+        release(item, False)
+    
+    def vector_record(item) -> dict:
+        # Stored with tenant isolation, keyed by content
+        chunk = item["chunk"]
+        return {
+            "doc_id": safe_doc_id,
+            "chunk_id": item["entry"]["hash"],
+            "vector": item["embedding"],
+            "metadata": {
+                "source": safe_doc_id,
+                "tenant_id": tenant_id,
+                "chunk_index": chunk["chunk_id"],
+                "token_estimate": chunk.get("token_estimate", 0),
+                # Returned by retrieval and packed into the prompt
+                "text": chunk["text"]
+            }
+        }
+    
+    def register(item):
+        entry, norm_hash = item["entry"], item["norm_hash"]
+        if dedup_index is None or dedup_index.add(norm_hash, safe_doc_id, entry["hash"], item["signature"]):
+            if norm_hash is not None:
+                entry["norm_hash"] = norm_hash
+            with counts_lock:
+                counts["embedded"] += 1
+        else:
+            # A concurrent ingest registered the same chunk first; keep
+            # its vector and drop ours
+            delete_vectors(tenant_id, safe_doc_id, [entry["hash"]])
+            entry["ref"] = norm_hash
+            with counts_lock:
+                counts["deduplicated"] += 1
+        release(item, True)
+    
+    def dedup_stage(items):
+        for chunk in items:
+            counts["total"] += 1
+            chunk_hash = content_hash(chunk["text"])
+            entry = current_chunks.get(chunk_hash) or reusable_chunks.get(chunk_hash)
+            
+            if entry is None:
+                entry = {"hash": chunk_hash}
+                try:
+                    norm_hash = signature = match = None
+                    if dedup_index is not None:
+                        norm_hash = normalized_hash(chunk["text"])
+                        if DEDUP_NEAR_THRESHOLD > 0:
+                            signature = minhash_signature(chunk["text"])
+                        match = dedup_index.lookup(norm_hash, signature, DEDUP_NEAR_THRESHOLD)
+                    
+                    item = {"chunk": chunk, "entry": entry, "norm_hash": norm_hash, "signature": signature}
+                    # Store a reference instead of a new vector, unless the
+                    # entry was released since the lookup
+                    if match is not None and dedup_index.add_ref(match, safe_doc_id):
+                        entry["ref"] = match
+                        with counts_lock:
+                            counts["deduplicated"] += 1
+                    elif dedup_index is None:
+                        yield item
+                    else:
+                        waiting = dedup_index.claim(norm_hash)
+                        if waiting is None:
+                            with counts_lock:
+                                claimed.add(norm_hash)
+                            yield item
+                        else:
+                            item["waiting"] = waiting
+                            deferred.append(item)
+                except Exception as e:
+                    logger.error(f"Error processing chunk {chunk['chunk_id']}: {str(e)}")
+                    entry["failed"] = True
             
+            current_chunks[chunk_hash] = entry
+            records.append((entry, chunk))
+    
+    def embed_stage(items):
+        for item in items:
+            try:
+                item["embedding"] = generate_embedding(item["chunk"]["text"], tenant_id)
             except Exception as e:
-                logger.error(f"Error processing chunk {idx}: {str(e)}")
+                fail(item, f"Error processing chunk {item['chunk']['chunk_id']}: {str(e)}")
                 continue
+            yield item
+    
+    def write_stage(batches):
+        for batch in batches:
+            try:
+                store_vectors([vector_record(item) for item in batch])
+            except Exception as e:
+                for item in batch:
+                    fail(item, f"Error storing chunk {item['chunk']['chunk_id']}: {str(e)}")
+                continue
+            
+            for item in batch:
+                register(item)
+                yield item["entry"]["hash"]
+    
+    pipeline.add_stage("dedup", dedup_stage)
+    pipeline.add_stage("embed", embed_stage, workers=EMBED_CONCURRENCY)
+    pipeline.add_stage("write", write_stage, batch_size=WRITE_BATCH_SIZE)
+    try:
+        for _ in pipeline.run():
+            pass
+    finally:
+        # Never leave other ingests waiting on a claim
+        for norm_hash in list(claimed):
+            release({"norm_hash": norm_hash}, False)
+    
+    # Chunks claimed by concurrent ingests are resolved only after this
+    # document released its own claims, so ingests never wait on each other
+    for item in deferred:
+        norm_hash = item["norm_hash"]
+        if item["waiting"].result() and dedup_index.add_ref(norm_hash, safe_doc_id):
+            item["entry"]["ref"] = norm_hash
+            with counts_lock:
+                counts["deduplicated"] += 1
+            continue
         
-        sec_context.log_action("ingest_complete", {
-            "total_chunks": len(chunks),
-            "successful_chunks": successful_chunks
-        })
+        # The other ingest failed; embed the chunk here
+        try:
+            item["embedding"] = generate_embedding(item["chunk"]["text"], tenant_id)
+            store_vectors([vector_record(item)])
+        except Exception as e:
+            fail(item, f"Error processing chunk {item['chunk']['chunk_id']}: {str(e)}")
+            continue
+        register(item)
+    
+    manifest_chunks = [
+        {
+            **{k: v for k, v in entry.items() if k in ("hash", "ref", "norm_hash")},
+            "chunk_index": chunk["chunk_id"],
+            "token_estimate": chunk.get("token_estimate", 0)
+        }
+        for entry, chunk in records
+        if not entry.get("failed")
+    ]
+    current_chunks = {h: e for h, e in current_chunks.items() if not e.get("failed")}
+    total_chunks = counts["total"]
+    successful_chunks = len(manifest_chunks)
+    embedded_chunks = counts["embedded"]
+    deduplicated_chunks = counts["deduplicated"]
+    
+    logger.info(
+        f"Created {total_chunks} chunks from document "
+        f"({embedded_chunks} embedded, {deduplicated_chunks} deduplicated, "
+        f"{successful_chunks - embedded_chunks - deduplicated_chunks} unchanged)"
+    )
+    
+    # Remove vectors of chunks that no longer exist. Without a manifest
+    # the document may still have vectors from before manifests existed.
+    stale_ids = {safe_doc_id: set()}
+    if previous_manifest:
+        for chunk_hash, entry in previous_chunks.items():
+            if chunk_hash in current_chunks:
+                continue
+            
+            norm_hash = entry.get("ref") or entry.get("norm_hash")
+            if norm_hash and dedup_index is not None:
+                removed = dedup_index.remove_ref(norm_hash, safe_doc_id)
+                if removed is not None:
+                    # Last reference gone: delete wherever the vector lives
+                    stale_ids.setdefault(removed["doc_id"], set()).add(removed["chunk_id"])
+                elif "ref" not in entry and dedup_index.get(norm_hash) is None:
+                    stale_ids[safe_doc_id].add(chunk_hash)
+                # Otherwise other documents still reference the vector
+            elif "ref" not in entry:
+                stale_ids[safe_doc_id].add(chunk_hash)
+    else:
+        stale_ids[safe_doc_id] = set(list_vector_ids(tenant_id, safe_doc_id)) - set(current_chunks)
+    
+    for owner_doc_id, chunk_ids in stale_ids.items():
+        if chunk_ids:
+            delete_vectors(tenant_id, owner_doc_id, chunk_ids)
+    deleted_chunks = sum(len(ids) for ids in stale_ids.values())
+    
+    manifest = {
+        "doc_id": safe_doc_id,
+        "params": params,
+        "chunks": manifest_chunks,
+        "updated_at": datetime.utcnow().isoformat()
+    }
+    # Only a complete ingest may be skipped next time
+    if source_info is not None and successful_chunks == total_chunks:
+        manifest["source"] = source_info()
+    save_manifest(tenant_id, safe_doc_id, manifest)
+    
+    return {
+        "total_chunks": total_chunks,
+        "successful_chunks": successful_chunks,
+        "embedded_chunks": embedded_chunks,
+        "deduplicated_chunks": deduplicated_chunks,
+        "deleted_chunks": deleted_chunks,
+        "pipeline": pipeline.stats()
+    }
+
+
+def ingest_document(bucket: str, key: str, request_id: str, dedup_indexes: TenantDedupIndexes = None) -> dict:
+    """
+    Chunk, embed and store one S3 document
+
+    Args:
+        bucket: Source bucket
+        key: Object key (tenant_id/doc_id)
+        request_id: Invocation request ID
+        dedup_indexes: Per-tenant dedup indexes shared across the batch
+            (None disables deduplication)
+
+    Returns:
+        Per-document status dictionary
+    """
+    logger.info(f"Processing document: s3://{bucket}/{key}")
+    
+    # Extract tenant_id from S3 path (assumes format: tenant_id/doc_id)
+    path_parts = key.split('/')
+    if len(path_parts) < 2:
+        logger.error(f"Invalid S3 key format: {key}")
+        return {"status": "error", "message": "Invalid S3 key format", "key": key}
+    
+    tenant_id = path_parts[0]
+    doc_id = '/'.join(path_parts[1:])
+    
+    # Initialize security context
+    sec_context = SecurityContext(tenant_id, "system", request_id)
+    sec_context.log_action("ingest_start", {"document": doc_id})
+    
+    # Sanitize document ID
+    safe_doc_id = sanitize_document_id(doc_id)
+    tracer = Tracer("ingest")
+    
+    # Duplicate events and identical re-uploads stop here: the source
+    # ETag and index settings match the manifest of the last ingest
+    params = index_params()
+    with tracer.span("change_check"):
+        head = s3.head_object(Bucket=bucket, Key=key)
+        etag = head["ETag"]
+        manifest = load_manifest(tenant_id, safe_doc_id)
+    if is_unchanged(manifest, etag, params):
+        logger.info(f"Document unchanged since last ingest: {safe_doc_id}")
+        sec_context.log_action("ingest_unchanged", {"document": safe_doc_id})
+        tracer.emit_metrics()
+        return {
+            "status": "unchanged",
+            "document": safe_doc_id,
+            "tenant_id": tenant_id,
+            "chunks": len(manifest["chunks"]),
+            "timings": tracer.durations(),
+            "request_id": request_id
+        }
+    
+    # Stream document from S3 through bounded pipeline stages; PII is
+    # masked paragraph by paragraph so the full document is never held
+    # in memory. Reads are pinned to the ETag recorded in the manifest;
+    # large objects use parallel ranged GETs, and gzip/zstd uploads are
+    # decompressed on the fly.
+    if CHUNK_STRATEGY not in CHUNKING_STRATEGIES:
+        raise ValueError(f"Unknown chunking strategy: {CHUNK_STRATEGY}")
+    chunker = CHUNKING_STRATEGIES[CHUNK_STRATEGY]
+    
+    encoding = detect_encoding(key, head.get("ContentEncoding"))
+    raw = HashingReader(open_object(s3, bucket, key, head))
+    try:
+        body = decompressing_reader(raw, encoding)
         
-        # Create audit log
-        audit_entry = create_audit_log_entry(
-            tenant_id=tenant_id,
-            user_id="system",
-            action="ingest",
-            metadata={
-                "document": safe_doc_id,
-                "total_chunks": len(chunks),
-                "successful_chunks": successful_chunks,
-                "request_id": request_id,
-                "security_context": sec_context.to_dict()
-            }
-        )
+        chunks = Pipeline(queue_size=PIPELINE_QUEUE_SIZE)
+        chunks.add_stage("fetch", lambda _: iter(lambda: body.read(STREAM_READ_SIZE), b""))
+        chunks.add_stage("decode_mask", lambda blocks: mask_pii_stream(iter_paragraphs(BlockReader(blocks))))
+        chunks.add_stage("chunk", lambda paragraphs: chunker(paragraphs, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS))
         
-        logger.info(f"Audit log: {json.dumps(audit_entry)}")
+        def source_info():
+            return {
+                "etag": etag,
+                "content_hash": raw.hexdigest(),
+                "size": raw.bytes_read,
+                "encoding": encoding
+            }
         
-        return {
-            "status": "ingestion complete",
+        sec_context.log_action("chunking_start")
+        with tracer.span("index"):
+            counts = index_document_chunks(
+                tenant_id, safe_doc_id, chunks, dedup_indexes,
+                params=params, source_info=source_info
+            )
+    finally:
+        # Stops in-flight ranged GETs if the pipeline aborted early
+        raw.close()
+    # Stages overlap, so their times sum to more than the index span
+    for stage, stats in counts["pipeline"].items():
+        tracer.record(stage, stats["seconds"] * 1000, parent="ingest.index")
+    sec_context.log_action("chunking_complete", {"num_chunks": counts["total_chunks"]})
+    
+    total_chunks = counts["total_chunks"]
+    successful_chunks = counts["successful_chunks"]
+    embedded_chunks = counts["embedded_chunks"]
+    deduplicated_chunks = counts["deduplicated_chunks"]
+    deleted_chunks = counts["deleted_chunks"]
+    
+    sec_context.log_action("ingest_complete", {
+        "total_chunks": total_chunks,
+        "successful_chunks": successful_chunks,
+        "embedded_chunks": embedded_chunks,
+        "deduplicated_chunks": deduplicated_chunks
+    })
+    
+    # Create audit log
+    audit_entry = create_audit_log_entry(
+        tenant_id=tenant_id,
+        user_id="system",
+        action="ingest",
+        metadata={
             "document": safe_doc_id,
-            "chunks": len(chunks),
+            "total_chunks": total_chunks,
             "successful_chunks": successful_chunks,
-            "request_id": request_id
+            "embedded_chunks": embedded_chunks,
+            "deduplicated_chunks": deduplicated_chunks,
+            "deleted_chunks": deleted_chunks,
+            "request_id": request_id,
+            "security_context": sec_context.to_dict()
         }
+    )
+    
+    record_audit(audit_entry)
+    logger.info(f"Ingest pipeline stats: {json.dumps(counts['pipeline'])}")
+    tracer.emit_metrics()
     
+    return {
+        "status": "ingestion complete",
+        "document": safe_doc_id,
+        "tenant_id": tenant_id,
+        "chunks": total_chunks,
+        "successful_chunks": successful_chunks,
+        "embedded_chunks": embedded_chunks,
+        "deduplicated_chunks": deduplicated_chunks,
+        "reused_chunks": successful_chunks - embedded_chunks,
+        "pipeline": counts["pipeline"],
+        "timings": tracer.durations(),
+        "request_id": request_id
+    }
+
+
+
+def lambda_handler(event, context):
+    """
+    Enhanced ingest handler with security and audit logging
+
+    Ingests every record of the event with a bounded worker pool and
+    reports SQS partial batch failures.
+    """
+    request_id = context.request_id if hasattr(context, 'request_id') else 'local'
+    
+    try:
+        objects, unparsed = parse_s3_records(event)
     except Exception as e:
-        logger.error(f"Error during ingestion: {str(e)}", exc_info=True)
+        logger.error(f"Error parsing ingest event: {str(e)}", exc_info=True)
         return {
             "status": "error",
             "message": str(e),
             "request_id": request_id
         }
+    
+    # Nothing to ingest (e.g. an S3 test notification) is not a failure
+    if not objects and not unparsed:
+        logger.info("Ingest event carried no S3 records")
+        return {
+            "status": "ingestion complete",
+            "documents": 0,
+            "failed_documents": 0,
+            "results": [],
+            "batchItemFailures": [],
+            "request_id": request_id
+        }
+    
+    dedup_indexes = TenantDedupIndexes() if DEDUP_ENABLED else None
+    
+    def process(obj):
+        _, bucket, key = obj
+        try:
+            return ingest_document(bucket, key, request_id, dedup_indexes)
+        except Exception as e:
+            logger.error(f"Error during ingestion of s3://{bucket}/{key}: {str(e)}", exc_info=True)
+            return {"status": "error", "message": str(e), "key": key}
+    
+    workers = max(1, min(INGEST_MAX_WORKERS, len(objects)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(process, objects))
+    
+    # Unparseable messages fail on their own and are retried (or sent to
+    # the dead-letter queue) without holding back the rest of the batch
+    for item_id, message in unparsed:
+        objects.append((item_id, None, None))
+        results.append({"status": "error", "message": message})
+    
+    # The container may be frozen as soon as the handler returns
+    flush_audit()
+    
+    # An SQS message is retried if any document it carried failed
+    failed_items = []
+    for (item_id, _, _), result in zip(objects, results):
+        if result["status"] == "error" and item_id and item_id not in failed_items:
+            failed_items.append(item_id)
+    
+    failed = sum(1 for r in results if r["status"] == "error")
+    response = {
+        "status": "error" if failed == len(results) else (
+            "partial failure" if failed else "ingestion complete"
+        ),
+        "documents": len(results),
+        "failed_documents": failed,
+        "results": results,
+        "batchItemFailures": [{"itemIdentifier": i} for i in failed_items],
+        "request_id": request_id
+    }
+    
+    # Single-document events keep the per-document fields at top level
+    if len(results) == 1:
+        response = {**results[0], **response, "status": results[0]["status"]}
+    
+    return response
@@ -0,0 +1,520 @@
+"""
+Local stand-ins for the AWS services used by the Lambda handlers
+- Directory-backed S3 client
+- Fake Bedrock runtime (deterministic embeddings and generations)
+- In-memory DynamoDB table and CloudWatch client
+
+Lets the real handler code paths run on one machine without AWS.
+
+Usage:
+    from local_backends import install_local_backends
+    backends = install_local_backends("./local-data")
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class NoSuchKey(Exception):
+    """Raised for missing objects, like botocore's S3.Client.exceptions.NoSuchKey"""
+    pass
+
+
+class _LocalS3Exceptions:
+    NoSuchKey = NoSuchKey
+
+
+class _StreamingBody(io.BytesIO):
+    """Stand-in for botocore's StreamingBody"""
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+class LocalS3Client:
+    """
+    S3 client stand-in storing objects as files under root/<bucket>/<key>.
+
+    Implements the subset of the boto3 S3 client API used in this repo.
+    """
+
+    exceptions = _LocalS3Exceptions
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(self.root, bucket) + os.sep):
+            raise ValueError(f"Invalid key: {key}")
+        return path
+
+    def _meta_path(self, bucket: str, key: str) -> str:
+        return self._path(bucket, key) + ".meta.json"
+
+    @staticmethod
+    def _etag(path: str) -> str:
+        with open(path, "rb") as f:
+            return f'"{hashlib.md5(f.read()).hexdigest()}"'
+
+    def _read_meta(self, bucket: str, key: str) -> Dict:
+        try:
+            with open(self._meta_path(bucket, key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def put_object(self, Bucket: str, Key: str, Body=b"", **kwargs) -> Dict:
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename so concurrent readers never see partial objects
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(Body)
+        os.replace(tmp_path, path)
+
+        meta = {k: kwargs[k] for k in ("ContentType", "ContentEncoding") if k in kwargs}
+        if meta:
+            with open(self._meta_path(Bucket, Key), "w") as f:
+                json.dump(meta, f)
+
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise NoSuchKey(f"s3://{Bucket}/{Key}")
+
+        stat = os.stat(path)
+        return {
+            "ETag": self._etag(path),
+            "ContentLength": stat.st_size,
+            "LastModified": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+            **self._read_meta(Bucket, Key)
+        }
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, **kwargs) -> Dict:
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise NoSuchKey(f"s3://{Bucket}/{Key}")
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        response = self.head_object(Bucket, Key)
+        if Range:
+            match = re.match(r"bytes=(\d+)-(\d*)", Range)
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            data = data[start:end + 1]
+            response["ContentRange"] = f"bytes {start}-{start + len(data) - 1}/{response['ContentLength']}"
+            response["ContentLength"] = len(data)
+
+        response["Body"] = _StreamingBody(data)
+        return response
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        for path in (self._path(Bucket, Key), self._meta_path(Bucket, Key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: Dict, **kwargs) -> Dict:
+        for obj in Delete.get("Objects", []):
+            self.delete_object(Bucket, obj["Key"])
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", **kwargs) -> Dict:
+        bucket_root = os.path.join(self.root, Bucket)
+        contents = []
+
+        for dirpath, _, filenames in os.walk(bucket_root):
+            for filename in filenames:
+                if filename.endswith(".meta.json") or filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, bucket_root).replace(os.sep, "/")
+                if not key.startswith(Prefix):
+                    continue
+                stat = os.stat(path)
+                contents.append({
+                    "Key": key,
+                    "Size": stat.st_size,
+                    "ETag": self._etag(path),
+                    "LastModified": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+                })
+
+        contents.sort(key=lambda obj: obj["Key"])
+        response = {"KeyCount": len(contents)}
+        if contents:
+            response["Contents"] = contents
+        return response
+
+    def get_paginator(self, operation_name: str):
+        client = self
+
+        class _Paginator:
+            def paginate(self, Bucket: str, Prefix: str = "", **kwargs):
+                yield client.list_objects_v2(Bucket=Bucket, Prefix=Prefix)
+
+        return _Paginator()
+
+
+class FakeBedrockRuntime:
+    """
+    Bedrock runtime stand-in.
+
+    Embeddings are a hashed bag of words, so texts sharing vocabulary get
+    similar vectors and retrieval behaves plausibly. Generations quote the
+    start of the prompt context. Optional latency simulates network time.
+    """
+
+    def __init__(self, dimensions: int = 1536, latency_ms: float = 0.0):
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.round(6).tolist()
+
+    def _generate(self, prompt: str) -> str:
+        context = prompt.split("Context:", 1)[-1].split("Question:", 1)[0].strip()
+        if not context:
+            return "I do not have enough information."
+        return f"Based on the context: {context[:200]}"
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict:
+        with self._lock:
+            self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        request = json.loads(body)
+        if "inputText" in request:
+            text = request["inputText"]
+            payload = {
+                "embedding": self._embed(text),
+                "inputTextTokenCount": max(1, len(text) // 4)
+            }
+        else:
+            prompt = request.get("prompt", "")
+            generation = self._generate(prompt)
+            payload = {
+                "generation": generation,
+                "prompt_token_count": max(1, len(prompt) // 4),
+                "generation_token_count": max(1, len(generation) // 4)
+            }
+
+        return {"body": _StreamingBody(json.dumps(payload).encode("utf-8"))}
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str, **kwargs) -> Dict:
+        with self._lock:
+            self.calls += 1
+
+        prompt = json.loads(body).get("prompt", "")
+        pieces = re.findall(r"\s*\S+", self._generate(prompt))
+
+        def events():
+            for i, piece in enumerate(pieces):
+                if self.latency_ms:
+                    time.sleep(self.latency_ms / 1000 / len(pieces))
+                chunk = {
+                    "generation": piece,
+                    "prompt_token_count": max(1, len(prompt) // 4) if i == 0 else None,
+                    "generation_token_count": i + 1
+                }
+                yield {"chunk": {"bytes": json.dumps(chunk).encode("utf-8")}}
+
+        return {"body": events()}
+
+
+def _conditional_check_failed(operation: str):
+    from botocore.exceptions import ClientError
+    return ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}},
+        operation
+    )
+
+
+class LocalDynamoTable:
+    """
+    In-memory stand-in for a boto3 DynamoDB Table resource
+
+    `items` lists every put_item() in order; get_item(), update_item()
+    and delete_item() work on the latest item per key, query() on items
+    by hash key and range key (= or BETWEEN). Update and condition
+    expressions support the subset used in this repo: SET (with
+    if_not_exists), ADD and DELETE (numbers and sets), and conditions
+    joined by AND/OR on attribute_exists, attribute_not_exists and
+    comparisons.
+    """
+
+    def __init__(self, hash_key: str = "tenant_id", range_key: str = "timestamp"):
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.items = []
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def _key(self, item: Dict) -> tuple:
+        return (item[self.hash_key], item.get(self.range_key))
+
+    def put_item(self, Item: Dict, **kwargs) -> Dict:
+        with self._lock:
+            self.items.append(Item)
+            self._by_key[self._key(Item)] = Item
+        return {}
+
+    def get_item(self, Key: Dict, **kwargs) -> Dict:
+        with self._lock:
+            item = self._by_key.get(self._key(Key))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def delete_item(
+        self,
+        Key: Dict,
+        ConditionExpression: str = None,
+        ExpressionAttributeNames: Dict = None,
+        ExpressionAttributeValues: Dict = None,
+        ReturnValues: str = "NONE",
+        **kwargs
+    ) -> Dict:
+        with self._lock:
+            item = self._by_key.get(self._key(Key))
+            if ConditionExpression and not self._condition(
+                ConditionExpression, item or {}, ExpressionAttributeNames or {}, ExpressionAttributeValues or {}
+            ):
+                raise _conditional_check_failed("DeleteItem")
+            self._by_key.pop(self._key(Key), None)
+
+        if ReturnValues == "ALL_OLD" and item is not None:
+            return {"Attributes": dict(item)}
+        return {}
+
+    def query(
+        self,
+        KeyConditionExpression: str,
+        ExpressionAttributeNames: Dict = None,
+        ExpressionAttributeValues: Dict = None,
+        ScanIndexForward: bool = True,
+        **kwargs
+    ) -> Dict:
+        values = ExpressionAttributeValues or {}
+        match = re.match(
+            r"\S+\s*=\s*(:\w+)(?:\s+AND\s+\S+\s+(?:BETWEEN\s+(:\w+)\s+AND\s+(:\w+)|=\s*(:\w+)))?$",
+            KeyConditionExpression.strip()
+        )
+        hash_value = values[match.group(1)]
+        if match.group(2):
+            low, high = values[match.group(2)], values[match.group(3)]
+        elif match.group(4):
+            low = high = values[match.group(4)]
+        else:
+            low = high = None
+
+        with self._lock:
+            items = [
+                dict(item) for (hash_key, range_value), item in self._by_key.items()
+                if hash_key == hash_value and (low is None or low <= range_value <= high)
+            ]
+        items.sort(key=lambda item: item.get(self.range_key), reverse=not ScanIndexForward)
+        return {"Items": items, "Count": len(items)}
+
+    @staticmethod
+    def _operand(token: str, item: Dict, names: Dict, values: Dict):
+        if token.startswith(":"):
+            return values[token]
+        return item.get(names.get(token, token))
+
+    def _condition(self, expression: str, item: Dict, names: Dict, values: Dict) -> bool:
+        comparisons = {
+            "<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b, "<>": lambda a, b: a != b,
+            "<": lambda a, b: a < b, ">": lambda a, b: a > b, "=": lambda a, b: a == b
+        }
+        for alternative in re.split(r"\s+OR\s+", expression.strip()):
+            satisfied = True
+            for clause in re.split(r"\s+AND\s+", alternative.strip()):
+                clause = clause.strip()
+                function = re.match(r"(attribute_exists|attribute_not_exists)\((.+)\)$", clause)
+                if function:
+                    exists = names.get(function.group(2).strip(), function.group(2).strip()) in item
+                    satisfied = exists if function.group(1) == "attribute_exists" else not exists
+                else:
+                    left, op, right = re.match(r"(\S+)\s*(<=|>=|<>|<|>|=)\s*(\S+)$", clause).groups()
+                    a = self._operand(left, item, names, values)
+                    b = self._operand(right, item, names, values)
+                    satisfied = a is not None and b is not None and comparisons[op](a, b)
+                if not satisfied:
+                    break
+            if satisfied:
+                return True
+        return False
+
+    def update_item(
+        self,
+        Key: Dict,
+        UpdateExpression: str,
+        ConditionExpression: str = None,
+        ExpressionAttributeNames: Dict = None,
+        ExpressionAttributeValues: Dict = None,
+        ReturnValues: str = "NONE",
+        **kwargs
+    ) -> Dict:
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            current = self._by_key.get(self._key(Key))
+            item = dict(current) if current is not None else dict(Key)
+            if ConditionExpression and not self._condition(ConditionExpression, item, names, values):
+                raise _conditional_check_failed("UpdateItem")
+
+            updated = {}
+            removed = []
+            for action, body in re.findall(
+                r"\b(SET|ADD|DELETE)\s+(.+?)(?=\s+(?:SET|ADD|DELETE)\s+|$)", UpdateExpression.strip()
+            ):
+                for assignment in re.split(r",\s*(?![^()]*\))", body):
+                    if action in ("ADD", "DELETE"):
+                        name, value = assignment.split()
+                        name = names.get(name, name)
+                        value = values[value]
+                        if action == "DELETE":
+                            remaining = set(item.get(name, ())) - value
+                            if remaining:
+                                updated[name] = remaining
+                            elif name in item:
+                                removed.append(name)
+                        elif isinstance(value, set):
+                            updated[name] = set(item.get(name, ())) | value
+                        else:
+                            updated[name] = item.get(name, 0) + value
+                    else:
+                        name, expression = (part.strip() for part in assignment.split("=", 1))
+                        name = names.get(name, name)
+                        default = re.match(r"if_not_exists\((\S+),\s*(\S+)\)$", expression)
+                        if default:
+                            existing = self._operand(default.group(1), item, names, values)
+                            updated[name] = existing if existing is not None else values[default.group(2)]
+                        else:
+                            updated[name] = self._operand(expression, item, names, values)
+            item.update(updated)
+            for name in removed:
+                item.pop(name, None)
+            self._by_key[self._key(Key)] = item
+
+        if ReturnValues == "ALL_OLD":
+            return {"Attributes": dict(current)} if current is not None else {}
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": dict(item)}
+        if ReturnValues == "UPDATED_NEW":
+            return {"Attributes": updated}
+        return {}
+
+
+class LocalCloudWatch:
+    """CloudWatch client stand-in that keeps published metric data"""
+
+    def __init__(self):
+        self.metric_data = []
+        self._lock = threading.Lock()
+
+    def put_metric_data(self, Namespace: str, MetricData: List[Dict], **kwargs) -> Dict:
+        with self._lock:
+            self.metric_data.extend(MetricData)
+        return {}
+
+
+class LocalBackends:
+    """Handles to the installed stand-ins"""
+
+    def __init__(self, s3, bedrock, table, cloudwatch, dedup_table=None):
+        self.s3 = s3
+        self.bedrock = bedrock
+        self.table = table
+        self.cloudwatch = cloudwatch
+        self.dedup_table = dedup_table
+
+
+def install_local_backends(
+    root: str,
+    fake_bedrock: bool = True,
+    bedrock_latency_ms: float = 0.0
+) -> LocalBackends:
+    """
+    Point the handler modules at local stand-ins
+
+    Must run before the handler modules are used. Sets placeholder AWS
+    environment variables so the modules can be imported without AWS
+    configuration.
+
+    Args:
+        root: Directory holding local buckets (root/<bucket>/<key>)
+        fake_bedrock: Replace Bedrock, DynamoDB and CloudWatch as well;
+            False keeps the real clients (real Bedrock with local storage)
+        bedrock_latency_ms: Simulated latency per Bedrock call
+
+    Returns:
+        LocalBackends with the installed clients
+    """
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("AWS_DEFAULT_REGION", os.environ["AWS_REGION"])
+    os.environ.setdefault("VECTOR_BUCKET", "local-vectors")
+    os.environ.setdefault("COST_TABLE", "local-cost-table")
+    os.environ.setdefault("DEDUP_TABLE", "local-dedup-table")
+
+    import vector_store
+    import bedrock_client
+    import audit
+    import ingest_handler
+    import rate_limit
+    import usage
+
+    s3 = LocalS3Client(root)
+    vector_store.s3 = s3
+    audit.s3 = s3
+    ingest_handler.s3 = s3
+
+    bedrock = table = cloudwatch = dedup_table = None
+    if fake_bedrock:
+        bedrock = FakeBedrockRuntime(latency_ms=bedrock_latency_ms)
+        table = LocalDynamoTable()
+        dedup_table = LocalDynamoTable(range_key="norm_hash")
+        cloudwatch = LocalCloudWatch()
+        bedrock_client.bedrock_runtime = bedrock
+        bedrock_client.cloudwatch = cloudwatch
+        rate_limit.table = table
+        usage.table = table
+        ingest_handler.dedup_table = dedup_table
+
+    return LocalBackends(s3, bedrock, table, cloudwatch, dedup_table)
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Local HTTP runner for the Lambda handlers.
+
+An asyncio HTTP/1.1 server adapts requests into API Gateway and S3
+events and runs the real handlers in a thread or process pool, against
+local storage and (optionally) the fake Bedrock stand-in, so the handler
+code paths can be load-tested and profiled on one machine.
+
+Routes:
+    POST /chat                    -> chat_handler (API Gateway event)
+    PUT  /documents/<bucket>/<key> -> store the body, then ingest_handler
+    POST /ingest                  -> ingest_handler (body is an S3 event)
+    GET  /stats                   -> per-route latency and queueing
+    GET  /health
+
+Run:
+    python local_server.py --local-root ./local-data --fake-bedrock --workers 8
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+HANDLERS = {
+    "chat": "chat_handler",
+    "ingest": "ingest_handler"
+}
+
+MAX_BODY_BYTES = int(os.environ.get("LOCAL_SERVER_MAX_BODY_BYTES", str(64 * 1024 * 1024)))
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"
+}
+
+
+class LocalContext:
+    """Stand-in for the Lambda context object"""
+
+    def __init__(self, function_name: str, timeout_seconds: float = 30):
+        self.request_id = uuid.uuid4().hex
+        self.aws_request_id = self.request_id
+        self.function_name = function_name
+        self.memory_limit_in_mb = 1024
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+# Worker state, set up once per worker process (or once for the thread pool)
+_worker = {"profile_dir": None}
+_profiles = threading.local()
+
+
+def _init_worker(root: str, fake_bedrock: bool, bedrock_latency_ms: float, profile_dir: Optional[str]):
+    # Workers outlive each request, so post-response work can run after
+    # the response instead of inline as on Lambda
+    os.environ.setdefault("POST_RESPONSE_MODE", "background")
+    from local_backends import install_local_backends
+    install_local_backends(root, fake_bedrock=fake_bedrock, bedrock_latency_ms=bedrock_latency_ms)
+    _worker["profile_dir"] = profile_dir
+
+
+def _invoke(handler: str, event: Dict, submitted_at: float) -> Tuple[Dict, float, float]:
+    """
+    Run one handler invocation (in a pool worker)
+
+    Returns:
+        (handler result, queue wait ms, handler ms)
+    """
+    import importlib
+    module = importlib.import_module(HANDLERS[handler])
+
+    start = time.time()
+    profile_dir = _worker["profile_dir"]
+    if profile_dir:
+        # One cumulative profile per worker thread, rewritten after each call
+        if not hasattr(_profiles, "profile"):
+            _profiles.profile = cProfile.Profile()
+        _profiles.profile.enable()
+    try:
+        result = module.lambda_handler(event, LocalContext(handler))
+    finally:
+        if profile_dir:
+            _profiles.profile.disable()
+            _profiles.profile.dump_stats(os.path.join(
+                profile_dir, f"{handler}-{os.getpid()}-{threading.get_ident()}.prof"
+            ))
+    end = time.time()
+    return result, (start - submitted_at) * 1000, (end - start) * 1000
+
+
+class RouteStats:
+    """Request counts and latency samples per route"""
+
+    def __init__(self):
+        self._routes: Dict[str, Dict[str, List[float]]] = {}
+
+    def record(self, route: str, status: int, queue_ms: float, handler_ms: float, total_ms: float):
+        route_stats = self._routes.setdefault(route, {
+            "requests": 0, "errors": 0, "queue_ms": [], "handler_ms": [], "total_ms": []
+        })
+        route_stats["requests"] += 1
+        if status >= 500:
+            route_stats["errors"] += 1
+        route_stats["queue_ms"].append(queue_ms)
+        route_stats["handler_ms"].append(handler_ms)
+        route_stats["total_ms"].append(total_ms)
+
+    @staticmethod
+    def _percentiles(samples: List[float]) -> Dict[str, float]:
+        ordered = sorted(samples)
+        if not ordered:
+            return {}
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+        return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1], 2)}
+
+    def summary(self) -> Dict:
+        return {
+            route: {
+                "requests": s["requests"],
+                "errors": s["errors"],
+                "queue_ms": self._percentiles(s["queue_ms"]),
+                "handler_ms": self._percentiles(s["handler_ms"]),
+                "total_ms": self._percentiles(s["total_ms"])
+            }
+            for route, s in self._routes.items()
+        }
+
+    def reset(self):
+        self._routes.clear()
+
+
+class LocalServer:
+    """
+    HTTP front end dispatching to a handler worker pool
+
+    Args:
+        root: Directory for local buckets (see local_backends)
+        workers: Concurrent handler invocations
+        pool: "thread" (shared warm state, like one container per worker
+            thread) or "process" (one container per worker process)
+        fake_bedrock: Use the fake Bedrock stand-in
+        bedrock_latency_ms: Simulated latency per fake Bedrock call
+        profile_dir: Write cProfile stats per worker to this directory
+    """
+
+    def __init__(
+        self,
+        root: str,
+        workers: int = 4,
+        pool: str = "thread",
+        fake_bedrock: bool = True,
+        bedrock_latency_ms: float = 0.0,
+        profile_dir: str = None
+    ):
+        from local_backends import LocalS3Client
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        init_args = (root, fake_bedrock, bedrock_latency_ms, profile_dir)
+        if pool == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args)
+        elif pool == "thread":
+            _init_worker(*init_args)
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        else:
+            raise ValueError(f"Unknown pool: {pool}")
+
+        # Uploads are written from the event loop side; workers read the
+        # same directory
+        self.s3 = LocalS3Client(root)
+        self.stats = RouteStats()
+        self.workers = workers
+        self.pool = pool
+
+    async def invoke(self, handler: str, event: Dict) -> Dict:
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        result, queue_ms, handler_ms = await loop.run_in_executor(
+            self.executor, _invoke, handler, event, time.time()
+        )
+        total_ms = (time.monotonic() - start) * 1000
+
+        if "statusCode" not in result:
+            # Event-driven handlers (ingest) return a plain result dict
+            result = {
+                "statusCode": 500 if result.get("status") == "error" else 200,
+                "body": json.dumps(result, default=str)
+            }
+        self.stats.record(handler, result["statusCode"], queue_ms, handler_ms, total_ms)
+        return result
+
+    async def route(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Dict:
+        """Dispatch one request; returns a Lambda-style response dict"""
+        path = urlsplit(target).path
+
+        if path == "/health":
+            return {"statusCode": 200, "body": json.dumps({"status": "ok", "pool": self.pool, "workers": self.workers})}
+
+        if path == "/stats":
+            if method == "DELETE":
+                self.stats.reset()
+            return {"statusCode": 200, "body": json.dumps(self.stats.summary())}
+
+        if path == "/chat":
+            if method != "POST":
+                return _error(405, "Use POST")
+            return await self.invoke("chat", _api_gateway_event(method, target, headers, body))
+
+        if path == "/ingest":
+            if method != "POST":
+                return _error(405, "Use POST")
+            try:
+                event = json.loads(body or b"{}")
+            except ValueError:
+                return _error(400, "Body must be an S3 event")
+            return await self.invoke("ingest", event)
+
+        if path.startswith("/documents/"):
+            if method != "PUT":
+                return _error(405, "Use PUT")
+            parts = unquote(path[len("/documents/"):]).split("/", 1)
+            if len(parts) < 2 or not parts[1]:
+                return _error(400, "Use /documents/<bucket>/<tenant_id>/<document>")
+            bucket, key = parts
+            self.s3.put_object(
+                Bucket=bucket, Key=key, Body=body,
+                ContentType=headers.get("content-type", "application/octet-stream"),
+                **({"ContentEncoding": headers["content-encoding"]} if "content-encoding" in headers else {})
+            )
+            return await self.invoke("ingest", {
+                "Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": key, "size": len(body)}}}]
+            })
+
+        return _error(404, f"No route for {path}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve requests on one keep-alive connection"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await _write_response(writer, _error(400, "Malformed request line"), keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                if "chunked" in headers.get("transfer-encoding", "").lower():
+                    await _write_response(writer, _error(411, "Send Content-Length"), keep_alive=False)
+                    break
+                length = int(headers.get("content-length", "0") or 0)
+                if length > MAX_BODY_BYTES:
+                    await _write_response(writer, _error(413, f"Body exceeds {MAX_BODY_BYTES} bytes"), keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    response = await self.route(method.upper(), target, headers, body)
+                except Exception as e:
+                    response = _error(500, str(e))
+
+                keep_alive = (
+                    headers.get("connection", "").lower() != "close"
+                    and (version == "HTTP/1.1" or headers.get("connection", "").lower() == "keep-alive")
+                )
+                await _write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        print(f"Serving on http://{host}:{port} ({self.workers} {self.pool} workers)")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def _api_gateway_event(method: str, target: str, headers: Dict[str, str], body: bytes) -> Dict:
+    """API Gateway (HTTP API, payload 2.0) event for a request"""
+    parts = urlsplit(target)
+    return {
+        "version": "2.0",
+        "rawPath": parts.path,
+        "rawQueryString": parts.query,
+        "headers": headers,
+        "requestContext": {
+            "http": {"method": method, "path": parts.path},
+            "requestId": uuid.uuid4().hex,
+            "timeEpoch": int(time.time() * 1000)
+        },
+        "body": body.decode("utf-8", errors="replace"),
+        "isBase64Encoded": False
+    }
+
+
+def _error(status: int, message: str) -> Dict:
+    return {"statusCode": status, "body": json.dumps({"error": message})}
+
+
+async def _write_response(writer: asyncio.StreamWriter, response: Dict, keep_alive: bool):
+    status = response.get("statusCode", 200)
+    body = response.get("body", "")
+    payload = body.encode("utf-8") if isinstance(body, str) else (body or b"")
+    headers = {"Content-Type": "application/json", **(response.get("headers") or {})}
+    headers["Content-Length"] = str(len(payload))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+
+    head = f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode("latin-1") + b"\r\n" + payload)
+    await writer.drain()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Lambda handlers locally over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--local-root", default="./local-data", help="Directory for local buckets")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Concurrent handler invocations")
+    parser.add_argument("--pool", choices=["thread", "process"], default="thread",
+                        help="Run handlers in threads (shared warm state) or processes")
+    parser.add_argument("--fake-bedrock", action="store_true", help="Use the fake Bedrock stand-in")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=0.0,
+                        help="Simulated latency per fake Bedrock call")
+    parser.add_argument("--profile-dir", help="Write cProfile stats per worker to this directory")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    local_server = LocalServer(
+        args.local_root,
+        workers=args.workers,
+        pool=args.pool,
+        fake_bedrock=args.fake_bedrock,
+        bedrock_latency_ms=args.bedrock_latency_ms,
+        profile_dir=args.profile_dir
+    )
+    try:
+        asyncio.run(local_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        local_server.close()
@@ -0,0 +1,241 @@
+"""
+Staged processing pipeline with bounded queues
+- Each stage runs in its own thread(s) and streams items to the next
+- Bounded queues between stages provide backpressure and cap memory
+- Per-stage throughput, wait times and queue depth statistics
+
+Usage:
+    pipeline = Pipeline(queue_size=8)
+    pipeline.add_stage("fetch", lambda _: read_blocks(body))
+    pipeline.add_stage("parse", lambda blocks: (parse(b) for b in blocks))
+    pipeline.add_stage("embed", embed_items, workers=4)
+    pipeline.add_stage("write", write_batches, batch_size=16)
+    for result in pipeline.run():
+        ...
+    print(pipeline.stats())
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+# Marks the end of a stage's output
+_END = object()
+
+# How often blocked threads check whether the pipeline was aborted
+POLL_INTERVAL = 0.05
+
+
+class PipelineAborted(Exception):
+    """Raised inside stages when another stage failed"""
+    pass
+
+
+class _Stage:
+    """One pipeline stage and its counters"""
+
+    def __init__(self, name: str, fn: Callable, workers: int, batch_size: Optional[int]):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.running = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.idle_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.depth_total = 0
+        self.depth_samples = 0
+        self.depth_max = 0
+        self.started = None
+        self.finished = None
+
+    def stats(self) -> Dict:
+        seconds = (self.finished or time.monotonic()) - self.started if self.started else 0.0
+        return {
+            "workers": self.workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "seconds": round(seconds, 4),
+            # Source stages have no inputs; rate them by output
+            "items_per_second": round((self.items_in or self.items_out) / seconds, 2) if seconds else 0.0,
+            "idle_seconds": round(self.idle_seconds, 4),
+            "blocked_seconds": round(self.blocked_seconds, 4),
+            "input_queue_max": self.depth_max,
+            "input_queue_avg": round(self.depth_total / self.depth_samples, 2) if self.depth_samples else 0.0
+        }
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues.
+
+    A stage is a function taking an iterator of input items and returning
+    an iterable of output items; the first stage receives an empty
+    iterator. Stages with several workers share one input iterator, so
+    their output order is not preserved. With batch_size, the stage
+    receives lists of up to batch_size items instead of single items.
+    """
+
+    def __init__(self, queue_size: int = 8):
+        self.queue_size = queue_size
+        self._stages: List[_Stage] = []
+        self._abort = threading.Event()
+        self._error = None
+
+    def add_stage(
+        self,
+        name: str,
+        fn: Callable[[Iterator], Iterable],
+        workers: int = 1,
+        batch_size: int = None
+    ) -> "Pipeline":
+        """
+        Append a stage
+
+        Args:
+            name: Stage name used in statistics
+            fn: Function mapping an input iterator to output items
+            workers: Threads running fn concurrently
+            batch_size: Deliver inputs as lists of up to this many items
+
+        Returns:
+            The pipeline, for chaining
+        """
+        self._stages.append(_Stage(name, fn, max(1, workers), batch_size))
+        return self
+
+    def _get(self, q: queue.Queue, stage: _Stage):
+        waited = time.monotonic()
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                item = q.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        with stage.lock:
+            stage.idle_seconds += time.monotonic() - waited
+        return item
+
+    def _put(self, q: queue.Queue, item, stage: _Stage):
+        waited = time.monotonic()
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        with stage.lock:
+            stage.blocked_seconds += time.monotonic() - waited
+
+    def _inputs(self, q: Optional[queue.Queue], stage: _Stage) -> Iterator:
+        if q is None:
+            return
+        while True:
+            item = self._get(q, stage)
+            if item is _END:
+                # Leave the marker for the stage's other workers
+                q.put(_END)
+                return
+            with stage.lock:
+                stage.items_in += 1
+                depth = q.qsize()
+                stage.depth_total += depth
+                stage.depth_samples += 1
+                stage.depth_max = max(stage.depth_max, depth)
+            yield item
+
+    @staticmethod
+    def _batched(items: Iterator, batch_size: int) -> Iterator[List]:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _worker(self, stage: _Stage, q_in: Optional[queue.Queue], q_out: queue.Queue):
+        try:
+            inputs = self._inputs(q_in, stage)
+            if stage.batch_size:
+                inputs = self._batched(inputs, stage.batch_size)
+            for item in stage.fn(inputs):
+                self._put(q_out, item, stage)
+                with stage.lock:
+                    stage.items_out += 1
+        except PipelineAborted:
+            return
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._abort.set()
+            return
+
+        with stage.lock:
+            stage.running -= 1
+            last = stage.running == 0
+            if last:
+                stage.finished = time.monotonic()
+        if last:
+            try:
+                self._put(q_out, _END, stage)
+            except PipelineAborted:
+                pass
+
+    def run(self) -> Iterator:
+        """
+        Start all stages and yield the final stage's output
+
+        Raises:
+            The first exception raised by any stage
+        """
+        if not self._stages:
+            return
+
+        queues = [None] + [queue.Queue(maxsize=self.queue_size) for _ in self._stages]
+        threads = []
+        for i, stage in enumerate(self._stages):
+            stage.started = time.monotonic()
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(stage, queues[i], queues[i + 1]),
+                    name=f"pipeline-{stage.name}-{n}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        output = queues[-1]
+        try:
+            while True:
+                try:
+                    item = output.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if self._abort.is_set():
+                        break
+                    continue
+                if item is _END:
+                    break
+                yield item
+        finally:
+            # Stop the stages if the consumer stopped early or a stage failed
+            if self._error is not None or not all(s.finished for s in self._stages):
+                self._abort.set()
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per-stage statistics, in stage order"""
+        return {stage.name: stage.stats() for stage in self._stages}
@@ -0,0 +1,175 @@
+"""
+Post-response work for the request handlers
+- Deferred work queue for evaluation and audit assembly
+- Background or inline execution, with latency accounting
+- Deterministic per-request sampling
+
+Lambda freezes the container once the handler returns: background
+tasks still pending at that point would only resume during the next warm
+invocation (slowing an unrelated request) and are lost if the container
+is recycled. Tasks therefore run inline before the handler returns by
+default, and only EVAL_SAMPLE_RATE of chat answers (10% by default) are
+evaluated. Background mode is for long-running processes such as
+local_server.py.
+"""
+
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger()
+
+# "inline": run before returning; "background": run on a worker thread
+# (only safe where the process keeps running after the response)
+POST_RESPONSE_MODE = os.environ.get("POST_RESPONSE_MODE", "inline")
+
+# Fraction of chat requests whose answers are evaluated; the rest skip
+# evaluation entirely
+EVAL_SAMPLE_RATE = float(os.environ.get("EVAL_SAMPLE_RATE", "0.1"))
+
+
+def should_sample(rate: float, key: str) -> bool:
+    """
+    Decide whether a request is sampled
+
+    Deterministic in the key (e.g. the request ID), so retries and log
+    lines agree on whether a request was sampled.
+
+    Args:
+        rate: Sampling rate (0-1)
+        key: Stable request key
+
+    Returns:
+        True if the request falls in the sample
+    """
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    bucket = int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16)
+    return bucket / 0xFFFFFFFF < rate
+
+
+class PostResponseQueue:
+    """
+    Queue of work that must not delay the response.
+
+    Handlers defer() tasks while building the response and call
+    complete() just before returning. In inline mode complete() runs
+    them; in background mode they run on a daemon worker thread.
+    """
+
+    def __init__(self, mode: str = None):
+        self.mode = mode or POST_RESPONSE_MODE
+        self._queue = queue.Queue()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stats = {
+            "deferred": 0,
+            "completed": 0,
+            "failed": 0,
+            "task_ms": 0.0,
+            "added_ms": 0.0
+        }
+
+    def defer(self, name: str, fn: Callable, *args, **kwargs):
+        """
+        Defer a task until after the response is built
+
+        Args:
+            name: Task name for logs and statistics
+            fn: Callable to run
+            *args, **kwargs: Arguments for fn
+        """
+        with self._lock:
+            self._stats["deferred"] += 1
+            self._pending.append((name, fn, args, kwargs, time.monotonic()))
+
+    def complete(self) -> float:
+        """
+        Hand off the deferred tasks of the current request
+
+        Returns:
+            Milliseconds this call added to the request
+        """
+        start = time.monotonic()
+        with self._lock:
+            tasks, self._pending = self._pending, []
+
+        if self.mode == "inline":
+            for task in tasks:
+                self._run(*task)
+        else:
+            self._ensure_worker()
+            for task in tasks:
+                self._queue.put(task)
+
+        added_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self._stats["added_ms"] += added_ms
+        if tasks:
+            logger.info(f"Post-response work ({self.mode}): {len(tasks)} task(s), added {added_ms:.2f} ms")
+        return added_ms
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until every handed-off task has run
+
+        Args:
+            timeout: Maximum seconds to wait (None waits indefinitely)
+
+        Returns:
+            True if the queue drained in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def stats(self) -> Dict:
+        """Counters and cumulative task / added latency"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._drain, name="post-response", daemon=True)
+                self._worker.start()
+
+    def _drain(self):
+        while True:
+            task = self._queue.get()
+            try:
+                self._run(*task)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, name: str, fn: Callable, args: tuple, kwargs: dict, deferred_at: float):
+        start = time.monotonic()
+        try:
+            fn(*args, **kwargs)
+            failed = False
+        except Exception as e:
+            logger.error(f"Post-response task {name} failed: {str(e)}", exc_info=True)
+            failed = True
+
+        task_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self._stats["failed" if failed else "completed"] += 1
+            self._stats["task_ms"] += task_ms
+        logger.info(
+            f"Post-response task {name}: {task_ms:.1f} ms "
+            f"(started {(start - deferred_at) * 1000:.1f} ms after defer)"
+        )
+
+
+# Shared by the handlers of this container
+post_response = PostResponseQueue()
@@ -1,3 +1,9 @@
+import os
+import re
+from typing import Callable, Dict, List, Tuple
+
+from chunking import approximate_token_count
+
 SYSTEM_PROMPT = """
 You are an internal enterprise assistant.
 Answer only using the provided context.
@@ -5,11 +11,158 @@ If the answer is not in the context, say:
 "I do not have enough information."
 """
 
-def build_prompt(context_chunks, user_question):
-    context_text = "\n\n".join([chunk["text"] for chunk in context_chunks])
-    return f"""
-{SYSTEM_PROMPT}
+# Maximum estimated tokens of retrieved context per prompt
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "2000"))
+
+WORD = re.compile(r"\S+")
+
+
+def _overlap_cut(previous: str, following: str) -> int:
+    """
+    Character offset in `following` just past the words that repeat the
+    end of `previous` (0 if the texts do not overlap)
+    """
+    previous_words = previous.split()
+    matches = list(WORD.finditer(following))
+    following_words = [m.group() for m in matches]
+
+    for k in range(min(len(previous_words), len(following_words)), 0, -1):
+        if previous_words[-k] == following_words[0] and previous_words[-k:] == following_words[:k]:
+            return matches[k - 1].end()
+    return 0
+
+
+def _merge_group(chunks_by_index: Dict[int, Dict]) -> List[Dict]:
+    """
+    Merge one document's selected chunks into blocks of consecutive
+    chunk indexes, dropping the text adjacent chunks repeat
+    """
+    blocks = []
+    for index in sorted(chunks_by_index):
+        chunk = chunks_by_index[index]
+        if blocks and blocks[-1]["chunk_indexes"][-1] == index - 1:
+            block = blocks[-1]
+            block["text"] += chunk["text"][_overlap_cut(block["text"], chunk["text"]):]
+            block["chunk_indexes"].append(index)
+            block["similarity"] = max(block["similarity"], chunk.get("similarity", 0.0))
+        else:
+            blocks.append({
+                "text": chunk["text"],
+                "doc_id": chunk.get("doc_id"),
+                "chunk_indexes": [index],
+                "similarity": chunk.get("similarity", 0.0)
+            })
+    return blocks
+
+
+def pack_context(
+    context_chunks: List[Dict],
+    max_tokens: int = None,
+    estimator: Callable[[str], int] = approximate_token_count
+) -> Tuple[List[Dict], Dict]:
+    """
+    Select and merge retrieved chunks into a token budget
+
+    Chunks are taken greedily by similarity. Adjacent chunks of the same
+    document are merged with their repeated overlap removed, chunks whose
+    text is already in the context are dropped, and chunks that would
+    exceed the budget are skipped.
+
+    Args:
+        context_chunks: Retrieved chunks ("text", optional "similarity",
+            "doc_id" and "metadata.chunk_index")
+        max_tokens: Context token budget (default CONTEXT_TOKEN_BUDGET)
+        estimator: Token estimator
+
+    Returns:
+        (blocks in prompt order, packing statistics)
+    """
+    max_tokens = CONTEXT_TOKEN_BUDGET if max_tokens is None else max_tokens
+    ranked = sorted(
+        enumerate(context_chunks),
+        key=lambda pair: (-pair[1].get("similarity", 0.0), pair[0])
+    )
 
+    groups = {}        # group key -> {chunk index: chunk}
+    group_blocks = {}  # group key -> merged blocks
+    group_tokens = {}  # group key -> estimated tokens of its blocks
+    used_tokens = 0
+    duplicates = 0
+    over_budget = 0
+
+    for position, chunk in ranked:
+        text = chunk.get("text", "")
+        if not text.strip():
+            continue
+
+        if any(text in block["text"] for blocks in group_blocks.values() for block in blocks):
+            duplicates += 1
+            continue
+
+        doc_id = chunk.get("doc_id") or chunk.get("metadata", {}).get("source")
+        index = chunk.get("metadata", {}).get("chunk_index")
+        if doc_id is None or index is None:
+            # Unknown position: never merged with other chunks
+            key, index = ("chunk", position), 0
+        else:
+            key = ("doc", doc_id)
+
+        trial = {**groups.get(key, {}), index: chunk}
+        blocks = _merge_group(trial)
+        tokens = sum(estimator(block["text"]) for block in blocks)
+        if used_tokens - group_tokens.get(key, 0) + tokens > max_tokens:
+            over_budget += 1
+            continue
+
+        used_tokens += tokens - group_tokens.get(key, 0)
+        groups[key] = trial
+        group_blocks[key] = blocks
+        group_tokens[key] = tokens
+
+    # Documents in order of their best chunk, blocks in document order
+    packed = [block for blocks in group_blocks.values() for block in blocks]
+
+    tokens_before = sum(estimator(c.get("text", "")) for c in context_chunks if c.get("text", "").strip())
+    stats = {
+        "chunks_in": len(context_chunks),
+        "chunks_used": sum(len(g) for g in groups.values()),
+        "blocks": len(packed),
+        "duplicates_removed": duplicates,
+        "over_budget": over_budget,
+        "tokens_before": tokens_before,
+        "tokens_after": used_tokens,
+        "tokens_saved": tokens_before - used_tokens
+    }
+    return packed, stats
+
+
+def build_prompt_with_stats(
+    context_chunks,
+    user_question,
+    max_context_tokens: int = None,
+    history: str = None
+):
+    """
+    Build the RAG prompt from packed context
+
+    Args:
+        context_chunks: Retrieved chunks
+        user_question: Question to answer
+        max_context_tokens: Context token budget (default CONTEXT_TOKEN_BUDGET)
+        history: Conversation so far (conversation.format_history())
+
+    Returns:
+        (prompt, packing statistics from pack_context)
+    """
+    blocks, stats = pack_context(context_chunks, max_context_tokens)
+    context_text = "\n\n".join([block["text"] for block in blocks])
+    history_text = f"""
+Conversation so far:
+{history}
+""" if history else ""
+    prompt = f"""
+{SYSTEM_PROMPT}
+{history_text}
 Context:
 {context_text}
 
@@ -18,3 +171,9 @@ Question:
 
 Answer:
 """
+    return prompt, stats
+
+
+def build_prompt(context_chunks, user_question, max_context_tokens: int = None, history: str = None):
+    prompt, _ = build_prompt_with_stats(context_chunks, user_question, max_context_tokens, history)
+    return prompt
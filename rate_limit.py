@@ -0,0 +1,179 @@
+"""
+Per-tenant request rate limiting
+- In-process token buckets: no I/O, absorb bursts within one container
+- Sliding-window counters in DynamoDB: one conditional update per
+  request enforces the limit across all Lambda containers
+
+The chat handler checks the limit before any Bedrock call, so a tenant
+over its limit costs at most one DynamoDB write per request.
+
+Usage:
+    from rate_limit import check_rate_limit
+    result = check_rate_limit(tenant_id, "chat")
+    if not result["allowed"]:
+        ...  # 429, Retry-After: result["retry_after"]
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict
+
+import boto3
+from botocore.exceptions import ClientError
+
+from security import TokenBucket
+
+logger = logging.getLogger()
+
+# Requests per minute per tenant and action (0 disables rate limiting)
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "60"))
+# Requests one container may take at once (default: the per-minute limit).
+# The buckets refill at the per-minute rate, so on their own they admit
+# up to burst + limit requests in a minute; the shared window holds each
+# minute to the limit.
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "0")) or None
+# Enforce the limit across containers through DynamoDB
+RATE_LIMIT_SHARED = os.environ.get("RATE_LIMIT_SHARED", "true").lower() == "true"
+RATE_LIMIT_WINDOW_SECONDS = 60
+
+# Counters live in the cost table unless a separate table is configured:
+# tenant_id "ratelimit#<key>", timestamp = window start
+RATE_LIMIT_TABLE = os.environ.get("RATE_LIMIT_TABLE") or os.environ.get("COST_TABLE")
+RATE_LIMIT_KEY_PREFIX = "ratelimit#"
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(RATE_LIMIT_TABLE)
+
+
+class SlidingWindowCounter:
+    """
+    Sliding-window request counter shared through DynamoDB
+
+    Requests are counted per fixed window, one item per key and window.
+    The rate over the last window_seconds is estimated as the previous
+    window's count, weighted by how much of it the sliding window still
+    covers, plus the current window's count. Each request is a single
+    UpdateItem that ADDs to the current count only if the estimate stays
+    within the limit. The previous window's count no longer changes, so
+    it is read once per key and window.
+    """
+
+    def __init__(self, limit: int, window_seconds: int = RATE_LIMIT_WINDOW_SECONDS):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._previous = {}  # key -> (window, count)
+        self._lock = threading.Lock()
+
+    def _previous_count(self, key: str, window: int) -> int:
+        with self._lock:
+            cached = self._previous.get(key)
+        if cached and cached[0] == window:
+            return cached[1]
+
+        response = table.get_item(
+            Key={"tenant_id": RATE_LIMIT_KEY_PREFIX + key, "timestamp": window * self.window_seconds}
+        )
+        count = int(response.get("Item", {}).get("request_count", 0))
+        with self._lock:
+            self._previous[key] = (window, count)
+        return count
+
+    def acquire(self, key: str, cost: int = 1, now: float = None) -> float:
+        """
+        Count `cost` requests for key if the limit allows
+
+        Returns:
+            0.0 if allowed, else seconds until the current window ends
+        """
+        now = time.time() if now is None else now
+        window = int(now // self.window_seconds)
+        window_start = window * self.window_seconds
+        retry_after = window_start + self.window_seconds - now
+
+        overlap = 1.0 - (now - window_start) / self.window_seconds
+        previous = self._previous_count(key, window - 1)
+        # Current count after this request must not exceed the remainder
+        max_current = math.floor(self.limit - previous * overlap) - cost
+        if max_current < 0:
+            return retry_after
+
+        try:
+            table.update_item(
+                Key={"tenant_id": RATE_LIMIT_KEY_PREFIX + key, "timestamp": window_start},
+                UpdateExpression="ADD request_count :cost SET expires_at = if_not_exists(expires_at, :expires)",
+                ConditionExpression="attribute_not_exists(request_count) OR request_count <= :max_current",
+                ExpressionAttributeValues={
+                    ":cost": cost,
+                    ":max_current": max_current,
+                    # Items are only needed for the next window; TTL cleans them up
+                    ":expires": window_start + 3 * self.window_seconds
+                }
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return retry_after
+            raise
+        return 0.0
+
+
+class RateLimiter:
+    """In-process token buckets in front of the shared sliding window"""
+
+    def __init__(
+        self,
+        limit_per_minute: int = RATE_LIMIT_PER_MINUTE,
+        burst: int = RATE_LIMIT_BURST,
+        shared: bool = RATE_LIMIT_SHARED
+    ):
+        self.limit_per_minute = limit_per_minute
+        self.local = TokenBucket(limit_per_minute, burst)
+        self.shared = SlidingWindowCounter(limit_per_minute) if shared else None
+
+    def check(self, key: str, cost: int = 1) -> Dict:
+        """
+        Check and count `cost` requests for key
+
+        Returns:
+            Dictionary with allowed, retry_after (seconds) and limited_by
+            ("local", "shared" or None)
+        """
+        if not self.limit_per_minute:
+            return {"allowed": True, "retry_after": 0.0, "limited_by": None}
+
+        wait = self.local.acquire(key, cost)
+        if wait:
+            return {"allowed": False, "retry_after": wait, "limited_by": "local"}
+
+        if self.shared is not None:
+            try:
+                wait = self.shared.acquire(key, cost)
+            except Exception as e:
+                # Fail open: the in-process limit still applies
+                logger.warning(f"Shared rate limit check failed for {key}: {str(e)}")
+                wait = 0.0
+            if wait:
+                return {"allowed": False, "retry_after": wait, "limited_by": "shared"}
+
+        return {"allowed": True, "retry_after": 0.0, "limited_by": None}
+
+
+# Kept across warm invocations
+limiter = RateLimiter()
+
+
+def check_rate_limit(tenant_id: str, action: str = "chat", cost: int = 1) -> Dict:
+    """
+    Check the per-tenant rate limit for an action
+
+    Args:
+        tenant_id: Tenant identifier
+        action: Action being rate limited
+        cost: Requests to count (e.g. questions in a batch)
+
+    Returns:
+        RateLimiter.check() result
+    """
+    return limiter.check(f"{tenant_id}#{action}", cost)
@@ -0,0 +1,260 @@
+"""
+Streaming readers for large S3 source documents
+- Parallel ranged GETs with a bounded prefetch window
+- Streaming gzip / zstd decompression, detected from Content-Encoding
+  or the key's extension
+"""
+
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for zstd-compressed uploads
+    zstandard = None
+
+# Objects at least this large are read with parallel ranged GETs
+RANGED_READ_THRESHOLD = int(os.environ.get("RANGED_READ_THRESHOLD", str(64 * 1024 * 1024)))
+RANGED_READ_PART_SIZE = int(os.environ.get("RANGED_READ_PART_SIZE", str(8 * 1024 * 1024)))
+RANGED_READ_CONCURRENCY = int(os.environ.get("RANGED_READ_CONCURRENCY", "4"))
+
+ENCODING_EXTENSIONS = {
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".zst": "zstd",
+    ".zstd": "zstd"
+}
+
+
+class _ByteQueue:
+    """
+    Queue of byte blocks read from the front.
+
+    Blocks are kept as received and read through an offset into the first
+    one, so each read copies only the bytes it returns; a block is dropped
+    once fully consumed.
+    """
+
+    def __init__(self):
+        self._blocks = deque()
+        self._offset = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, data: bytes):
+        if data:
+            self._blocks.append(data)
+            self._size += len(data)
+
+    def take(self, size: int = -1) -> bytes:
+        """Remove and return up to `size` bytes (all if size < 0)"""
+        if size < 0 or size > self._size:
+            size = self._size
+
+        pieces = []
+        remaining = size
+        while remaining:
+            block = self._blocks[0]
+            available = len(block) - self._offset
+            if available <= remaining:
+                pieces.append(block[self._offset:] if self._offset else block)
+                self._blocks.popleft()
+                self._offset = 0
+                remaining -= available
+            else:
+                pieces.append(block[self._offset:self._offset + remaining])
+                self._offset += remaining
+                remaining = 0
+
+        self._size -= size
+        return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+
+class RangedReader:
+    """
+    File-like reader fetching an object as parallel ranged GETs.
+
+    Up to `concurrency` parts are in flight ahead of the reader, so memory
+    is bounded by concurrency * part_size regardless of object size.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        key: str,
+        size: int,
+        etag: str = None,
+        part_size: int = RANGED_READ_PART_SIZE,
+        concurrency: int = RANGED_READ_CONCURRENCY
+    ):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.part_size = part_size
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self._window = max(1, concurrency)
+        self._pending = deque()
+        self._next_offset = 0
+        self._buffer = _ByteQueue()
+        self._fill()
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        kwargs = {"Bucket": self.bucket, "Key": self.key, "Range": f"bytes={start}-{end}"}
+        if self.etag:
+            # All parts must come from the same object version
+            kwargs["IfMatch"] = self.etag
+        return self.s3.get_object(**kwargs)["Body"].read()
+
+    def _fill(self):
+        while len(self._pending) < self._window and self._next_offset < self.size:
+            start = self._next_offset
+            end = min(start + self.part_size, self.size) - 1
+            self._pending.append(self._executor.submit(self._fetch, start, end))
+            self._next_offset = end + 1
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self._buffer) < size) and self._pending:
+            self._buffer.append(self._pending.popleft().result())
+            self._fill()
+
+        if not self._pending:
+            self._executor.shutdown(wait=False)
+
+        return self._buffer.take(size)
+
+    def close(self):
+        """Cancel parts not yet fetched and release buffered ones"""
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._buffer = _ByteQueue()
+        self._executor.shutdown(wait=False)
+
+
+class GzipReader:
+    """
+    Streaming gzip decompression over a file-like object.
+    Handles multi-member files (e.g. concatenated gzip output).
+    """
+
+    def __init__(self, raw, read_size: int = 64 * 1024):
+        self._raw = raw
+        self._read_size = read_size
+        self._decompressor = self._new_member()
+        self._in_member = False
+        self._buffer = _ByteQueue()
+        self._eof = False
+
+    @staticmethod
+    def _new_member():
+        # 32 + MAX_WBITS: accept gzip or zlib headers
+        return zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            if self._decompressor.eof:
+                # Start over on the next member
+                data = self._decompressor.unused_data
+                self._decompressor = self._new_member()
+                self._in_member = False
+            else:
+                data = self._decompressor.unconsumed_tail
+
+            data = data or self._raw.read(self._read_size)
+            if not data:
+                if self._in_member:
+                    raise EOFError("Compressed stream ended before the end-of-stream marker")
+                self._eof = True
+                break
+
+            self._in_member = True
+            # Bounded output per call keeps memory flat on highly compressible input
+            self._buffer.append(self._decompressor.decompress(data, self._read_size * 16))
+
+        return self._buffer.take(size)
+
+
+def detect_encoding(key: str, content_encoding: str = None) -> Optional[str]:
+    """
+    Determine the compression of an object
+
+    Args:
+        key: Object key
+        content_encoding: Content-Encoding of the object, if set
+
+    Returns:
+        "gzip", "zstd" or None for uncompressed objects
+
+    Raises:
+        ValueError: If Content-Encoding names an unsupported compression
+    """
+    if content_encoding:
+        encoding = content_encoding.split(",")[0].strip().lower()
+        if encoding in ("gzip", "x-gzip"):
+            return "gzip"
+        if encoding in ("zstd", "zstandard"):
+            return "zstd"
+        if encoding not in ("identity", ""):
+            raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+
+    _, extension = os.path.splitext(key.lower())
+    return ENCODING_EXTENSIONS.get(extension)
+
+
+def decompressing_reader(raw, encoding: Optional[str]):
+    """
+    Wrap a byte stream with streaming decompression
+
+    Args:
+        raw: File-like object with read(size)
+        encoding: Result of detect_encoding()
+
+    Returns:
+        File-like object yielding decompressed bytes
+    """
+    if encoding is None:
+        return raw
+    if encoding == "gzip":
+        return GzipReader(raw)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to ingest zstd-compressed documents")
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def open_object(s3_client, bucket: str, key: str, head: Dict = None):
+    """
+    Open an S3 object as a raw byte stream
+
+    Large objects are fetched with parallel ranged GETs, others with a
+    single streaming GET. Reads are pinned to the ETag in `head`.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Bucket name
+        key: Object key
+        head: head_object() response (fetched if not given)
+
+    Returns:
+        File-like object with read(size) returning the stored bytes
+    """
+    head = head or s3_client.head_object(Bucket=bucket, Key=key)
+    size = head.get("ContentLength", 0)
+    etag = head.get("ETag")
+
+    if size >= RANGED_READ_THRESHOLD:
+        return RangedReader(s3_client, bucket, key, size, etag)
+
+    kwargs = {"Bucket": bucket, "Key": key}
+    if etag:
+        kwargs["IfMatch"] = etag
+    return s3_client.get_object(**kwargs)["Body"]
@@ -3,17 +3,33 @@ Security utilities for RAG system
 - Multi-tenant isolation
 - Input sanitization
 - Output filtering
-- Audit logging
+- Audit logging (written by audit.py)
 """
 
 import hashlib
 import hmac
 import re
 import json
-from typing import Dict, Optional
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, Iterator, Optional
 from datetime import datetime
 from decimal import Decimal
 
+from audit import audit_mode, record_audit, AUDIT_STEP_MODE
+from guardrails import mask_pii as _mask_pii
+
+# Markup removed from model output (script first, then iframe)
+SCRIPT_TAG = re.compile(r'<script[^>]*>.*?</script>', re.IGNORECASE | re.DOTALL)
+IFRAME_TAG = re.compile(r'<iframe[^>]*>.*?</iframe>', re.IGNORECASE | re.DOTALL)
+TRUNCATION_MARKER = "...[truncated]"
+
+# Whitespace PII matches cannot span (as in guardrails.split_for_masking);
+# at the end of the buffer the next character is not known yet
+_PII_SAFE_CUT = re.compile(r"(?<!\d)\s|\s(?!\d)")
+_PII_SAFE_CUT_AT_END = re.compile(r"(?<!\d)\s")
+
 
 def sanitize_tenant_id(tenant_id: str) -> str:
     """
@@ -85,28 +101,226 @@ def validate_s3_path(tenant_id: str, doc_id: str) -> str:
     return f"{safe_tenant}/{safe_doc}"
 
 
-def sanitize_output(text: str, max_length: int = 50000) -> str:
+def sanitize_output(text: str, max_length: int = 50000, mask_pii: bool = False) -> str:
     """
     Sanitize LLM output before returning to user
     
     Args:
         text: Raw LLM output
         max_length: Maximum allowed length
+        mask_pii: Also mask PII (see guardrails.mask_pii)
         
     Returns:
         Sanitized output
     """
     # Remove any potential script tags or HTML
-    sanitized = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.IGNORECASE | re.DOTALL)
-    sanitized = re.sub(r'<iframe[^>]*>.*?</iframe>', '', sanitized, flags=re.IGNORECASE | re.DOTALL)
+    sanitized = SCRIPT_TAG.sub('', text)
+    sanitized = IFRAME_TAG.sub('', sanitized)
+    
+    if mask_pii:
+        sanitized = _mask_pii(sanitized)
     
     # Limit output length
     if len(sanitized) > max_length:
-        sanitized = sanitized[:max_length] + "...[truncated]"
+        sanitized = sanitized[:max_length] + TRUNCATION_MARKER
     
     return sanitized.strip()
 
 
+class _TagFilter:
+    """
+    Incremental equivalent of re.sub(r'<tag[^>]*>.*?</tag>', '', text)
+    (case-insensitive)
+    
+    Holds back text from a possible opening tag until its closing tag
+    arrives (then drops the span) or the stream ends (then releases it,
+    since the pattern cannot match anywhere after an unclosed tag).
+    """
+    
+    def __init__(self, tag: str):
+        self.opening = re.compile(f"<{tag}", re.IGNORECASE)
+        self.closing = re.compile(f"</{tag}>", re.IGNORECASE)
+        self.prefix = f"<{tag}"
+        self.buffer = ""
+        self.inside = False   # buffer starts with an opening tag
+        self.scan_from = 0    # Where to resume looking for ">" / closing tag
+        self.opened = False   # ">" of the opening tag seen
+    
+    def _partial_opening(self) -> int:
+        """Length of a trailing prefix of the opening tag ("<", "<scr", ...)"""
+        tail = self.buffer[-(len(self.prefix) - 1):].lower()
+        for i in range(len(tail)):
+            if self.prefix.startswith(tail[i:]):
+                return len(tail) - i
+        return 0
+    
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        released = []
+        while True:
+            if not self.inside:
+                match = self.opening.search(self.buffer)
+                if match is None:
+                    hold = self._partial_opening()
+                    released.append(self.buffer[:len(self.buffer) - hold])
+                    self.buffer = self.buffer[len(self.buffer) - hold:]
+                    break
+                released.append(self.buffer[:match.start()])
+                self.buffer = self.buffer[match.start():]
+                self.inside, self.opened, self.scan_from = True, False, len(self.prefix)
+            
+            if not self.opened:
+                end = self.buffer.find(">", self.scan_from)
+                if end < 0:
+                    self.scan_from = len(self.buffer)
+                    break
+                self.opened, self.scan_from = True, end + 1
+            
+            match = self.closing.search(self.buffer, self.scan_from)
+            if match is None:
+                # A closing tag may straddle the next piece
+                self.scan_from = max(self.scan_from, len(self.buffer) - len(self.prefix) - 1)
+                break
+            self.buffer = self.buffer[match.end():]
+            self.inside = False
+        return "".join(released)
+    
+    def finish(self) -> str:
+        released, self.buffer, self.inside = self.buffer, "", False
+        return released
+
+
+class StreamingSanitizer:
+    """
+    Incremental sanitize_output() for streamed generations
+    
+    feed() takes each generated piece and returns the text that is safe
+    to send now; finish() returns the rest. Text is held back only while
+    it could still change: from a possible <script>/<iframe> opening tag
+    to its closing tag, and since the last whitespace no PII match can
+    span. The concatenated output equals
+    sanitize_output(text, max_length, mask_pii).
+    
+    Usage:
+        sanitizer = StreamingSanitizer()
+        for piece in pieces:
+            send(sanitizer.feed(piece))
+        send(sanitizer.finish())
+    """
+    
+    def __init__(self, max_length: int = 50000, mask_pii: bool = True):
+        self.max_length = max_length
+        self.mask_pii = mask_pii
+        # Same order as sanitize_output(): iframes are found in script-free text
+        self.filters = [_TagFilter("script"), _TagFilter("iframe")]
+        self.pending = ""       # Tag-free text not yet PII-masked
+        self.length = 0         # Masked characters released (before stripping)
+        self.started = False    # Non-whitespace released (leading strip done)
+        self.whitespace = ""    # Trailing whitespace held for the final strip
+        self.done = False
+    
+    @property
+    def held(self) -> int:
+        """Characters received but not yet released"""
+        return sum(len(f.buffer) for f in self.filters) + len(self.pending) + len(self.whitespace)
+    
+    def _safe_cut(self, start: int) -> int:
+        """Last whitespace in pending at or after start that PII cannot span, or -1"""
+        last = len(self.pending) - 1
+        for i in range(last, start - 1, -1):
+            if self.pending[i].isspace():
+                safe_cut = _PII_SAFE_CUT_AT_END if i == last else _PII_SAFE_CUT
+                if safe_cut.match(self.pending, i):
+                    return i
+        return -1
+    
+    def _release(self, text: str) -> str:
+        """Apply the length limit and strip() to masked text"""
+        if self.done or not text:
+            return ""
+        
+        truncated = len(text) > self.max_length - self.length
+        if truncated:
+            text = text[:self.max_length - self.length]
+            self.done = True
+        self.length += len(text)
+        
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        if truncated:
+            released = self.whitespace + text + TRUNCATION_MARKER
+            self.whitespace = ""
+            return released
+        
+        text = self.whitespace + text
+        stripped = text.rstrip()
+        self.whitespace = text[len(stripped):]
+        return stripped
+    
+    def feed(self, text: str) -> str:
+        """
+        Add generated text
+        
+        Returns:
+            Sanitized text that can be sent now (possibly "")
+        """
+        if self.done:
+            return ""
+        for tag_filter in self.filters:
+            text = tag_filter.feed(text)
+        if not self.mask_pii:
+            return self._release(text)
+        
+        previous = len(self.pending)
+        self.pending += text
+        cut = self._safe_cut(max(previous - 1, 0))
+        if cut < 0:
+            return ""
+        safe, self.pending = self.pending[:cut], self.pending[cut:]
+        return self._release(_mask_pii(safe))
+    
+    def finish(self) -> str:
+        """
+        End of stream
+        
+        Returns:
+            Remaining sanitized text
+        """
+        text = ""
+        for tag_filter in self.filters:
+            text = tag_filter.feed(text) + tag_filter.finish()
+        text, self.pending = self.pending + text, ""
+        if self.mask_pii:
+            text = _mask_pii(text)
+        released = self._release(text)
+        self.whitespace = ""
+        return released
+
+
+def sanitize_stream(
+    pieces: Iterable[str],
+    max_length: int = 50000,
+    mask_pii: bool = True
+) -> Iterator[str]:
+    """
+    Sanitize a stream of generated text pieces (see StreamingSanitizer)
+    
+    Yields:
+        Non-empty sanitized pieces as soon as they are safe to send
+    """
+    sanitizer = StreamingSanitizer(max_length=max_length, mask_pii=mask_pii)
+    for piece in pieces:
+        released = sanitizer.feed(piece)
+        if released:
+            yield released
+        if sanitizer.done:
+            return
+    released = sanitizer.finish()
+    if released:
+        yield released
+
+
 def create_audit_log_entry(
     tenant_id: str,
     user_id: str,
@@ -177,48 +391,99 @@ def verify_request_signature(
     return hmac.compare_digest(signature, expected_signature)
 
 
+class TokenBucket:
+    """
+    In-process token buckets, one per key
+    
+    Each key holds up to `burst` tokens and refills at rate_per_minute;
+    a request takes `cost` tokens. Checks are O(1), and beyond max_keys
+    the least recently used buckets are dropped (a dropped key starts
+    full again).
+    """
+    
+    def __init__(self, rate_per_minute: float, burst: float = None, max_keys: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst or rate_per_minute
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+    
+    def acquire(self, key: str, cost: float = 1, now: float = None) -> float:
+        """
+        Take `cost` tokens from the key's bucket
+        
+        Returns:
+            0.0 if allowed, else seconds until the tokens are available
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            elif cost > self.burst or not self.rate:
+                wait = float("inf")
+            else:
+                wait = (cost - tokens) / self.rate
+            
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# enforce_rate_limit() state when no cache is passed
+_rate_limit_windows = {}
+_rate_limit_lock = threading.Lock()
+
+
 def enforce_rate_limit(
     tenant_id: str,
     action: str,
     limit_per_minute: int = 60,
-    cache: Dict = None
+    cache: Dict = None,
+    now: float = None
 ) -> bool:
     """
-    Simple in-memory rate limiting (production should use Redis/DynamoDB)
+    In-process sliding-window rate limiting per tenant and action
+    
+    At most limit_per_minute requests are allowed in any 60 seconds.
+    The cache maps each key to the times of its recent requests; expired
+    times are dropped from the front, so a check is amortized O(1) and a
+    key holds at most limit_per_minute times. Limits one process; see
+    rate_limit.check_rate_limit() for the limit shared by all Lambda
+    containers.
     
     Args:
         tenant_id: Tenant identifier
         action: Action being rate limited
         limit_per_minute: Maximum requests per minute
         cache: Optional cache dictionary (for testing)
+        now: Current time in seconds (default time.monotonic())
         
     Returns:
         True if request is allowed, False if rate limit exceeded
     """
-    # This is a simplified example - production should use persistent storage
     if cache is None:
-        # In real implementation, use Redis or DynamoDB
-        return True
-    
+        cache = _rate_limit_windows
+    now = time.monotonic() if now is None else now
     key = f"ratelimit:{tenant_id}:{action}"
-    current_time = datetime.utcnow()
-    
-    if key not in cache:
-        cache[key] = []
-    
-    # Remove entries older than 1 minute
-    cache[key] = [
-        ts for ts in cache[key]
-        if (current_time - ts).total_seconds() < 60
-    ]
-    
-    # Check limit
-    if len(cache[key]) >= limit_per_minute:
-        return False
     
-    # Add new request
-    cache[key].append(current_time)
-    return True
+    with _rate_limit_lock:
+        window = cache.get(key)
+        if window is None:
+            window = cache[key] = deque()
+        
+        # Remove entries older than 1 minute
+        while window and now - window[0] >= 60:
+            window.popleft()
+        
+        if len(window) >= limit_per_minute:
+            return False
+        
+        window.append(now)
+        return True
 
 
 class SecurityContext:
@@ -233,7 +498,8 @@ class SecurityContext:
         self.tenant_id = sanitize_tenant_id(tenant_id)
         self.user_id = user_id
         self.request_id = request_id or self._generate_request_id()
-        self.audit_trail = []
+        # (time, action, metadata); dictionaries are built on read
+        self._trail = []
     
     def _generate_request_id(self) -> str:
         """Generate unique request ID"""
@@ -246,13 +512,36 @@ class SecurityContext:
         action: str,
         metadata: Dict = None
     ):
-        """Log action to audit trail"""
-        entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "action": action,
-            "metadata": metadata or {}
-        }
-        self.audit_trail.append(entry)
+        """
+        Log action to audit trail
+        
+        Per-step actions are kept in memory by default; AUDIT_ACTIONS can
+        drop them ("off") or also send them to the audit sink.
+        """
+        mode = audit_mode(action, AUDIT_STEP_MODE)
+        if mode == "off":
+            return
+        self._trail.append((time.time(), action, metadata))
+        if mode != "trail":
+            record_audit({
+                "timestamp": datetime.utcnow().isoformat(),
+                "tenant_id": self.tenant_id,
+                "user_id": self.user_id,
+                "request_id": self.request_id,
+                "action": action,
+                "metadata": metadata or {}
+            }, mode)
+    
+    @property
+    def audit_trail(self) -> list:
+        return [
+            {
+                "timestamp": datetime.utcfromtimestamp(logged_at).isoformat(),
+                "action": action,
+                "metadata": metadata or {}
+            }
+            for logged_at, action, metadata in self._trail
+        ]
     
     def get_s3_prefix(self) -> str:
         """Get tenant-isolated S3 prefix"""
@@ -268,5 +557,5 @@ class SecurityContext:
             "tenant_id": self.tenant_id,
             "user_id": self.user_id,
             "request_id": self.request_id,
-            "audit_trail_length": len(self.audit_trail)
+            "audit_trail_length": len(self._trail)
         }
@@ -0,0 +1,169 @@
+"""
+Lightweight request tracing
+- Nested spans on the monotonic clock
+- CloudWatch Embedded Metric Format (EMF) output
+- Server-Timing response header
+
+Usage:
+    tracer = Tracer("chat")
+    with tracer.span("embed"):
+        ...
+    headers["Server-Timing"] = tracer.server_timing()
+    tracer.emit_metrics()
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Same namespace as the cost metrics in bedrock_client
+PROJECT_NAME = os.environ.get("PROJECT_NAME", "rag-genai")
+
+TRACE_METRICS_ENABLED = os.environ.get("TRACE_METRICS_ENABLED", "true").lower() == "true"
+
+_METRIC_TOKEN = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+class Span:
+    """One timed stage; `path` includes its parents (e.g. chat.retrieval)"""
+
+    __slots__ = ("name", "path", "depth", "start", "end")
+
+    def __init__(self, name: str, path: str, depth: int, start: float):
+        self.name = name
+        self.path = path
+        self.depth = depth
+        self.start = start
+        self.end = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.monotonic()
+        return (end - self.start) * 1000
+
+    def to_dict(self) -> Dict:
+        return {"name": self.path, "duration_ms": round(self.duration_ms, 3)}
+
+
+class Tracer:
+    """
+    Collects the spans of one request.
+
+    Spans nest per thread: a span opened inside another on the same
+    thread becomes its child. Work on other threads can pass `parent`
+    explicitly.
+    """
+
+    def __init__(self, name: str, dimensions: Dict[str, str] = None):
+        self.name = name
+        self.dimensions = dimensions or {}
+        self.spans: List[Span] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._root = Span(name, name, 0, time.monotonic())
+
+    def _stack(self) -> List[Span]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[str] = None):
+        """
+        Time a stage
+
+        Args:
+            name: Stage name
+            parent: Parent path for spans started on another thread
+        """
+        stack = self._stack()
+        if parent is None:
+            parent = stack[-1].path if stack else self.name
+        span = Span(name, f"{parent}.{name}", parent.count(".") + 1, time.monotonic())
+
+        with self._lock:
+            self.spans.append(span)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = time.monotonic()
+            stack.pop()
+
+    def record(self, name: str, duration_ms: float, parent: Optional[str] = None):
+        """Add a stage measured elsewhere (e.g. by a worker pool)"""
+        parent = parent or self.name
+        end = time.monotonic()
+        span = Span(name, f"{parent}.{name}", parent.count(".") + 1, end - duration_ms / 1000)
+        span.end = end
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self) -> float:
+        """Close the request span; returns total milliseconds"""
+        if self._root.end is None:
+            self._root.end = time.monotonic()
+        return self._root.duration_ms
+
+    def durations(self, max_depth: int = None) -> Dict[str, float]:
+        """
+        Milliseconds per span path; repeated spans are summed
+
+        Args:
+            max_depth: Only include spans nested at most this deep
+        """
+        totals = {self.name: round(self._root.duration_ms, 3)}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            if max_depth is not None and span.depth > max_depth:
+                continue
+            totals[span.path] = round(totals.get(span.path, 0.0) + span.duration_ms, 3)
+        return totals
+
+    def server_timing(self, max_depth: int = 1) -> str:
+        """
+        Server-Timing header value, e.g. "total;dur=120.5, embed;dur=40.1"
+
+        Args:
+            max_depth: Nesting depth of the spans to include
+        """
+        entries = []
+        for path, ms in self.durations(max_depth).items():
+            metric = "total" if path == self.name else path[len(self.name) + 1:]
+            entries.append(f"{_METRIC_TOKEN.sub('_', metric)};dur={ms:.1f}")
+        return ", ".join(entries)
+
+    def to_emf(self, max_depth: int = 2) -> Dict:
+        """
+        CloudWatch Embedded Metric Format record with one metric per span
+        path (milliseconds), dimensioned by handler
+        """
+        durations = self.durations(max_depth)
+        dimensions = {"Handler": self.name, **self.dimensions}
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": PROJECT_NAME,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [
+                        {"Name": f"{path}.latency", "Unit": "Milliseconds"} for path in durations
+                    ]
+                }]
+            },
+            **dimensions
+        }
+        for path, ms in durations.items():
+            record[f"{path}.latency"] = ms
+        return record
+
+    def emit_metrics(self):
+        """Print the EMF record; Lambda ships stdout to CloudWatch Logs"""
+        self.finish()
+        if TRACE_METRICS_ENABLED:
+            print(json.dumps(self.to_emf()))
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Pre-aggregated usage rollups for cost tracking and billing
+- Hourly, daily and monthly totals per tenant, overall and per model,
+  kept with atomic ADD updates as Bedrock calls are logged
+- Usage queries over a time range read one item per period, so a
+  monthly bill is one read instead of a scan over every call
+
+Rollups live in the cost table: tenant_id "usage#<granularity>#<tenant>",
+timestamp = period start (UTC). Each item holds calls, tokens_used and
+estimated_cost, plus the same three per model as "<name>#<model_id>".
+
+Query usage from the command line:
+    python usage.py --tenant tenant-a --start 2026-10-01 --end 2026-10-31
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, List
+
+import boto3
+
+USAGE_GRANULARITIES = ("hour", "day", "month")
+USAGE_METRICS = ("calls", "tokens_used", "estimated_cost")
+USAGE_KEY_PREFIX = "usage#"
+# Hourly rollups expire after this many days (daily and monthly are kept)
+USAGE_HOURLY_RETENTION_DAYS = int(os.environ.get("USAGE_HOURLY_RETENTION_DAYS", "90"))
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(os.environ.get("COST_TABLE"))
+
+# The hourly and daily updates run alongside the monthly one, so
+# recording usage costs one DynamoDB round trip
+_rollup_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def period_start(granularity: str, timestamp: float) -> int:
+    """Start of the hour, day or month (UTC) containing timestamp, epoch seconds"""
+    moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    if granularity == "hour":
+        moment = moment.replace(minute=0, second=0, microsecond=0)
+    elif granularity == "day":
+        moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif granularity == "month":
+        moment = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    else:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    return int(moment.timestamp())
+
+
+def _usage_key(tenant_id: str, granularity: str, start: int) -> Dict:
+    return {"tenant_id": f"{USAGE_KEY_PREFIX}{granularity}#{tenant_id}", "timestamp": start}
+
+
+def _add_usage(tenant_id: str, granularity: str, start: int, model_id: str, tokens_used: int, cost: float) -> Dict:
+    """ADD one call to a rollup item; returns the updated attributes"""
+    increments = {"calls": 1, "tokens_used": tokens_used, "estimated_cost": Decimal(str(cost))}
+    names = {}
+    values = {}
+    additions = []
+    for i, (metric, value) in enumerate(increments.items()):
+        names[f"#total{i}"] = metric
+        names[f"#model{i}"] = f"{metric}#{model_id}"
+        values[f":v{i}"] = value
+        additions += [f"#total{i} :v{i}", f"#model{i} :v{i}"]
+
+    update = "ADD " + ", ".join(additions)
+    if granularity == "hour":
+        update += " SET expires_at = if_not_exists(expires_at, :expires)"
+        values[":expires"] = start + USAGE_HOURLY_RETENTION_DAYS * 86400
+
+    response = table.update_item(
+        Key=_usage_key(tenant_id, granularity, start),
+        UpdateExpression=update,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnValues="UPDATED_NEW"
+    )
+    return response.get("Attributes", {})
+
+
+def record_usage(
+    tenant_id: str,
+    model_id: str,
+    tokens_used: int,
+    cost: float,
+    timestamp: float = None
+) -> Dict:
+    """
+    Add one model call to the tenant's hourly, daily and monthly rollups
+
+    Concurrent calls never overwrite each other: every rollup is an
+    atomic ADD.
+
+    Args:
+        tenant_id: Tenant identifier
+        model_id: Bedrock model ID
+        tokens_used: Tokens billed for the call
+        cost: Estimated cost in USD
+        timestamp: Time of the call (default now)
+
+    Returns:
+        Monthly totals after this call: period (month start), calls,
+        tokens_used and estimated_cost
+    """
+    timestamp = datetime.now(timezone.utc).timestamp() if timestamp is None else timestamp
+    starts = {granularity: period_start(granularity, timestamp) for granularity in USAGE_GRANULARITIES}
+
+    futures = [
+        _rollup_executor.submit(_add_usage, tenant_id, granularity, starts[granularity], model_id, tokens_used, cost)
+        for granularity in ("hour", "day")
+    ]
+    monthly = _add_usage(tenant_id, "month", starts["month"], model_id, tokens_used, cost)
+    for future in futures:
+        future.result()
+
+    return {
+        "period": starts["month"],
+        "calls": int(monthly.get("calls", 0)),
+        "tokens_used": int(monthly.get("tokens_used", 0)),
+        "estimated_cost": float(monthly.get("estimated_cost", 0))
+    }
+
+
+def _parse_item(item: Dict) -> Dict:
+    """Rollup item to {start, calls, tokens_used, estimated_cost, models}"""
+    usage = {"start": int(item["timestamp"])}
+    models = {}
+    for name, value in item.items():
+        metric, _, model_id = name.partition("#")
+        if metric not in USAGE_METRICS:
+            continue
+        value = float(value) if metric == "estimated_cost" else int(value)
+        if model_id:
+            models.setdefault(model_id, {})[metric] = value
+        else:
+            usage[metric] = value
+    for metric in USAGE_METRICS:
+        usage.setdefault(metric, 0)
+    usage["models"] = models
+    return usage
+
+
+def get_usage(tenant_id: str, granularity: str, start: int) -> Dict:
+    """
+    Usage for one period (one GetItem)
+
+    Args:
+        tenant_id: Tenant identifier
+        granularity: "hour", "day" or "month"
+        start: Period start (period_start())
+
+    Returns:
+        Dictionary with start, calls, tokens_used, estimated_cost and
+        per-model totals under models
+    """
+    response = table.get_item(Key=_usage_key(tenant_id, granularity, start))
+    return _parse_item(response.get("Item") or {"timestamp": start})
+
+
+def query_usage(tenant_id: str, start: float, end: float, granularity: str = "day") -> Dict:
+    """
+    Usage over a time range, one rollup item per period
+
+    Args:
+        tenant_id: Tenant identifier
+        start: Range start, epoch seconds (rounded down to a period start)
+        end: Range end, epoch seconds (inclusive)
+        granularity: "hour", "day" or "month"
+
+    Returns:
+        Dictionary with the periods that had usage (oldest first) and
+        totals over the range, overall and per model
+    """
+    key = _usage_key(tenant_id, granularity, period_start(granularity, start))
+    query = {
+        "KeyConditionExpression": "tenant_id = :pk AND #ts BETWEEN :start AND :end",
+        "ExpressionAttributeNames": {"#ts": "timestamp"},
+        "ExpressionAttributeValues": {":pk": key["tenant_id"], ":start": key["timestamp"], ":end": int(end)}
+    }
+
+    items = []
+    while True:
+        response = table.query(**query)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            break
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    periods = [_parse_item(item) for item in items]
+    totals = {metric: sum(period[metric] for period in periods) for metric in USAGE_METRICS}
+    models = {}
+    for period in periods:
+        for model_id, metrics in period["models"].items():
+            model_totals = models.setdefault(model_id, dict.fromkeys(USAGE_METRICS, 0))
+            for metric, value in metrics.items():
+                model_totals[metric] += value
+    # Sum of per-period floats: drop the float noise
+    totals["estimated_cost"] = round(totals["estimated_cost"], 9)
+    for model_totals in models.values():
+        model_totals["estimated_cost"] = round(model_totals["estimated_cost"], 9)
+    totals["models"] = models
+
+    return {
+        "tenant_id": tenant_id,
+        "granularity": granularity,
+        "start": key["timestamp"],
+        "end": int(end),
+        "periods": periods,
+        "totals": totals
+    }
+
+
+def _parse_date(value: str) -> float:
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Query tenant usage rollups")
+    parser.add_argument("--tenant", required=True, help="Tenant ID")
+    parser.add_argument("--start", required=True, help="Start date (YYYY-MM-DD[THH:MM], UTC)")
+    parser.add_argument("--end", required=True, help="End date, inclusive (YYYY-MM-DD[THH:MM], UTC)")
+    parser.add_argument("--granularity", default="day", choices=USAGE_GRANULARITIES)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    end = datetime.fromisoformat(args.end)
+    # A bare end date covers the whole day
+    if len(args.end) == 10:
+        end += timedelta(days=1, seconds=-1)
+    report = query_usage(
+        args.tenant,
+        _parse_date(args.start),
+        end.replace(tzinfo=timezone.utc).timestamp(),
+        args.granularity
+    )
+    print(json.dumps(report, indent=2))
@@ -1,20 +1,39 @@
 import boto3
 import json
+import logging
 import os
+import threading
+import time
 import numpy as np
-from typing import List, Dict, Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterable
+
+logger = logging.getLogger()
 
 s3 = boto3.client("s3")
 VECTOR_BUCKET = os.environ.get("VECTOR_BUCKET")
 
+# Concurrent PUTs per store_vectors() batch (S3 has no batch PUT)
+VECTOR_WRITE_CONCURRENCY = int(os.environ.get("VECTOR_WRITE_CONCURRENCY", "8"))
+
+# Tenant indexes are cached per container. The cache is revalidated with
+# one LIST of the tenant prefix, at most every INDEX_CACHE_TTL seconds
+# (0 = on every lookup); only new or changed vectors are fetched.
+INDEX_CACHE_TTL = float(os.environ.get("INDEX_CACHE_TTL", "0"))
+INDEX_LOAD_CONCURRENCY = int(os.environ.get("INDEX_LOAD_CONCURRENCY", "16"))
+
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+
 
-def store_vector(doc_id: str, chunk_id: int, vector: list, metadata: dict):
+def store_vector(doc_id: str, chunk_id, vector: list, metadata: dict):
     """
     Store vector embedding with metadata
     
     Args:
         doc_id: Document identifier
-        chunk_id: Chunk index
+        chunk_id: Chunk identifier (index or content hash)
         vector: Embedding vector
         metadata: Additional metadata (must include tenant_id)
     """
@@ -38,6 +57,152 @@ def store_vector(doc_id: str, chunk_id: int, vector: list, metadata: dict):
     )
 
 
+def store_vectors(vectors: List[Dict]):
+    """
+    Store a batch of vectors with concurrent writes
+    
+    Args:
+        vectors: Dictionaries with store_vector() arguments
+            (doc_id, chunk_id, vector, metadata)
+    """
+    if len(vectors) <= 1:
+        for v in vectors:
+            store_vector(**v)
+        return
+    
+    with ThreadPoolExecutor(max_workers=min(VECTOR_WRITE_CONCURRENCY, len(vectors))) as executor:
+        # list() re-raises the first failed write
+        list(executor.map(lambda v: store_vector(**v), vectors))
+
+
+def _manifest_key(tenant_id: str, doc_id: str) -> str:
+    return f"{tenant_id}/manifests/{doc_id}.json"
+
+
+def load_manifest(tenant_id: str, doc_id: str) -> Optional[Dict]:
+    """
+    Load the chunk manifest of a previously ingested document
+    
+    Args:
+        tenant_id: Tenant identifier
+        doc_id: Document identifier
+        
+    Returns:
+        Manifest dictionary, or None if the document was never ingested
+    """
+    try:
+        response = s3.get_object(Bucket=VECTOR_BUCKET, Key=_manifest_key(tenant_id, doc_id))
+    except s3.exceptions.NoSuchKey:
+        return None
+    
+    return json.loads(response["Body"].read().decode("utf-8"))
+
+
+def save_manifest(tenant_id: str, doc_id: str, manifest: Dict):
+    """
+    Store the chunk manifest of a document
+    
+    Args:
+        tenant_id: Tenant identifier
+        doc_id: Document identifier
+        manifest: Manifest dictionary (chunk content hashes in document order)
+    """
+    s3.put_object(
+        Bucket=VECTOR_BUCKET,
+        Key=_manifest_key(tenant_id, doc_id),
+        Body=json.dumps(manifest),
+        ContentType="application/json"
+    )
+
+
+def _session_key(tenant_id: str, user_id: str, session_id: str) -> str:
+    return f"{tenant_id}/sessions/{user_id}/{session_id}.json"
+
+
+def load_session(tenant_id: str, user_id: str, session_id: str) -> Optional[Dict]:
+    """
+    Load a stored conversation session
+
+    Args:
+        tenant_id: Tenant identifier
+        user_id: Sanitized user identifier
+        session_id: Session identifier
+
+    Returns:
+        Session dictionary, or None for a new session
+    """
+    try:
+        response = s3.get_object(Bucket=VECTOR_BUCKET, Key=_session_key(tenant_id, user_id, session_id))
+    except s3.exceptions.NoSuchKey:
+        return None
+
+    return json.loads(response["Body"].read().decode("utf-8"))
+
+
+def save_session(tenant_id: str, user_id: str, session_id: str, session: Dict):
+    """
+    Store a conversation session
+
+    Args:
+        tenant_id: Tenant identifier
+        user_id: Sanitized user identifier
+        session_id: Session identifier
+        session: Session dictionary (see conversation.py)
+    """
+    s3.put_object(
+        Bucket=VECTOR_BUCKET,
+        Key=_session_key(tenant_id, user_id, session_id),
+        Body=json.dumps(session),
+        ContentType="application/json"
+    )
+
+
+def list_vector_ids(tenant_id: str, doc_id: str) -> List[str]:
+    """
+    List chunk identifiers stored for a document
+    
+    Args:
+        tenant_id: Tenant identifier
+        doc_id: Document identifier
+        
+    Returns:
+        Chunk identifiers (S3 object names without the .json suffix)
+    """
+    prefix = f"{tenant_id}/vectors/{doc_id}/"
+    paginator = s3.get_paginator('list_objects_v2')
+    
+    chunk_ids = []
+    for page in paginator.paginate(Bucket=VECTOR_BUCKET, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            name = obj['Key'][len(prefix):]
+            if name.endswith('.json') and '/' not in name:
+                chunk_ids.append(name[:-len('.json')])
+    
+    return chunk_ids
+
+
+def delete_vectors(tenant_id: str, doc_id: str, chunk_ids: Iterable[str]):
+    """
+    Delete stored vectors of a document
+    
+    Args:
+        tenant_id: Tenant identifier
+        doc_id: Document identifier
+        chunk_ids: Chunk identifiers to delete
+    """
+    keys = [
+        {"Key": f"{tenant_id}/vectors/{doc_id}/{chunk_id}.json"}
+        for chunk_id in chunk_ids
+    ]
+    
+    # DeleteObjects accepts at most 1000 keys per request
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=VECTOR_BUCKET,
+            Delete={"Objects": keys[i:i + 1000], "Quiet": True}
+        )
+
+
 def cosine_similarity(vec1: list, vec2: list) -> float:
     """
     Calculate cosine similarity between two vectors
@@ -62,6 +227,194 @@ def cosine_similarity(vec1: list, vec2: list) -> float:
     return float(dot_product / (norm_v1 * norm_v2))
 
 
+class VectorIndex:
+    """
+    In-memory index of a tenant's vectors.
+
+    Vectors are stacked into one L2-normalized matrix so a query is scored
+    against every chunk with a single matrix-vector product. Vectors whose
+    dimension differs from the most common one (e.g. left over from an
+    earlier embedding model) are skipped.
+    """
+
+    def __init__(self, tenant_id: str, records: Dict[str, Dict]):
+        """
+        Args:
+            tenant_id: Tenant identifier
+            records: S3 key -> {"etag", "vector", "metadata", "chunk_id", "doc_id"}
+        """
+        self.tenant_id = tenant_id
+        self.records = records
+        self.loaded_at = time.monotonic()
+        
+        dimensions = Counter(len(record["vector"]) for record in records.values())
+        dimension = dimensions.most_common(1)[0][0] if dimensions else 0
+        self.keys = [k for k in records if len(records[k]["vector"]) == dimension]
+        skipped = len(records) - len(self.keys)
+        if skipped:
+            logger.warning(
+                f"Skipped {skipped} vector(s) for tenant {tenant_id} "
+                f"not matching dimension {dimension}"
+            )
+        
+        if self.keys:
+            matrix = np.array([records[k]["vector"] for k in self.keys], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.matrix = matrix / norms
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+    
+    def __len__(self) -> int:
+        return len(self.keys)
+    
+    def scores(self, query_vector: list) -> np.ndarray:
+        """Cosine similarity of the query against every stored vector"""
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not len(self.keys) or norm == 0 or query.shape[0] != self.matrix.shape[1]:
+            return np.zeros(len(self.keys), dtype=np.float32)
+        return self.matrix @ (query / norm)
+    
+    def scores_many(self, query_vectors: List[list]) -> np.ndarray:
+        """
+        Cosine similarity of several queries in one matrix product
+        
+        Returns:
+            Array of shape (len(query_vectors), len(index))
+        """
+        if not query_vectors:
+            return np.zeros((0, len(self.keys)), dtype=np.float32)
+        
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        if not len(self.keys) or queries.ndim != 2 or queries.shape[1] != self.matrix.shape[1]:
+            return np.zeros((len(query_vectors), len(self.keys)), dtype=np.float32)
+        
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (queries / norms) @ self.matrix.T
+    
+    def search_many(self, query_vectors: List[list], top_k: int = 5, min_similarity: float = 0.5) -> List[List[Dict]]:
+        """Retrieve the most similar chunks for each query, in query order"""
+        return [self.results(row, top_k, min_similarity) for row in self.scores_many(query_vectors)]
+    
+    def results(self, scores: np.ndarray, top_k: int = 5, min_similarity: float = 0.5) -> List[Dict]:
+        """Top-k records for precomputed scores, best first"""
+        if not len(scores):
+            return []
+        
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        
+        results = []
+        for i in top:
+            if scores[i] < min_similarity:
+                break
+            record = self.records[self.keys[i]]
+            results.append({
+                'similarity': float(scores[i]),
+                'text': record['metadata'].get('text', ''),
+                'metadata': record['metadata'],
+                'chunk_id': record['chunk_id'],
+                'doc_id': record['doc_id']
+            })
+        return results
+    
+    def search(self, query_vector: list, top_k: int = 5, min_similarity: float = 0.5) -> List[Dict]:
+        """
+        Retrieve the most similar chunks
+        
+        Args:
+            query_vector: Query embedding vector
+            top_k: Number of top results to return
+            min_similarity: Minimum similarity threshold
+            
+        Returns:
+            List of similar chunks with metadata, best first
+        """
+        return self.results(self.scores(query_vector), top_k, min_similarity)
+
+
+def _list_vector_objects(tenant_id: str) -> Dict[str, str]:
+    """S3 key -> ETag of every stored vector of a tenant"""
+    paginator = s3.get_paginator('list_objects_v2')
+    objects = {}
+    for page in paginator.paginate(Bucket=VECTOR_BUCKET, Prefix=f"{tenant_id}/vectors/"):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.json'):
+                objects[obj['Key']] = obj.get('ETag', '')
+    return objects
+
+
+def _load_vector_record(key: str, etag: str) -> Optional[Dict]:
+    try:
+        response = s3.get_object(Bucket=VECTOR_BUCKET, Key=key)
+        data = json.loads(response['Body'].read().decode('utf-8'))
+    except Exception:
+        # Skip files that can't be processed
+        return None
+    
+    if not data.get('vector'):
+        return None
+    
+    return {
+        "etag": etag,
+        "vector": data['vector'],
+        "metadata": data.get('metadata', {}),
+        "chunk_id": data.get('chunk_id'),
+        "doc_id": data.get('doc_id')
+    }
+
+
+def load_index(tenant_id: str) -> VectorIndex:
+    """
+    Load a tenant's vector index, reusing the cached copy when valid
+    
+    The tenant prefix is listed and compared with the cached ETags; only
+    vectors that were added or changed since are downloaded.
+    
+    Args:
+        tenant_id: Tenant identifier
+        
+    Returns:
+        VectorIndex of the tenant's current vectors
+    """
+    with _index_cache_lock:
+        cached = _index_cache.get(tenant_id)
+    
+    if cached is not None and INDEX_CACHE_TTL > 0 and time.monotonic() - cached.loaded_at < INDEX_CACHE_TTL:
+        return cached
+    
+    objects = _list_vector_objects(tenant_id)
+    previous = cached.records if cached is not None else {}
+    
+    if cached is not None and len(previous) == len(objects) and all(
+        previous.get(key, {}).get("etag") == etag for key, etag in objects.items()
+    ):
+        cached.loaded_at = time.monotonic()
+        return cached
+    
+    records = {
+        key: previous[key] for key, etag in objects.items()
+        if key in previous and previous[key]["etag"] == etag
+    }
+    missing = [(key, etag) for key, etag in objects.items() if key not in records]
+    
+    if missing:
+        workers = max(1, min(INDEX_LOAD_CONCURRENCY, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            loaded = executor.map(lambda item: _load_vector_record(*item), missing)
+            for (key, _), record in zip(missing, loaded):
+                if record is not None:
+                    records[key] = record
+    
+    index = VectorIndex(tenant_id, records)
+    with _index_cache_lock:
+        _index_cache[tenant_id] = index
+    return index
+
+
 def retrieve_similar(
     query_vector: list, 
     top_k: int = 5,
@@ -80,52 +433,8 @@ def retrieve_similar(
     Returns:
         List of similar chunks with metadata
     """
-    # List all vector files for this tenant
-    prefix = f"{tenant_id}/vectors/"
-    
     try:
-        paginator = s3.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=VECTOR_BUCKET, Prefix=prefix)
-        
-        similarities = []
-        
-        for page in pages:
-            if 'Contents' not in page:
-                continue
-            
-            for obj in page['Contents']:
-                if not obj['Key'].endswith('.json'):
-                    continue
-                
-                # Get vector file
-                try:
-                    response = s3.get_object(Bucket=VECTOR_BUCKET, Key=obj['Key'])
-                    data = json.loads(response['Body'].read().decode('utf-8'))
-                    
-                    # Calculate similarity
-                    vector = data.get('vector', [])
-                    if not vector:
-                        continue
-                    
-                    similarity = cosine_similarity(query_vector, vector)
-                    
-                    if similarity >= min_similarity:
-                        similarities.append({
-                            'similarity': similarity,
-                            'text': data.get('metadata', {}).get('text', ''),
-                            'metadata': data.get('metadata', {}),
-                            'chunk_id': data.get('chunk_id'),
-                            'doc_id': data.get('doc_id')
-                        })
-                
-                except Exception as e:
-                    # Skip files that can't be processed
-                    continue
-        
-        # Sort by similarity (descending) and return top k
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        return similarities[:top_k]
+        return load_index(tenant_id).search(query_vector, top_k, min_similarity)
     
     except Exception as e:
         # If retrieval fails, return empty list